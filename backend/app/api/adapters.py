@@ -0,0 +1,36 @@
+"""
+LoRA adapter endpoints
+"""
+
+from fastapi import APIRouter, HTTPException, Depends
+import logging
+
+from app.core.model_backend import ModelBackend
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+def get_model_manager() -> ModelBackend:
+    from app.main import model_manager
+    return model_manager
+
+
+@router.get("")
+async def list_adapters(
+    model_manager: ModelBackend = Depends(get_model_manager)
+):
+    """Adaptadores disponibles en disco, residentes en memoria y activo"""
+    return model_manager.list_adapters()
+
+
+@router.delete("/{name}")
+async def unload_adapter(
+    name: str,
+    model_manager: ModelBackend = Depends(get_model_manager)
+):
+    """Libera un adaptador de memoria sin reiniciar el servidor"""
+    if not model_manager.unload_adapter(name):
+        raise HTTPException(status_code=404, detail="Adaptador no residente")
+    return {"unloaded": name}
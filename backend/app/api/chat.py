@@ -3,20 +3,32 @@ Chat API endpoints
 """
 
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List, Dict
+from copy import copy
+from functools import lru_cache
+from typing import Optional, List, Dict, AsyncIterator
+import json
 import logging
+import time
 
-from app.core.model_manager_mlx import ModelManagerMLX
-from app.core.session_manager import SessionManager
-from app.core.guardrails import GuardrailsEngine, RiskLevel
+from app.core.batch_scheduler import GenerationRequest, GenerationResult
+from app.core.model_backend import ModelBackend
+from app.core.session_manager import Message, MessageTooLongError, RenderedPrompt, SessionManager
+from app.core.guardrails import GuardrailResult, GuardrailsEngine, RiskLevel, RiskTrajectory
+from app.core.inference_worker import InferenceWorker, InferenceStream, QueueFullError
+from app.core.lora_adapters import AdapterError
+from app.core.metrics import metrics
+from app.core.summarizer import ConversationSummarizer
+from app.core.text_normalization import NormalizedText, normalize_text
+from app.core.tracing import record_timings, span
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 # Dependencias (se inyectarán desde main.py)
-def get_model_manager() -> ModelManagerMLX:
+def get_model_manager() -> ModelBackend:
     from app.main import model_manager
     return model_manager
 
@@ -24,6 +36,35 @@ def get_session_manager() -> SessionManager:
     from app.main import session_manager
     return session_manager
 
+def get_inference_worker() -> InferenceWorker:
+    from app.main import inference_worker
+    return inference_worker
+
+def get_summarizer() -> Optional[ConversationSummarizer]:
+    from app.main import summarizer
+    return summarizer
+
+def get_guardrails() -> GuardrailsEngine:
+    from app.main import guardrails
+    return guardrails if guardrails is not None else _default_guardrails()
+
+
+@lru_cache(maxsize=1)
+def _default_guardrails() -> GuardrailsEngine:
+    """Motor compartido si la app corre sin lifespan (p.ej. TestClient sin contexto)"""
+    from app.config import settings
+    return GuardrailsEngine(settings)
+
+
+def _queue_full_exception(error: QueueFullError) -> HTTPException:
+    """503 inmediato con Retry-After cuando la cola de inferencia está llena"""
+    logger.warning("⏳ Cola de inferencia llena, rechazando petición")
+    return HTTPException(
+        status_code=503,
+        detail="Servidor ocupado, intenta de nuevo en unos segundos",
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
 
 class ChatRequest(BaseModel):
     """Request para chat"""
@@ -39,30 +80,46 @@ class ChatResponse(BaseModel):
     risk_level: str
     is_crisis: bool
     emergency_response: Optional[str] = None
+    prompt_tokens: Optional[int] = None
 
 
 @router.post("/message", response_model=ChatResponse)
 async def send_message(
     request: ChatRequest,
-    model_manager: ModelManagerMLX = Depends(get_model_manager),
-    session_manager: SessionManager = Depends(get_session_manager)
+    model_manager: ModelBackend = Depends(get_model_manager),
+    session_manager: SessionManager = Depends(get_session_manager),
+    inference_worker: InferenceWorker = Depends(get_inference_worker),
+    summarizer: Optional[ConversationSummarizer] = Depends(get_summarizer),
+    guardrails: GuardrailsEngine = Depends(get_guardrails)
 ):
     """
     Envía mensaje y obtiene respuesta del asistente
     """
     try:
+        # Rechazo rápido antes de tocar la sesión
+        inference_worker.check_capacity()
+        
         # Crear o recuperar sesión
-        session_id = request.session_id
-        if not session_id or not session_manager.get_session(session_id):
-            session_id = session_manager.create_session()
-            logger.info(f"🆕 Nueva sesión creada: {session_id}")
+        with span("session"):
+            session_id = request.session_id
+            if not session_id or not session_manager.get_session(session_id):
+                session_id = session_manager.create_session()
+                logger.info(f"🆕 Nueva sesión creada: {session_id}")
+            
+            # Adaptador LoRA: metadata de la petición o el de la sesión
+            adapter = session_manager.select_adapter(
+                session_id, request.metadata, validate=model_manager.check_adapter
+            )
         
-        # Inicializar guardrails
         from app.config import settings
-        guardrails = GuardrailsEngine(settings)
         
-        # PRE-FILTRO: Detectar crisis en input
-        input_check = guardrails.check_input(request.message)
+        # Texto normalizado una vez: lo usan los guardrails y lo guarda la sesión
+        normalized = normalize_text(request.message)
+        
+        # PRE-FILTRO: Detectar crisis en input (y en la trayectoria de la sesión)
+        trajectory = session_manager.get_risk(session_id)
+        risk_before = copy(trajectory)
+        input_check = _check_input(guardrails, request.message, trajectory, normalized)
         
         # Si es crisis crítica, retornar respuesta de emergencia
         if input_check.should_terminate:
@@ -76,7 +133,8 @@ async def send_message(
                 session_id,
                 "user",
                 request.message,
-                {"risk_level": input_check.risk_level.value}
+                {"risk_level": input_check.risk_level.value},
+                normalized=normalized
             )
             session_manager.add_message(
                 session_id,
@@ -94,22 +152,37 @@ async def send_message(
             )
         
         # Añadir mensaje del usuario
-        session_manager.add_message(
+        user_message = session_manager.add_message(
             session_id,
             "user",
             request.message,
-            request.metadata
+            request.metadata,
+            normalized=normalized
         )
         
-        # Obtener mensajes formateados
-        messages = session_manager.get_conversation_history(session_id)
-        
-        # Generar respuesta
-        logger.info(f"🤖 Generando respuesta para sesión {session_id}")
-        response = model_manager.generate_chat(messages)
+        try:
+            # Prompt dentro del presupuesto de tokens (reserva MAX_TOKENS),
+            # tokenizado de forma incremental por la sesión
+            session_manager.check_message_fits(session_id, user_message, settings.MAX_TOKENS)
+            prompt = _render_prompt(session_manager, session_id, settings)
+            
+            # Generar respuesta
+            logger.info(f"🤖 Generando respuesta para sesión {session_id}")
+            generation = _generation_request(model_manager, prompt, session_id, adapter, settings, guardrails)
+            stream = inference_worker.submit_generation(generation)
+            try:
+                response = await stream.read_all()
+            finally:
+                stream.cancel()
+        except Exception:
+            # Mensaje demasiado largo, cola llena o fallo de generación: sin
+            # respuesta, el reintento del cliente no debe encontrar el turno ya en el historial
+            session_manager.discard_message(session_id, user_message, risk_before)
+            raise
+        record_timings(generation.timings)
         
-        # POST-FILTRO: Validar respuesta
-        is_valid, violated_rules = guardrails.check_output(response)
+        # POST-FILTRO: Validar respuesta (si no se cortó ya durante la generación)
+        is_valid, violated_rules = _check_output(guardrails, response, stream.result)
         
         if not is_valid:
             logger.warning(
@@ -124,6 +197,10 @@ async def send_message(
             response
         )
         
+        # Resumen en segundo plano si la sesión ya es larga
+        if summarizer:
+            summarizer.schedule(session_id)
+        
         # Limpiar sesiones expiradas (background)
         session_manager.cleanup_expired_sessions()
         
@@ -131,14 +208,273 @@ async def send_message(
             session_id=session_id,
             response=response,
             risk_level=input_check.risk_level.value,
-            is_crisis=False
+            is_crisis=False,
+            prompt_tokens=prompt.prompt_tokens
         )
         
+    except QueueFullError as e:
+        raise _queue_full_exception(e)
+    except MessageTooLongError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except AdapterError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"❌ Error en chat: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _check_input(
+    guardrails: GuardrailsEngine,
+    text: str,
+    trajectory: Optional[RiskTrajectory] = None,
+    normalized: Optional[NormalizedText] = None
+) -> GuardrailResult:
+    """Pre-filtro con su tiempo y resultado en métricas; acumula el riesgo de la sesión"""
+    start = time.perf_counter()
+    result = guardrails.check_input(text, normalized)
+    if trajectory is not None:
+        result = guardrails.check_trajectory(trajectory, result)
+    metrics.observe_input_check(
+        time.perf_counter() - start, result.risk_level.value, result.triggered_rules
+    )
+    return result
+
+
+def _check_output(
+    guardrails: GuardrailsEngine,
+    response: str,
+    result: Optional[GenerationResult] = None
+):
+    """
+    Post-filtro con su tiempo y reglas violadas en métricas
+
+    Si el filtro incremental ya cortó la generación se usan sus reglas sin
+    volver a revisar el texto.
+    """
+    start = time.perf_counter()
+    if result is not None and result.finish_reason == "filtered":
+        is_valid, violated_rules = False, result.violated_rules
+    else:
+        is_valid, violated_rules = guardrails.check_output(response)
+    metrics.observe_output_check(time.perf_counter() - start, violated_rules)
+    return is_valid, violated_rules
+
+
+def _render_prompt(session_manager: SessionManager, session_id: str, settings) -> RenderedPrompt:
+    """Prompt incremental de la sesión; registra su coste en tokens"""
+    prompt = session_manager.render_prompt(session_id, max_new_tokens=settings.MAX_TOKENS)
+    logger.info(
+        f"📏 Prompt de {prompt.prompt_tokens}/{prompt.budget} tokens "
+        f"({prompt.dropped} mensajes resumidos{', reconstruido' if prompt.rebuilt else ''})"
+    )
+    return prompt
+
+
+def _generation_request(
+    model_manager: ModelBackend,
+    prompt: RenderedPrompt,
+    session_id: str,
+    adapter: Optional[str],
+    settings,
+    guardrails: Optional[GuardrailsEngine] = None
+) -> GenerationRequest:
+    """
+    Petición de generación; tokeniza el texto solo si la sesión no trae token ids
+
+    Con ENABLE_STREAMING_GUARD el post-filtro revisa cada fragmento en el
+    hilo de inferencia y la decodificación se corta en la primera violación.
+    """
+    tokens = prompt.tokens
+    if tokens is None:
+        with span("tokenize"):
+            tokens = model_manager.encode(prompt.text)
+    output_filter = None
+    if guardrails is not None and settings.ENABLE_STREAMING_GUARD:
+        output_filter = guardrails.stream_output_filter().feed
+    return model_manager.build_request(
+        tokens,
+        max_tokens=settings.MAX_TOKENS,
+        session_id=session_id,
+        adapter=adapter,
+        output_filter=output_filter
+    )
+
+
+def _sse_event(event: str, data: Dict) -> str:
+    """Serializa un evento Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/message/stream")
+async def send_message_stream(
+    request: ChatRequest,
+    model_manager: ModelBackend = Depends(get_model_manager),
+    session_manager: SessionManager = Depends(get_session_manager),
+    inference_worker: InferenceWorker = Depends(get_inference_worker),
+    summarizer: Optional[ConversationSummarizer] = Depends(get_summarizer),
+    guardrails: GuardrailsEngine = Depends(get_guardrails)
+):
+    """
+    Envía mensaje y recibe la respuesta token a token (Server-Sent Events)
+    
+    Eventos emitidos:
+        start: {"session_id"}
+        token: {"delta"} por cada fragmento generado
+        done: {"session_id", "response", "risk_level", "is_crisis",
+               "emergency_response", "filtered", "prompt_tokens"}
+        error: {"detail"} si la generación falla a mitad del stream
+    """
+    # Rechazo rápido antes de tocar la sesión
+    try:
+        inference_worker.check_capacity()
+    except QueueFullError as e:
+        raise _queue_full_exception(e)
+    
+    # Crear o recuperar sesión
+    with span("session"):
+        session_id = request.session_id
+        if not session_id or not session_manager.get_session(session_id):
+            session_id = session_manager.create_session()
+            logger.info(f"🆕 Nueva sesión creada: {session_id}")
+        
+        # Adaptador LoRA: metadata de la petición o el de la sesión
+        try:
+            adapter = session_manager.select_adapter(
+                session_id, request.metadata, validate=model_manager.check_adapter
+            )
+        except AdapterError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    from app.config import settings
+    
+    # Texto normalizado una vez: lo usan los guardrails y lo guarda la sesión
+    normalized = normalize_text(request.message)
+    
+    # PRE-FILTRO: Detectar crisis en input (y en la trayectoria de la sesión)
+    trajectory = session_manager.get_risk(session_id)
+    risk_before = copy(trajectory)
+    input_check = _check_input(guardrails, request.message, trajectory, normalized)
+    
+    async def crisis_events() -> AsyncIterator[str]:
+        logger.warning(
+            f"🚨 CRISIS DETECTADA en sesión {session_id}: "
+            f"{input_check.triggered_rules}"
+        )
+        session_manager.add_message(
+            session_id,
+            "user",
+            request.message,
+            {"risk_level": input_check.risk_level.value},
+            normalized=normalized
+        )
+        session_manager.add_message(
+            session_id,
+            "assistant",
+            input_check.emergency_response,
+            {"is_emergency": True}
+        )
+        yield _sse_event("start", {"session_id": session_id})
+        yield _sse_event("done", {
+            "session_id": session_id,
+            "response": input_check.emergency_response,
+            "risk_level": input_check.risk_level.value,
+            "is_crisis": True,
+            "emergency_response": input_check.emergency_response,
+            "filtered": False,
+            "prompt_tokens": None
+        })
+    
+    async def generation_events(
+        stream: InferenceStream,
+        prompt: RenderedPrompt,
+        user_message: Message
+    ) -> AsyncIterator[str]:
+        yield _sse_event("start", {"session_id": session_id})
+        
+        chunks = []
+        completed = False
+        try:
+            async for delta in stream:
+                chunks.append(delta)
+                yield _sse_event("token", {"delta": delta})
+            completed = True
+        except Exception as e:
+            logger.error(f"❌ Error en chat stream: {e}", exc_info=True)
+            yield _sse_event("error", {"detail": str(e)})
+        finally:
+            # Cliente desconectado o error: liberar el hilo de inferencia
+            # y retirar el turno que se queda sin respuesta
+            stream.cancel()
+            if not completed:
+                session_manager.discard_message(session_id, user_message, risk_before)
+        if not completed:
+            return
+        
+        response = "".join(chunks).strip()
+        
+        # POST-FILTRO: los tokens ya se enviaron, el cliente reemplaza
+        # el texto mostrado si el evento final viene con filtered=True.
+        # Con el filtro incremental la generación ya se cortó en la violación
+        is_valid, violated_rules = _check_output(guardrails, response, stream.result)
+        if not is_valid:
+            logger.warning(
+                f"⚠️  Respuesta inválida, usando fallback: {violated_rules}"
+            )
+            response = guardrails.get_fallback_response()
+        
+        session_manager.add_message(
+            session_id,
+            "assistant",
+            response
+        )
+        if summarizer:
+            summarizer.schedule(session_id)
+        session_manager.cleanup_expired_sessions()
+        
+        yield _sse_event("done", {
+            "session_id": session_id,
+            "response": response,
+            "risk_level": input_check.risk_level.value,
+            "is_crisis": False,
+            "emergency_response": None,
+            "filtered": not is_valid,
+            "prompt_tokens": prompt.prompt_tokens
+        })
+    
+    if input_check.should_terminate:
+        events = crisis_events()
+    else:
+        user_message = session_manager.add_message(
+            session_id,
+            "user",
+            request.message,
+            request.metadata,
+            normalized=normalized
+        )
+        
+        logger.info(f"🤖 Generando respuesta (stream) para sesión {session_id}")
+        try:
+            session_manager.check_message_fits(session_id, user_message, settings.MAX_TOKENS)
+            prompt = _render_prompt(session_manager, session_id, settings)
+            stream = inference_worker.submit_generation(
+                _generation_request(model_manager, prompt, session_id, adapter, settings, guardrails)
+            )
+        except Exception as e:
+            session_manager.discard_message(session_id, user_message, risk_before)
+            if isinstance(e, QueueFullError):
+                raise _queue_full_exception(e)
+            if isinstance(e, MessageTooLongError):
+                raise HTTPException(status_code=413, detail=str(e))
+            raise
+        events = generation_events(stream, prompt, user_message)
+    
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.get("/sessions/{session_id}/history")
 async def get_history(
     session_id: str,
@@ -150,7 +486,12 @@ async def get_history(
     if not history:
         raise HTTPException(status_code=404, detail="Sesión no encontrada")
     
-    return {"session_id": session_id, "messages": history}
+    risk = session_manager.get_risk(session_id)
+    return {
+        "session_id": session_id,
+        "messages": history,
+        "risk": risk.to_dict() if risk else None
+    }
 
 
 @router.post("/sessions")
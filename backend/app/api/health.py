@@ -5,6 +5,7 @@ Health check endpoints
 from fastapi import APIRouter
 from pydantic import BaseModel
 from datetime import datetime
+from typing import Optional
 import logging
 
 logger = logging.getLogger(__name__)
@@ -18,30 +19,39 @@ class HealthResponse(BaseModel):
     timestamp: str
     model_loaded: bool
     version: str
+    guardrails_version: Optional[str] = None
 
 
 @router.get("/health", response_model=HealthResponse)
 async def health_check():
     """Health check endpoint"""
-    from app.main import model_manager
+    from app.main import model_manager, guardrail_rules
     
     return HealthResponse(
         status="healthy",
         timestamp=datetime.now().isoformat(),
-        model_loaded=model_manager.model is not None if model_manager else False,
-        version="0.1.0"
+        model_loaded=model_manager.is_loaded if model_manager else False,
+        version="0.1.0",
+        guardrails_version=guardrail_rules.current().version if guardrail_rules else None
     )
 
 
 @router.get("/metrics")
 async def metrics():
     """Métricas básicas (sin PII)"""
-    from app.main import session_manager
+    from app.main import model_manager, session_manager, inference_worker, summarizer, guardrail_rules
+    from app.core.metrics import metrics as prometheus
     
     if not session_manager:
         return {"error": "Session manager no inicializado"}
     
     return {
         "active_sessions": len(session_manager.sessions),
+        "context": session_manager.get_stats(),
+        "inference": inference_worker.get_stats() if inference_worker else None,
+        "summaries": summarizer.get_stats() if summarizer else None,
+        "prometheus": {"enabled": prometheus.enabled, "port": prometheus.port},
+        "guardrails": guardrail_rules.get_stats() if guardrail_rules else None,
+        "model": model_manager.get_model_info() if model_manager else None,
         "timestamp": datetime.now().isoformat()
     }
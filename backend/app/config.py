@@ -19,21 +19,54 @@ class Settings(BaseSettings):
     # Modelo
     MODEL_NAME: str = "Qwen/Qwen2.5-7B-Instruct"
     MODEL_PATH: str = "./models/qwen2.5-7b"
-    LORA_PATH: str = "./models/lora_adapters"
+    LORA_PATH: str = "./models/lora_adapters"  # Un subdirectorio por adaptador
+    MAX_RESIDENT_ADAPTERS: int = 4  # Adaptadores LoRA en memoria (LRU)
     QUANTIZATION: str = "4bit"  # 4bit, 8bit, none
     MAX_TOKENS: int = 256
     TEMPERATURE: float = 0.7
     TOP_P: float = 0.9
     USE_MLX: bool = True  # Usar MLX en Apple Silicon
+    MODEL_BACKEND: str = "auto"  # auto, mlx, llamacpp, stub
+    GGUF_MODEL_PATH: str = "./models/qwen2.5-7b-gguf"  # Fichero .gguf o directorio (llamacpp)
+    LLAMA_N_THREADS: int = 0  # Hilos de CPU para llama.cpp (0 = automático)
+    DRAFT_MODEL_PATH: str = ""  # Modelo borrador MLX (vacío = sin decodificación especulativa)
+    NUM_DRAFT_TOKENS: int = 3  # Tokens propuestos por el borrador en cada paso
+    STUB_TOKEN_DELAY_MS: float = 0.0  # Retardo por paso del backend stub (pruebas de carga)
+    
+    # Inferencia (hilo dedicado + cola acotada)
+    INFERENCE_QUEUE_SIZE: int = 8  # Trabajos en espera antes de rechazar
+    INFERENCE_RETRY_AFTER: int = 5  # Segundos sugeridos al cliente (Retry-After)
+    MAX_BATCH_SIZE: int = 8  # Secuencias decodificadas a la vez (batching continuo)
+    PROMPT_CACHE_MAX_MB: int = 1024  # Presupuesto del KV-cache por sesión (LRU)
     
     # Sesión
     MAX_CONTEXT_LENGTH: int = 4096
     SUMMARY_TRIGGER: int = 10  # Mensajes antes de resumir
+    ENABLE_MODEL_SUMMARY: bool = True  # Resumen con el modelo en segundo plano
+    SUMMARY_KEEP_RECENT: int = 4  # Mensajes recientes que nunca se resumen
+    SUMMARY_MAX_TOKENS: int = 192  # Longitud máxima del resumen generado
     SESSION_TIMEOUT: int = 3600  # Segundos
+    SESSION_STORE: str = "memory"  # memory (sin persistencia) | sqlite
+    SESSION_DB_PATH: str = "./data/sessions/sessions.db"  # Base SQLite (WAL) si SESSION_STORE=sqlite
+    SESSION_LOAD_WINDOW: int = 40  # Mensajes recientes que se cargan al recuperar una sesión
+    SESSION_STORE_FLUSH_MS: float = 50.0  # Escrituras agrupadas por commit (write-behind)
+    SESSION_STORE_BATCH: int = 512  # Operaciones máximas por commit
     
     # Guardrails
     ENABLE_CRISIS_DETECTION: bool = True
-    RISK_THRESHOLD: float = 0.75
+    RISK_THRESHOLD: float = 0.75  # Probabilidad del clasificador que eleva el riesgo a HIGH
+    ENABLE_RISK_CLASSIFIER: bool = True  # Segunda etapa para resultados ambiguos (requiere NumPy)
+    RISK_MODEL_PATH: str = "./data/guardrails/risk_model.npz"  # Pesos (scripts/train_risk_classifier.py)
+    RISK_SEED_PATH: str = "./data/guardrails/risk_seed.jsonl"  # Corpus si no hay pesos
+    RISK_DECAY: float = 0.7  # Decaimiento por mensaje del riesgo acumulado de la sesión
+    RISK_TRAJECTORY_THRESHOLD: float = 2.0  # Acumulado que escala el turno a HIGH (3 MEDIUM seguidos)
+    GUARDRAIL_RULES_PATH: str = "./data/guardrails/rules.yaml"  # Reglas versionadas (YAML/JSON)
+    GUARDRAIL_RULES_RELOAD_SEC: float = 5.0  # Revisión del fichero (0 = sin recarga en caliente)
+    ENABLE_STREAMING_GUARD: bool = True  # Post-filtro durante la generación (corta al primer fallo)
+    GUARDRAIL_STREAM_LOOKBACK: int = 64  # Caracteres previos que se revisan con cada fragmento
+    GUARDRAIL_BATCH_WORKERS: int = 0  # Procesos de check_*_batch (0 = nº de CPUs)
+    GUARDRAIL_BATCH_PARALLEL_MIN: int = 5000  # Textos a partir de los que el lote usa el pool
+    # Keywords integradas, solo si no existe GUARDRAIL_RULES_PATH
     CRISIS_KEYWORDS: List[str] = [
         "suicidio", "suicidar", "matarme", "matar me",
         "acabar con mi vida", "no quiero vivir",
@@ -55,6 +88,10 @@ class Settings(BaseSettings):
     LOG_LEVEL: str = "INFO"
     ENABLE_METRICS: bool = True
     METRICS_PORT: int = 9090
+    ENABLE_SERVER_TIMING: bool = True  # Cabecera Server-Timing con los tiempos por fase
+    PROFILE_SAMPLE_EVERY: int = 0  # Perfilar 1 de cada N peticiones (0 = deshabilitado)
+    PROFILE_DIR: str = "./profiles"  # Pilas "folded" listas para flamegraph
+    PROFILE_INTERVAL_MS: float = 5.0  # Intervalo de muestreo del profiler
     
     class Config:
         env_file = ".env"
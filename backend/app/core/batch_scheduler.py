@@ -0,0 +1,465 @@
+"""
+Continuous Batching Scheduler - Batching a nivel de iteración
+
+En vez de decodificar cada petición por separado, todas las secuencias
+activas avanzan un token por paso en un único batch. Las peticiones nuevas
+se admiten en la frontera de cada token y las terminadas salen del batch
+sin esperar al resto.
+
+Con un SessionPromptCache, el KV-cache de cada sesión se conserva entre
+turnos y el prefill solo procesa los tokens nuevos. Las sesiones sin cache
+propio parten de una copia del KV del prompt de sistema (SharedPrefixCache).
+
+Si la petición trae un `output_filter`, cada fragmento se valida antes de
+enviarlo; con la primera violación la secuencia sale del batch (motivo
+"filtered") sin decodificar el resto de la respuesta.
+
+Todas las secuencias de un batch comparten los pesos del modelo, así que
+comparten también el adaptador LoRA: una petición con otro adaptador espera
+a que el batch se vacíe y entonces se cambia.
+"""
+
+import copy
+import itertools
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from app.core.decoding import IncrementalDetokenizer, StopSequenceMatcher
+from app.core.generation_stats import GenerationStats
+from app.core.metrics import metrics
+from app.core.prompt_cache import PromptCacheEntry, SessionPromptCache, SharedPrefixCache
+
+logger = logging.getLogger(__name__)
+
+_request_ids = itertools.count(1)
+
+
+@dataclass
+class GenerationResult:
+    """Resultado final de una petición"""
+    text: str
+    finish_reason: str  # stop, length, filtered, cancelled, error
+    prompt_tokens: int
+    generated_tokens: int
+    cached_tokens: int = 0  # Tokens del prompt reutilizados del KV-cache
+    tokens_saved: int = 0  # Tokens no decodificados gracias a un stop string o al filtro
+    violated_rules: List[str] = field(default_factory=list)  # Reglas del output_filter
+    error: Optional[BaseException] = None
+
+
+@dataclass
+class GenerationRequest:
+    """Petición de generación con su propia configuración de muestreo"""
+    prompt_tokens: List[int]
+    max_tokens: int = 512
+    temperature: float = 0.7
+    top_p: float = 0.9
+    stop_strings: List[str] = field(default_factory=list)
+    session_id: Optional[str] = None  # Clave del prompt cache entre turnos
+    shared_prefix_len: int = 0  # Tokens iniciales del prompt de sistema compartido
+    adapter: Optional[str] = None  # Adaptador LoRA (None = modelo base)
+    on_delta: Optional[Callable[[str], None]] = None
+    on_finish: Optional[Callable[[GenerationResult], None]] = None
+    # Valida el texto nuevo antes de emitirlo; devuelve las reglas violadas
+    output_filter: Optional[Callable[[str], List[str]]] = None
+    cancelled: bool = False
+    request_id: int = field(default_factory=lambda: next(_request_ids))
+    created_at: float = field(default_factory=time.perf_counter)  # Origen del TTFT
+    timings: Dict[str, float] = field(default_factory=dict)  # queue/prefill/decode en segundos
+
+
+class BatchDecoder(ABC):
+    """
+    Interfaz del modelo para el scheduler
+
+    Cada implementación mantiene el KV-cache de las secuencias activas y
+    produce un token por secuencia en cada llamada a step().
+    """
+
+    eos_token_ids: set = set()
+
+    @abstractmethod
+    def add(
+        self,
+        seq_id: int,
+        request: GenerationRequest,
+        cached: Optional[PromptCacheEntry] = None
+    ):
+        """
+        Prefill de una secuencia nueva y alta en el batch
+
+        Si llega `cached`, sus primeros `cached.reuse_tokens` tokens ya están
+        en el KV-cache y solo se procesa el resto del prompt.
+        """
+
+    @abstractmethod
+    def step(self) -> Dict[int, int]:
+        """Un paso de decodificación: {seq_id: token} para las secuencias activas"""
+
+    @abstractmethod
+    def remove(self, seq_id: int) -> Optional[PromptCacheEntry]:
+        """
+        Retira una secuencia del batch
+
+        Returns:
+            El KV-cache final de la secuencia (None si no se conserva)
+        """
+
+    @abstractmethod
+    def decode(self, tokens: List[int]) -> str:
+        """Convierte token ids a texto"""
+
+    def build_prefix_cache(self, tokens: List[int]) -> Optional[PromptCacheEntry]:
+        """Prefill aislado de un prefijo (None si el decoder no lo soporta)"""
+        return None
+
+    def clone_cache(self, cache: Any) -> Any:
+        """Copia independiente de un KV-cache"""
+        return copy.deepcopy(cache)
+
+    def set_adapter(self, name: Optional[str]):
+        """
+        Activa un adaptador LoRA (None = modelo base)
+
+        Solo se llama con el batch vacío. Si falla, el decoder debe quedar
+        con el modelo base.
+        """
+        if name is not None:
+            raise ValueError("Este backend no admite adaptadores LoRA")
+
+
+def _cache_key(request: GenerationRequest) -> str:
+    """Clave del prompt cache: el KV depende también del adaptador"""
+    if request.adapter is None:
+        return request.session_id
+    return f"{request.session_id}@{request.adapter}"
+
+
+@dataclass
+class _Sequence:
+    """Estado de una secuencia dentro del batch"""
+    request: GenerationRequest
+    detokenizer: IncrementalDetokenizer
+    matcher: StopSequenceMatcher
+    generated: int = 0
+    cached_tokens: int = 0
+    prefill_time: float = 0.0
+    first_token_at: Optional[float] = None
+    last_token_at: Optional[float] = None
+    inter_token: List[float] = field(default_factory=list)
+    violated_rules: List[str] = field(default_factory=list)
+
+
+class ContinuousBatchScheduler:
+    """Planificador de batching continuo sobre un BatchDecoder"""
+
+    def __init__(
+        self,
+        decoder: BatchDecoder,
+        max_batch_size: int = 8,
+        prompt_cache: Optional[SessionPromptCache] = None,
+        prefix_cache: Optional[SharedPrefixCache] = None,
+        live_stats: Optional[GenerationStats] = None
+    ):
+        self.decoder = decoder
+        self.max_batch_size = max_batch_size
+        self.prompt_cache = prompt_cache
+        self.prefix_cache = prefix_cache
+        self.waiting: Deque[GenerationRequest] = deque()
+        self.active: Dict[int, _Sequence] = {}
+
+        # Estadísticas
+        self.total_steps = 0
+        self.total_tokens = 0
+        self.decode_time = 0.0
+        self.prefill_tokens = 0
+        self.early_stops = 0
+        self.tokens_saved = 0
+        self.filtered = 0
+        self.filtered_tokens_saved = 0
+        self.active_adapter: Optional[str] = None
+        self.adapter_switches = 0
+        self.live_stats = live_stats or GenerationStats()
+
+    def submit(self, request: GenerationRequest):
+        """Encola una petición; se admitirá en la próxima frontera de token"""
+        self.waiting.append(request)
+
+    def has_work(self) -> bool:
+        return bool(self.active or self.waiting)
+
+    def has_capacity(self) -> bool:
+        return len(self.active) + len(self.waiting) < self.max_batch_size
+
+    def step(self):
+        """Admite peticiones pendientes, decodifica un token y retira las terminadas"""
+        self._admit()
+        self._retire_cancelled()
+
+        if not self.active:
+            return
+
+        start = time.perf_counter()
+        tokens = self.decoder.step()
+        now = time.perf_counter()
+        self.decode_time += now - start
+        self.total_steps += 1
+
+        for seq_id, token in tokens.items():
+            seq = self.active.get(seq_id)
+            if seq is None:
+                continue
+            self.total_tokens += 1
+            if seq.last_token_at is None:
+                seq.first_token_at = now
+            else:
+                seq.inter_token.append(now - seq.last_token_at)
+            seq.last_token_at = now
+            self._advance(seq_id, seq, token)
+
+    def run_until_idle(self):
+        """Procesa todas las peticiones pendientes (uso offline)"""
+        while self.has_work():
+            self.step()
+
+    def fail_all(self, error: BaseException):
+        """Termina todas las peticiones con error (p.ej. fallo del modelo)"""
+        for seq_id in list(self.active):
+            self._finish(seq_id, "error", error)
+        while self.waiting:
+            request = self.waiting.popleft()
+            self._notify_finish(request, GenerationResult(
+                text="",
+                finish_reason="error",
+                prompt_tokens=len(request.prompt_tokens),
+                generated_tokens=0,
+                error=error
+            ))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Estadísticas agregadas del batch"""
+        return {
+            "active_sequences": len(self.active),
+            "waiting_sequences": len(self.waiting),
+            "max_batch_size": self.max_batch_size,
+            "total_steps": self.total_steps,
+            "total_tokens": self.total_tokens,
+            "avg_batch_size": round(self.total_tokens / self.total_steps, 2) if self.total_steps else 0.0,
+            "tokens_per_sec": round(self.total_tokens / self.decode_time, 2) if self.decode_time else 0.0,
+            "prefill_tokens": self.prefill_tokens,
+            "early_stops": self.early_stops,
+            "tokens_saved": self.tokens_saved,
+            "filtered": self.filtered,
+            "filtered_tokens_saved": self.filtered_tokens_saved,
+            "active_adapter": self.active_adapter,
+            "adapter_switches": self.adapter_switches,
+            "prompt_cache": self.prompt_cache.get_stats() if self.prompt_cache is not None else None,
+            "prefix_cache": self.prefix_cache.get_stats() if self.prefix_cache is not None else None,
+        }
+
+    def warm_prefix(self, tokens: List[int]) -> bool:
+        """Calcula (o valida) el KV del prefijo compartido"""
+        if self.prefix_cache is None or not tokens:
+            return False
+        try:
+            return self.prefix_cache.ensure(tokens, self.decoder.build_prefix_cache)
+        except Exception as e:
+            logger.warning(f"⚠️  No se pudo cachear el prefijo de sistema: {e}")
+            return False
+
+    def _admit(self):
+        while self.waiting and len(self.active) < self.max_batch_size:
+            request = self.waiting[0]
+            if not request.cancelled and request.adapter != self.active_adapter:
+                if self.active:
+                    # Otro adaptador: esperar a que se vacíe el batch (FIFO)
+                    break
+                if not self._switch_adapter(request):
+                    self.waiting.popleft()
+                    continue
+
+            self.waiting.popleft()
+            if request.cancelled:
+                self._notify_finish(request, GenerationResult(
+                    text="",
+                    finish_reason="cancelled",
+                    prompt_tokens=len(request.prompt_tokens),
+                    generated_tokens=0
+                ))
+                continue
+
+            seq_id = request.request_id
+            seq = _Sequence(
+                request=request,
+                detokenizer=IncrementalDetokenizer(self.decoder.decode),
+                matcher=StopSequenceMatcher(request.stop_strings)
+            )
+            self.active[seq_id] = seq
+
+            cached = None
+            if request.session_id and self.prompt_cache is not None:
+                cached = self.prompt_cache.take(_cache_key(request), request.prompt_tokens)
+            if cached is None and request.shared_prefix_len and request.adapter is None:
+                # Se recalcula solo si cambió el prompt de sistema
+                prefix = request.prompt_tokens[:request.shared_prefix_len]
+                if self.warm_prefix(prefix):
+                    cached = self.prefix_cache.match(request.prompt_tokens, self.decoder.clone_cache)
+
+            prefill_start = time.perf_counter()
+            request.timings["queue"] = prefill_start - request.created_at
+            try:
+                try:
+                    self.decoder.add(seq_id, request, cached)
+                except Exception as e:
+                    if cached is None:
+                        raise
+                    # Cache inservible: prefill completo
+                    logger.warning(f"⚠️  Prompt cache descartado, prefill completo: {e}")
+                    cached = None
+                    self.decoder.add(seq_id, request)
+            except Exception as e:
+                logger.error(f"❌ Error en prefill: {e}")
+                self._finish(seq_id, "error", e, remove=False)
+                continue
+
+            seq.prefill_time = time.perf_counter() - prefill_start
+            request.timings["prefill"] = seq.prefill_time
+            seq.cached_tokens = cached.reuse_tokens if cached else 0
+            self.prefill_tokens += len(request.prompt_tokens) - seq.cached_tokens
+
+    def _switch_adapter(self, request: GenerationRequest) -> bool:
+        """Cambia el adaptador del modelo; si falla, termina la petición con error"""
+        try:
+            self.decoder.set_adapter(request.adapter)
+        except Exception as e:
+            logger.error(f"❌ Error activando adaptador {request.adapter}: {e}")
+            self.active_adapter = None
+            self._notify_finish(request, GenerationResult(
+                text="",
+                finish_reason="error",
+                prompt_tokens=len(request.prompt_tokens),
+                generated_tokens=0,
+                error=e
+            ))
+            return False
+
+        self.active_adapter = request.adapter
+        self.adapter_switches += 1
+        logger.info(f"🧬 Adaptador activo: {request.adapter or 'base'}")
+        return True
+
+    def _retire_cancelled(self):
+        for seq_id, seq in list(self.active.items()):
+            if seq.request.cancelled:
+                self._finish(seq_id, "cancelled")
+
+    def _advance(self, seq_id: int, seq: _Sequence, token: int):
+        request = seq.request
+
+        if token in self.decoder.eos_token_ids:
+            if not self._emit(seq, seq.detokenizer.finalize()):
+                self._flush(seq)
+            self._finish(seq_id, "stop")
+            return
+
+        seq.generated += 1
+        if self._emit(seq, seq.detokenizer.add_token(token)):
+            self._finish(seq_id, "stop")
+        elif seq.generated >= request.max_tokens:
+            if self._emit(seq, seq.detokenizer.finalize()):
+                self._finish(seq_id, "stop")
+            else:
+                self._flush(seq)
+                self._finish(seq_id, "length")
+
+    def _emit(self, seq: _Sequence, delta: str) -> bool:
+        """Envía el texto nuevo; True si apareció un stop string o el filtro lo rechazó"""
+        self._send(seq, seq.matcher.feed(delta))
+        return seq.matcher.stopped or bool(seq.violated_rules)
+
+    def _flush(self, seq: _Sequence):
+        """Emite el texto retenido al terminar sin stop string"""
+        self._send(seq, seq.matcher.flush())
+
+    def _send(self, seq: _Sequence, out: str):
+        if not out or seq.violated_rules:
+            return
+        request = seq.request
+        if request.output_filter is not None:
+            seq.violated_rules = request.output_filter(out)
+            if seq.violated_rules:
+                # El fragmento que completa la violación no llega al cliente
+                return
+        if request.on_delta:
+            request.on_delta(out)
+
+    def _finish(
+        self,
+        seq_id: int,
+        reason: str,
+        error: Optional[BaseException] = None,
+        remove: bool = True
+    ):
+        seq = self.active.pop(seq_id)
+        if seq.violated_rules and reason in ("stop", "length"):
+            reason = "filtered"
+        if remove:
+            try:
+                entry = self.decoder.remove(seq_id)
+            except Exception as e:
+                logger.warning(f"⚠️  Error liberando secuencia {seq_id}: {e}")
+                entry = None
+
+            # Conservar el KV-cache para el siguiente turno de la sesión
+            if entry is not None and seq.request.session_id and self.prompt_cache is not None \
+                    and reason in ("stop", "length"):
+                self.prompt_cache.put(_cache_key(seq.request), entry)
+
+        if reason in ("stop", "length", "filtered") and seq.first_token_at is not None:
+            decode_time = seq.last_token_at - seq.first_token_at
+            seq.request.timings["decode"] = decode_time
+            self.live_stats.record(
+                ttft=seq.first_token_at - seq.request.created_at,
+                prefill_tokens=len(seq.request.prompt_tokens) - seq.cached_tokens,
+                prefill_time=seq.prefill_time,
+                generated_tokens=len(seq.inter_token) + 1,
+                decode_time=decode_time,
+                inter_token=seq.inter_token
+            )
+            metrics.observe_generation(
+                seq.prefill_time,
+                decode_time,
+                len(seq.request.prompt_tokens),
+                len(seq.inter_token) + 1
+            )
+
+        # Presupuesto de decodificación que ya no se gasta tras el stop string
+        tokens_saved = 0
+        if reason == "filtered":
+            tokens_saved = max(seq.request.max_tokens - seq.generated, 0)
+            self.filtered += 1
+            self.filtered_tokens_saved += tokens_saved
+        elif seq.matcher.stopped:
+            tokens_saved = max(seq.request.max_tokens - seq.generated, 0)
+            self.early_stops += 1
+            self.tokens_saved += tokens_saved
+
+        self._notify_finish(seq.request, GenerationResult(
+            text=seq.matcher.output.strip(),
+            finish_reason=reason,
+            prompt_tokens=len(seq.request.prompt_tokens),
+            generated_tokens=seq.generated,
+            cached_tokens=seq.cached_tokens,
+            tokens_saved=tokens_saved,
+            violated_rules=seq.violated_rules,
+            error=error
+        ))
+
+    @staticmethod
+    def _notify_finish(request: GenerationRequest, result: GenerationResult):
+        if request.on_finish:
+            request.on_finish(result)
@@ -0,0 +1,200 @@
+"""
+Utilidades de decodificación incremental (token ids -> texto)
+
+Los stop strings se comprueban dentro del bucle de decodificación: en cuanto
+aparece uno, la generación se detiene en vez de seguir hasta EOS/max_tokens
+y recortar el texto después.
+"""
+
+from typing import Any, Callable, Dict, List, Optional
+
+# Carácter de reemplazo: el token es parte de un carácter UTF-8 incompleto
+_REPLACEMENT_CHAR = "�"
+
+
+class IncrementalDetokenizer:
+    """
+    Convierte tokens a texto de forma incremental
+
+    Decodifica solo una ventana corta (tokens desde el último punto estable)
+    en lugar de todo el texto generado, así cada token cuesta O(1). Retiene
+    el texto mientras termine en un carácter UTF-8 incompleto.
+    """
+
+    def __init__(self, decode: Callable[[List[int]], str]):
+        self._decode = decode
+        self.tokens: List[int] = []
+        self.text = ""
+        self._prefix_offset = 0
+        self._read_offset = 0
+
+    def add_token(self, token: int) -> str:
+        """
+        Añade un token
+
+        Returns:
+            str: Texto nuevo legible (puede ser vacío)
+        """
+        self.tokens.append(token)
+        return self._flush(force=False)
+
+    def finalize(self) -> str:
+        """Emite el texto retenido al terminar la generación"""
+        return self._flush(force=True)
+
+    def _flush(self, force: bool) -> str:
+        if self._read_offset >= len(self.tokens):
+            return ""
+
+        prefix_text = self._decode(self.tokens[self._prefix_offset:self._read_offset])
+        new_text = self._decode(self.tokens[self._prefix_offset:])
+
+        if len(new_text) <= len(prefix_text):
+            return ""
+        if new_text.endswith(_REPLACEMENT_CHAR) and not force:
+            return ""
+
+        delta = new_text[len(prefix_text):]
+        self._prefix_offset = self._read_offset
+        self._read_offset = len(self.tokens)
+        self.text += delta
+        return delta
+
+
+def partial_stop_length(text: str, stop_strings: List[str]) -> int:
+    """Longitud del sufijo de text que es prefijo de algún stop string"""
+    longest = 0
+    for stop in stop_strings:
+        for size in range(min(len(stop) - 1, len(text)), longest, -1):
+            if text.endswith(stop[:size]):
+                longest = size
+                break
+    return longest
+
+
+class StopSequenceMatcher:
+    """
+    Detecta stop strings en texto que llega por fragmentos
+
+    Un stop string puede llegar partido entre tokens ("<|im_" + "end|>"): el
+    texto que podría ser su comienzo se retiene hasta saber si lo es. Solo
+    se busca en la cola del texto (lo nuevo más len(stop) - 1 caracteres),
+    así cada fragmento cuesta O(len(fragmento)) y no O(len(texto)).
+    """
+
+    def __init__(self, stop_strings: Optional[List[str]] = None, strip_leading: bool = True):
+        self.stop_strings = [s for s in (stop_strings or []) if s]
+        self.strip_leading = strip_leading
+        self.text = ""
+        self.emitted = 0
+        self.stopped = False
+        self._start = 0
+        self._max_stop = max((len(s) for s in self.stop_strings), default=0)
+
+    @property
+    def output(self) -> str:
+        """Texto ya emitido (sin el stop string ni lo posterior)"""
+        return self.text[self._start:self.emitted]
+
+    def feed(self, delta: str) -> str:
+        """
+        Añade texto decodificado
+
+        Returns:
+            str: Texto que se puede emitir ya (puede ser vacío). Tras un
+            stop string, `stopped` pasa a True y no se emite nada más.
+        """
+        if self.stopped or not delta:
+            return ""
+
+        start = max(0, len(self.text) - self._max_stop + 1)
+        self.text += delta
+
+        # No emitir espacios iniciales
+        if self.emitted == self._start and self.strip_leading:
+            self.emitted = self._start = len(self.text) - len(self.text.lstrip())
+
+        stop_at = self._find_stop(start)
+        if stop_at is not None:
+            self.stopped = True
+            end = stop_at
+        else:
+            end = len(self.text) - partial_stop_length(self.text, self.stop_strings)
+
+        return self._advance(end)
+
+    def flush(self) -> str:
+        """Emite el texto retenido al terminar sin stop string"""
+        if self.stopped:
+            return ""
+        return self._advance(len(self.text))
+
+    def _find_stop(self, start: int) -> Optional[int]:
+        positions = [
+            pos for pos in (self.text.find(s, start) for s in self.stop_strings)
+            if pos != -1
+        ]
+        return min(positions) if positions else None
+
+    def _advance(self, end: int) -> str:
+        if end <= self.emitted:
+            return ""
+        delta = self.text[self.emitted:end]
+        self.emitted = end
+        return delta
+
+
+class SpeculativeStats:
+    """
+    Tokens propuestos por el modelo borrador y aceptados por el principal
+
+    Cada ronda de decodificación especulativa propone hasta k tokens del
+    borrador; el modelo principal los verifica en un solo forward y añade
+    siempre un token propio.
+    """
+
+    def __init__(self, num_draft_tokens: int):
+        self.num_draft_tokens = num_draft_tokens
+        self.drafted = 0
+        self.accepted = 0
+        self.rounds = 0
+
+    def tracker(self, max_tokens: int) -> "DraftRoundTracker":
+        """Contador de rondas para una secuencia"""
+        return DraftRoundTracker(self, max_tokens)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "num_draft_tokens": self.num_draft_tokens,
+            "drafted_tokens": self.drafted,
+            "accepted_tokens": self.accepted,
+            "acceptance_rate": round(self.accepted / self.drafted, 3) if self.drafted else 0.0,
+            # Tokens producidos por cada forward del modelo principal
+            "tokens_per_verify": round((self.accepted + self.rounds) / self.rounds, 2) if self.rounds else 0.0,
+        }
+
+
+class DraftRoundTracker:
+    """Reconstruye las rondas a partir del flag from_draft de cada token"""
+
+    def __init__(self, stats: SpeculativeStats, max_tokens: int):
+        self._stats = stats
+        self._max_tokens = max_tokens
+        self._tokens = 0
+        self._in_round = False
+
+    def observe(self, from_draft: bool):
+        """Registra un token generado"""
+        stats = self._stats
+        if not self._in_round:
+            # La última ronda propone menos si se acaba max_tokens
+            stats.drafted += min(stats.num_draft_tokens, self._max_tokens - self._tokens)
+            stats.rounds += 1
+            self._in_round = True
+
+        self._tokens += 1
+        if from_draft:
+            stats.accepted += 1
+        else:
+            # Token del modelo principal: cierra la ronda
+            self._in_round = False
@@ -0,0 +1,102 @@
+"""
+Generation Stats - Latencia y throughput medidos sobre el tráfico real
+
+El scheduler registra cada petición terminada: tiempo hasta el primer token
+(TTFT), latencia entre tokens, velocidad de prefill y de decodificación.
+Se guardan en ventanas deslizantes para que get_model_info() informe de
+valores recientes en vez de estimaciones fijas. El benchmark
+(scripts/bench_generation.py) usa la misma clase.
+"""
+
+import threading
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Percentil por rango más cercano sobre una lista ya ordenada"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _summary(values: Iterable[float], scale: float = 1.0, digits: int = 2) -> Dict[str, float]:
+    """Media y percentiles (p50/p95/p99) escalados"""
+    ordered = sorted(values)
+    if not ordered:
+        return {"mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0}
+    return {
+        "mean": round(sum(ordered) / len(ordered) * scale, digits),
+        "p50": round(percentile(ordered, 50) * scale, digits),
+        "p95": round(percentile(ordered, 95) * scale, digits),
+        "p99": round(percentile(ordered, 99) * scale, digits),
+    }
+
+
+class GenerationStats:
+    """Ventanas deslizantes de las últimas peticiones (thread-safe)"""
+
+    def __init__(self, window: int = 512, max_token_samples: int = 16384):
+        self._lock = threading.Lock()
+        self._ttft = deque(maxlen=window)
+        self._prefill_tps = deque(maxlen=window)
+        self._decode_tps = deque(maxlen=window)
+        self._itl = deque(maxlen=max_token_samples)
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.generated_tokens = 0
+
+    def record(
+        self,
+        ttft: float,
+        prefill_tokens: int,
+        prefill_time: float,
+        generated_tokens: int,
+        decode_time: float,
+        inter_token: Optional[List[float]] = None
+    ):
+        """
+        Registra una petición terminada
+
+        Args:
+            ttft: Segundos desde la creación de la petición hasta el primer token
+            prefill_tokens: Tokens del prompt procesados (sin los reutilizados del cache)
+            prefill_time: Segundos de prefill
+            generated_tokens: Tokens decodificados
+            decode_time: Segundos entre el primer y el último token
+            inter_token: Segundos entre tokens consecutivos
+        """
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prefill_tokens
+            self.generated_tokens += generated_tokens
+            self._ttft.append(ttft)
+            if prefill_tokens and prefill_time > 0:
+                self._prefill_tps.append(prefill_tokens / prefill_time)
+            if generated_tokens > 1 and decode_time > 0:
+                self._decode_tps.append((generated_tokens - 1) / decode_time)
+            if inter_token:
+                self._itl.extend(inter_token)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Resumen de la ventana: latencias en ms y velocidades en tokens/s"""
+        with self._lock:
+            ttft = list(self._ttft)
+            itl = list(self._itl)
+            prefill = list(self._prefill_tps)
+            decode = list(self._decode_tps)
+            requests = self.requests
+            prompt_tokens = self.prompt_tokens
+            generated_tokens = self.generated_tokens
+
+        return {
+            "requests": requests,
+            "window": len(ttft),
+            "prompt_tokens": prompt_tokens,
+            "generated_tokens": generated_tokens,
+            "ttft_ms": _summary(ttft, scale=1000),
+            "inter_token_ms": _summary(itl, scale=1000),
+            "prefill_tokens_per_sec": _summary(prefill, digits=1),
+            "decode_tokens_per_sec": _summary(decode, digits=1),
+        }
@@ -0,0 +1,325 @@
+"""
+Guardrail Rules - Reglas de los guardrails en un fichero versionado
+
+Las keywords y patrones de crisis y los patrones prohibidos en respuestas
+se leen de GUARDRAIL_RULES_PATH (YAML o JSON) y se compilan una sola vez en
+un RuleSet inmutable que comparten todas las peticiones. El RuleRegistry
+comprueba cada GUARDRAIL_RULES_RELOAD_SEC si el fichero cambió: el RuleSet
+nuevo se compila entero y después sustituye al anterior en una sola
+asignación, así una petición nunca ve reglas a medio cargar. Si el fichero
+nuevo es inválido se conservan las reglas activas.
+
+En el servidor la comprobación la hace un hilo propio (start_watching()) y
+current() nunca toca el disco; sin él (scripts, tests) current() revisa el
+fichero como mucho cada GUARDRAIL_RULES_RELOAD_SEC.
+
+Formato:
+
+    version: "3"
+    crisis:
+      keywords: ["suicidio", ...]
+      patterns: ['quiero\\s+(morir|morirme)', ...]
+    content:
+      forbidden_patterns: ['prescribo', ...]
+
+Las reglas de crisis se comparan con el texto normalizado del mensaje
+(NormalizedText.folded), así que se compilan también normalizadas: sin
+tildes ("autolesión" encaja con "autolesion") y con espacios colapsados.
+
+Sin fichero se usan las reglas integradas (Settings.CRISIS_KEYWORDS y los
+patrones de este módulo) con versión "builtin".
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+try:
+    import yaml
+    _PARSE_ERRORS = (ValueError, yaml.YAMLError)
+except ImportError:  # Dependencia opcional: el fichero puede ser JSON
+    yaml = None
+    _PARSE_ERRORS = (ValueError,)
+
+from app.core.model_backend import resolve_project_path
+from app.core.multi_match import RuleMatcher
+from app.core.text_normalization import fold_text, strip_accents
+
+logger = logging.getLogger(__name__)
+
+BUILTIN_CRISIS_PATTERNS = (
+    r"quiero\s+(morir|morirme|suicidar|suicidarme)",
+    r"voy\s+a\s+(matar|suicidar)",
+    r"plan\s+para\s+(morir|suicidarme|matarme)",
+    r"no\s+quiero\s+(vivir|seguir\s+viviendo)",
+    r"(cortar|hacer\s+daño|lastimar)me",
+    r"acabar\s+con\s+(mi\s+vida|todo)",
+)
+
+BUILTIN_FORBIDDEN_PATTERNS = (
+    r"diagnóstico\s+de",
+    r"tienes\s+(depresión|ansiedad|trastorno)",
+    r"prescribo",
+    r"toma\s+(medicamento|medicina)",
+    r"dosis\s+de",
+)
+
+
+class RuleFileError(Exception):
+    """Fichero de reglas ilegible o con un formato inválido"""
+
+
+@dataclass(frozen=True)
+class RuleSet:
+    """Reglas compiladas de una versión concreta (inmutable)"""
+    version: str
+    crisis_keywords: Tuple[str, ...]
+    crisis_patterns: Tuple[str, ...]
+    forbidden_patterns: Tuple[str, ...]
+    crisis_matcher: RuleMatcher = field(repr=False, compare=False)
+    content_matcher: RuleMatcher = field(repr=False, compare=False)
+    source: str = "builtin"
+    loaded_at: str = field(default_factory=lambda: datetime.now().isoformat())
+
+    @classmethod
+    def build(
+        cls,
+        version: str,
+        crisis_keywords: Sequence[str],
+        crisis_patterns: Sequence[str],
+        forbidden_patterns: Sequence[str],
+        source: str = "builtin"
+    ) -> "RuleSet":
+        """
+        Compila las reglas
+
+        Raises:
+            RuleFileError: si alguna regex no compila
+        """
+        try:
+            crisis_matcher = RuleMatcher(
+                [fold_text(k) for k in crisis_keywords],
+                [strip_accents(p) for p in crisis_patterns],
+                re.IGNORECASE
+            )
+            content_matcher = RuleMatcher(patterns=forbidden_patterns, flags=re.IGNORECASE)
+        except re.error as e:
+            raise RuleFileError(f"Patrón inválido ({e.pattern!r}): {e}") from e
+        return cls(
+            version=str(version),
+            crisis_keywords=tuple(crisis_keywords),
+            crisis_patterns=tuple(crisis_patterns),
+            forbidden_patterns=tuple(forbidden_patterns),
+            crisis_matcher=crisis_matcher,
+            content_matcher=content_matcher,
+            source=source
+        )
+
+    @classmethod
+    def builtin(cls, config) -> "RuleSet":
+        return cls.build(
+            "builtin",
+            config.CRISIS_KEYWORDS,
+            BUILTIN_CRISIS_PATTERNS,
+            BUILTIN_FORBIDDEN_PATTERNS
+        )
+
+
+def _string_list(data: Dict[str, Any], section: str, key: str) -> Tuple[str, ...]:
+    values = (data.get(section) or {}).get(key, [])
+    if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+        raise RuleFileError(f"{section}.{key} debe ser una lista de strings")
+    return tuple(values)
+
+
+def load_rule_file(path: Path) -> RuleSet:
+    """
+    Lee y compila un fichero de reglas (.yaml/.yml o .json)
+
+    Raises:
+        RuleFileError: si no se puede leer, no es válido o falta la versión
+    """
+    is_yaml = path.suffix in (".yaml", ".yml")
+    if is_yaml and yaml is None:
+        raise RuleFileError("PyYAML no instalado: usa un fichero .json")
+    try:
+        text = path.read_text(encoding="utf-8")
+        data = yaml.safe_load(text) if is_yaml else json.loads(text)
+    except (OSError, *_PARSE_ERRORS) as e:
+        raise RuleFileError(f"No se pudo leer {path}: {e}") from e
+
+    if not isinstance(data, dict) or not data.get("version"):
+        raise RuleFileError(f"{path}: falta el campo 'version'")
+
+    return RuleSet.build(
+        data["version"],
+        _string_list(data, "crisis", "keywords"),
+        _string_list(data, "crisis", "patterns"),
+        _string_list(data, "content", "forbidden_patterns"),
+        source=str(path)
+    )
+
+
+class RuleRegistry:
+    """RuleSet activo, recargado en caliente cuando cambia el fichero"""
+
+    def __init__(
+        self,
+        path: Optional[Path],
+        fallback: RuleSet,
+        reload_interval: float = 5.0
+    ):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._fallback = fallback
+        self._rules = fallback
+        self._signature = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+        self._stop_watching = threading.Event()
+
+        # Estadísticas
+        self.reloads = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+
+        self.reload()
+
+    def current(self) -> RuleSet:
+        """
+        Reglas activas
+
+        Sin hilo de vigilancia revisa el fichero como mucho cada
+        `reload_interval` segundos; con él solo devuelve la referencia.
+        """
+        if (self._watcher is None and self.path is not None and self.reload_interval > 0
+                and time.monotonic() >= self._next_check):
+            self.reload()
+        return self._rules
+
+    def start_watching(self):
+        """Revisa el fichero en un hilo propio cada `reload_interval` segundos"""
+        if self.path is None or self.reload_interval <= 0 or self._watcher is not None:
+            return
+        self._stop_watching.clear()
+        self._watcher = threading.Thread(target=self._watch, name="guardrail-rules-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        watcher = self._watcher
+        if watcher is None:
+            return
+        self._stop_watching.set()
+        watcher.join()
+        self._watcher = None
+
+    def _watch(self):
+        while not self._stop_watching.wait(self.reload_interval):
+            try:
+                self.reload()
+            except Exception as e:  # El hilo no debe morir: se reintenta en la siguiente vuelta
+                self.errors += 1
+                self.last_error = str(e)
+                logger.error(f"❌ Error revisando {self.path}: {e}")
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Recarga el fichero si cambió (o siempre con `force`)
+
+        Returns:
+            True si se activaron reglas nuevas
+        """
+        if self.path is None:
+            return False
+        # Un solo hilo recarga; el resto sigue con las reglas activas
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            self._next_check = time.monotonic() + self.reload_interval
+            signature = self._file_signature()
+            if signature == self._signature and not force:
+                return False
+            self._signature = signature
+
+            if signature is None:
+                if self._rules is not self._fallback:
+                    logger.warning(f"⚠️  {self.path} ya no existe, se mantienen las reglas {self._rules.version}")
+                else:
+                    logger.info(f"🛡️  Sin fichero de reglas ({self.path}), usando reglas integradas")
+                return False
+
+            try:
+                rules = load_rule_file(self.path)
+            except RuleFileError as e:
+                self.errors += 1
+                self.last_error = str(e)
+                logger.error(f"❌ Reglas de guardrails no recargadas, se mantiene {self._rules.version}: {e}")
+                return False
+
+            previous = self._rules
+            self._rules = rules  # Sustitución atómica
+            if previous is not self._fallback:
+                self.reloads += 1
+            self.last_error = None
+            logger.info(f"🛡️  Reglas de guardrails {previous.version} -> {rules.version} ({self.path})")
+            return True
+        finally:
+            self._lock.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        rules = self._rules
+        return {
+            "version": rules.version,
+            "source": rules.source,
+            "loaded_at": rules.loaded_at,
+            "crisis_keywords": len(rules.crisis_keywords),
+            "crisis_patterns": len(rules.crisis_patterns),
+            "forbidden_patterns": len(rules.forbidden_patterns),
+            "watching": self._watcher is not None,
+            "reloads": self.reloads,
+            "errors": self.errors,
+            "last_error": self.last_error,
+        }
+
+
+_registries: Dict[Tuple, RuleRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def shared_registry(config) -> RuleRegistry:
+    """
+    Registry compartido para la configuración dada
+
+    Todas las instancias de GuardrailsEngine con la misma ruta de reglas
+    usan las mismas reglas compiladas.
+    """
+    raw_path = getattr(config, "GUARDRAIL_RULES_PATH", "")
+    path = resolve_project_path(raw_path) if raw_path else None
+    key = (
+        str(path),
+        getattr(config, "GUARDRAIL_RULES_RELOAD_SEC", 5.0),
+        tuple(config.CRISIS_KEYWORDS)
+    )
+    registry = _registries.get(key)
+    if registry is None:
+        with _registries_lock:
+            registry = _registries.get(key)
+            if registry is None:
+                registry = RuleRegistry(path, RuleSet.builtin(config), reload_interval=key[1])
+                _registries[key] = registry
+    return registry
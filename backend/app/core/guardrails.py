@@ -1,13 +1,31 @@
 """
 Guardrails - Sistema de seguridad y detección de crisis
+
+Además de la API por mensaje (check_input / check_output), GuardrailsEngine
+ofrece check_input_batch / check_output_batch para auditorías offline:
+resultados columnares en arrays NumPy (nivel de riesgo y reglas como
+bits), sin log por mensaje y repartidos en un pool de procesos cuando el
+lote es grande.
 """
 
 import logging
-import re
-from typing import Dict, Tuple, Optional
+import os
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Sequence, Tuple, Optional
 from dataclasses import dataclass
 from enum import Enum
 
+try:
+    import numpy as np
+except ImportError:  # Dependencia opcional: solo para la API por lotes
+    np = None
+
+from app.core.guardrail_rules import RuleRegistry, RuleSet, shared_registry
+from app.core.risk_classifier import RiskClassifier, shared_classifier
+from app.core.text_normalization import NormalizedText, fold_text, normalize_text
+from app.core.tracing import traced
+
 logger = logging.getLogger(__name__)
 
 
@@ -19,6 +37,58 @@ class RiskLevel(Enum):
     CRITICAL = "critical"
 
 
+RISK_LEVELS = tuple(RiskLevel)
+
+# Puntuación de la primera etapa y umbral mínimo de MEDIUM, HIGH y CRITICAL
+KEYWORD_SCORE = 0.3
+PATTERN_SCORE = 0.5
+LEVEL_THRESHOLDS = (0.2, 0.5, 0.8)
+
+
+def risk_level_for(score: float) -> RiskLevel:
+    """Nivel de riesgo de una puntuación"""
+    return RISK_LEVELS[bisect_right(LEVEL_THRESHOLDS, score)]
+
+
+# Peso de cada nivel en el riesgo acumulado de la sesión
+TRAJECTORY_WEIGHTS = {
+    RiskLevel.LOW: 0.0,
+    RiskLevel.MEDIUM: 1.0,
+    RiskLevel.HIGH: 2.0,
+    RiskLevel.CRITICAL: 3.0,
+}
+
+
+@dataclass
+class RiskTrajectory:
+    """
+    Riesgo acumulado de una sesión
+    
+    Suma con decaimiento exponencial por mensaje del peso de cada nivel:
+    score = score * decay + peso. Se actualiza en O(1) con el resultado de
+    cada turno, sin volver a analizar el historial.
+    """
+    score: float = 0.0
+    peak: float = 0.0
+    messages: int = 0
+    escalations: int = 0
+    
+    def observe(self, risk_level: RiskLevel, decay: float) -> float:
+        """Acumula el nivel de un mensaje y devuelve el riesgo resultante"""
+        self.score = self.score * decay + TRAJECTORY_WEIGHTS[risk_level]
+        self.peak = max(self.peak, self.score)
+        self.messages += 1
+        return self.score
+    
+    def to_dict(self) -> Dict:
+        return {
+            "score": round(self.score, 3),
+            "peak": round(self.peak, 3),
+            "messages": self.messages,
+            "escalations": self.escalations,
+        }
+
+
 @dataclass
 class GuardrailResult:
     """Resultado de evaluación de guardrails"""
@@ -30,65 +100,77 @@ class GuardrailResult:
 
 
 class CrisisDetector:
-    """Detector de crisis y riesgo"""
+    """
+    Detector de crisis y riesgo en dos etapas
+    
+    1. Keywords y regex (una pasada, microsegundos).
+    2. Clasificador de n-gramas (RiskClassifier), solo si la primera etapa
+       es ambigua: alguna regla disparada pero por debajo de HIGH.
+    """
     
-    def __init__(self, config):
+    def __init__(
+        self,
+        config,
+        registry: Optional[RuleRegistry] = None,
+        classifier: Optional[RiskClassifier] = None
+    ):
         self.config = config
-        self.crisis_keywords = config.CRISIS_KEYWORDS
         self.risk_threshold = config.RISK_THRESHOLD
         
-        # Patrones de crisis
-        self.crisis_patterns = [
-            r"quiero\s+(morir|morirme|suicidar|suicidarme)",
-            r"voy\s+a\s+(matar|suicidar)",
-            r"plan\s+para\s+(morir|suicidarme|matarme)",
-            r"no\s+quiero\s+(vivir|seguir\s+viviendo)",
-            r"(cortar|hacer\s+daño|lastimar)me",
-            r"acabar\s+con\s+(mi\s+vida|todo)",
-        ]
-        
-        self.compiled_patterns = [
-            re.compile(pattern, re.IGNORECASE)
-            for pattern in self.crisis_patterns
-        ]
+        # Reglas compiladas una sola vez y compartidas entre peticiones
+        self.registry = registry or shared_registry(config)
+        self.classifier = classifier if classifier is not None else shared_classifier(config)
+    
+    @property
+    def rules(self) -> RuleSet:
+        return self.registry.current()
+    
+    @property
+    def crisis_keywords(self) -> tuple:
+        return self.rules.crisis_keywords
     
-    def detect_crisis(self, text: str) -> GuardrailResult:
+    @property
+    def crisis_patterns(self) -> tuple:
+        return self.rules.crisis_patterns
+    
+    def detect_crisis(self, text: str, normalized: Optional[NormalizedText] = None) -> GuardrailResult:
         """
         Detecta indicios de crisis en el texto
         
         Args:
             text: Texto a analizar
+            normalized: Texto ya normalizado (Message.normalized); si falta se calcula
             
         Returns:
             GuardrailResult con nivel de riesgo y acción recomendada
         """
         triggered_rules = []
-        risk_score = 0.0
+        folded = (normalized or normalize_text(text)).folded
+        
+        # Una sola versión de las reglas durante toda la evaluación
+        rules = self.rules
+        keyword_hits, pattern_hits = rules.crisis_matcher.match(folded)
         
         # 1. Búsqueda de keywords
-        text_lower = text.lower()
-        for keyword in self.crisis_keywords:
-            if keyword in text_lower:
-                triggered_rules.append(f"keyword: {keyword}")
-                risk_score += 0.3
+        for i in keyword_hits:
+            triggered_rules.append(f"keyword: {rules.crisis_keywords[i]}")
         
         # 2. Búsqueda de patrones
-        for i, pattern in enumerate(self.compiled_patterns):
-            if pattern.search(text):
-                triggered_rules.append(f"pattern: crisis_{i}")
-                risk_score += 0.5
-        
-        # 3. Determinar nivel de riesgo
-        if risk_score >= 0.8:
-            risk_level = RiskLevel.CRITICAL
-        elif risk_score >= 0.5:
-            risk_level = RiskLevel.HIGH
-        elif risk_score >= 0.2:
-            risk_level = RiskLevel.MEDIUM
-        else:
-            risk_level = RiskLevel.LOW
-        
-        # 4. Decidir acción
+        for i in pattern_hits:
+            triggered_rules.append(f"pattern: crisis_{i}")
+        risk_score = KEYWORD_SCORE * len(keyword_hits) + PATTERN_SCORE * len(pattern_hits)
+        
+        # 3. Segunda etapa: solo para resultados ambiguos (p.ej. "morir" a secas)
+        if self.classifier is not None and 0.0 < risk_score < LEVEL_THRESHOLDS[1]:
+            probability = self.classifier.predict(folded, folded=True)
+            if probability >= self.risk_threshold:
+                triggered_rules.append(f"classifier: {probability:.2f}")
+                risk_score = LEVEL_THRESHOLDS[1]
+        
+        # 4. Determinar nivel de riesgo
+        risk_level = risk_level_for(risk_score)
+        
+        # 5. Decidir acción
         is_safe = risk_level in [RiskLevel.LOW, RiskLevel.MEDIUM]
         should_terminate = risk_level == RiskLevel.CRITICAL
         
@@ -132,22 +214,14 @@ No estás solo/a. La ayuda profesional está disponible y puede marcar la difere
 class ContentFilter:
     """Filtro de contenido inapropiado en respuestas"""
     
-    def __init__(self, config):
+    def __init__(self, config, registry: Optional[RuleRegistry] = None):
         self.config = config
-        
-        # Patrones que NO deben aparecer en respuestas
-        self.forbidden_patterns = [
-            r"diagnóstico\s+de",
-            r"tienes\s+(depresión|ansiedad|trastorno)",
-            r"prescribo",
-            r"toma\s+(medicamento|medicina)",
-            r"dosis\s+de",
-        ]
-        
-        self.compiled_forbidden = [
-            re.compile(pattern, re.IGNORECASE)
-            for pattern in self.forbidden_patterns
-        ]
+        self.registry = registry or shared_registry(config)
+    
+    @property
+    def forbidden_patterns(self) -> tuple:
+        """Patrones que NO deben aparecer en respuestas"""
+        return self.registry.current().forbidden_patterns
     
     def validate_response(self, response: str) -> Tuple[bool, list]:
         """
@@ -159,12 +233,11 @@ class ContentFilter:
         Returns:
             (is_valid, violated_rules)
         """
-        violated_rules = []
-        
         # Buscar patrones prohibidos
-        for i, pattern in enumerate(self.compiled_forbidden):
-            if pattern.search(response):
-                violated_rules.append(f"forbidden_pattern_{i}")
+        violated_rules = [
+            f"forbidden_pattern_{i}"
+            for i in self.registry.current().content_matcher.match(response)[1]
+        ]
         
         is_valid = len(violated_rules) == 0
         
@@ -176,20 +249,209 @@ class ContentFilter:
         return is_valid, violated_rules
 
 
+class StreamingContentFilter:
+    """
+    ContentFilter incremental sobre la respuesta mientras se genera
+
+    Cada fragmento se busca junto con los últimos `lookback` caracteres ya
+    vistos, así un patrón partido entre tokens ("dosis" + " de") se detecta
+    en cuanto llega su último trozo y cada fragmento cuesta
+    O(lookback + fragmento) aunque la respuesta crezca. Un patrón cuya
+    coincidencia sea más larga que la ventana puede escaparse: el post-filtro
+    sobre la respuesta completa sigue siendo la última barrera.
+    """
+    
+    def __init__(self, content_filter: ContentFilter, lookback: int = 64):
+        # Una sola versión de las reglas durante toda la respuesta
+        self.rules = content_filter.registry.current()
+        self.lookback = lookback
+        self.violated_rules: List[str] = []
+        self._tail = ""
+    
+    def feed(self, delta: str) -> List[str]:
+        """
+        Añade un fragmento de la respuesta
+        
+        Returns:
+            Reglas violadas (vacío mientras la respuesta sea válida)
+        """
+        if self.violated_rules or not delta:
+            return self.violated_rules
+        
+        window = self._tail + delta
+        hits = self.rules.content_matcher.match(window)[1]
+        if hits:
+            self.violated_rules = [f"forbidden_pattern_{i}" for i in hits]
+            logger.warning(
+                f"⚠️  Respuesta violó reglas de contenido durante la generación: {self.violated_rules}"
+            )
+        self._tail = window[-self.lookback:] if self.lookback > 0 else ""
+        return self.violated_rules
+
+
+def _pack_hits(hits: List[List[int]], rule_count: int) -> "np.ndarray":
+    """Índices de reglas por texto -> matriz de bits empaquetada (n, ceil(reglas / 8))"""
+    mask = np.zeros((len(hits), rule_count), dtype=bool)
+    for row, indices in enumerate(hits):
+        mask[row, indices] = True
+    return np.packbits(mask, axis=1)
+
+
+def _unpack_hits(packed: "np.ndarray", rule_count: int) -> List[int]:
+    return np.flatnonzero(np.unpackbits(packed, count=rule_count)).tolist()
+
+
+@dataclass
+class BatchInputResult:
+    """
+    Resultado columnar de check_input_batch (una fila por texto)
+    
+    Las reglas disparadas van como bits: el bit i de `keyword_mask` es
+    crisis_keywords[i] y el de `pattern_mask`, crisis_{i}.
+    """
+    risk_levels: "np.ndarray"  # uint8, índice en RISK_LEVELS
+    risk_scores: "np.ndarray"  # float32, puntuación final
+    keyword_mask: "np.ndarray"  # uint8 (n, ceil(keywords / 8)), np.packbits
+    pattern_mask: "np.ndarray"  # uint8 (n, ceil(patrones / 8)), np.packbits
+    classifier_probability: "np.ndarray"  # float32, NaN si no se consultó
+    crisis_keywords: Tuple[str, ...]
+    pattern_count: int
+    risk_threshold: float
+    rules_version: str
+    
+    def __len__(self) -> int:
+        return len(self.risk_levels)
+    
+    @property
+    def is_safe(self) -> "np.ndarray":
+        return self.risk_levels <= RISK_LEVELS.index(RiskLevel.MEDIUM)
+    
+    @property
+    def should_terminate(self) -> "np.ndarray":
+        return self.risk_levels == RISK_LEVELS.index(RiskLevel.CRITICAL)
+    
+    def level(self, row: int) -> RiskLevel:
+        return RISK_LEVELS[self.risk_levels[row]]
+    
+    def triggered_rules(self, row: int) -> List[str]:
+        """Reglas de una fila, con los mismos nombres que detect_crisis"""
+        rules = [f"keyword: {self.crisis_keywords[i]}"
+                 for i in _unpack_hits(self.keyword_mask[row], len(self.crisis_keywords))]
+        rules += [f"pattern: crisis_{i}" for i in _unpack_hits(self.pattern_mask[row], self.pattern_count)]
+        probability = self.classifier_probability[row]
+        if probability >= self.risk_threshold:
+            rules.append(f"classifier: {probability:.2f}")
+        return rules
+    
+    def counts(self) -> Dict[str, int]:
+        """Textos por nivel de riesgo"""
+        per_level = np.bincount(self.risk_levels, minlength=len(RISK_LEVELS))
+        return {level.value: int(count) for level, count in zip(RISK_LEVELS, per_level)}
+
+
+@dataclass
+class BatchOutputResult:
+    """Resultado columnar de check_output_batch (una fila por respuesta)"""
+    is_valid: "np.ndarray"  # bool
+    violation_mask: "np.ndarray"  # uint8 (n, ceil(patrones / 8)); bit i = forbidden_pattern_{i}
+    pattern_count: int
+    rules_version: str
+    
+    def __len__(self) -> int:
+        return len(self.is_valid)
+    
+    def violated_rules(self, row: int) -> List[str]:
+        """Reglas de una fila, con los mismos nombres que validate_response"""
+        return [f"forbidden_pattern_{i}" for i in _unpack_hits(self.violation_mask[row], self.pattern_count)]
+
+
+class _BatchChecker:
+    """Reglas, clasificador y umbrales de un lote; se envía una vez a cada proceso"""
+    
+    def __init__(self, rules: RuleSet, classifier: Optional[RiskClassifier], risk_threshold: float,
+                 crisis_detection: bool):
+        self.rules = rules
+        self.classifier = classifier
+        self.risk_threshold = risk_threshold
+        self.crisis_detection = crisis_detection
+    
+    def check_input(self, texts: Sequence[str]) -> tuple:
+        rules = self.rules
+        n = len(texts)
+        if not self.crisis_detection:
+            return (
+                np.zeros(n, dtype=np.uint8),
+                np.zeros(n, dtype=np.float32),
+                _pack_hits([[]] * n, len(rules.crisis_keywords)),
+                _pack_hits([[]] * n, len(rules.crisis_patterns)),
+                np.full(n, np.nan, dtype=np.float32),
+            )
+        
+        folded = [fold_text(text) for text in texts]
+        hits = [rules.crisis_matcher.match(text) for text in folded]
+        keyword_counts = np.fromiter((len(k) for k, _ in hits), dtype=np.float64, count=n)
+        pattern_counts = np.fromiter((len(p) for _, p in hits), dtype=np.float64, count=n)
+        scores = KEYWORD_SCORE * keyword_counts + PATTERN_SCORE * pattern_counts
+        
+        # Segunda etapa vectorizada sobre las filas ambiguas
+        probability = np.full(n, np.nan, dtype=np.float32)
+        ambiguous = np.flatnonzero((scores > 0.0) & (scores < LEVEL_THRESHOLDS[1]))
+        if self.classifier is not None and ambiguous.size:
+            probability[ambiguous] = self.classifier.predict_many([folded[i] for i in ambiguous], folded=True)
+            scores[probability >= self.risk_threshold] = LEVEL_THRESHOLDS[1]
+        
+        levels = np.searchsorted(LEVEL_THRESHOLDS, scores, side="right").astype(np.uint8)
+        return (
+            levels,
+            scores.astype(np.float32),
+            _pack_hits([k for k, _ in hits], len(rules.crisis_keywords)),
+            _pack_hits([p for _, p in hits], len(rules.crisis_patterns)),
+            probability,
+        )
+    
+    def check_output(self, texts: Sequence[str]) -> tuple:
+        matcher = self.rules.content_matcher
+        hits = [matcher.match(text)[1] for text in texts]
+        is_valid = np.fromiter((not h for h in hits), dtype=bool, count=len(texts))
+        return is_valid, _pack_hits(hits, len(self.rules.forbidden_patterns))
+
+
+# Estado de cada proceso del pool (initializer)
+_worker_checker: Optional[_BatchChecker] = None
+
+
+def _init_batch_worker(checker: _BatchChecker):
+    global _worker_checker
+    _worker_checker = checker
+    # Los procesos hijos no registran nada por mensaje
+    logging.disable(logging.WARNING)
+
+
+def _batch_input_chunk(texts: Sequence[str]) -> tuple:
+    return _worker_checker.check_input(texts)
+
+
+def _batch_output_chunk(texts: Sequence[str]) -> tuple:
+    return _worker_checker.check_output(texts)
+
+
 class GuardrailsEngine:
     """Motor principal de guardrails"""
     
-    def __init__(self, config):
+    def __init__(self, config, registry: Optional[RuleRegistry] = None):
         self.config = config
-        self.crisis_detector = CrisisDetector(config)
-        self.content_filter = ContentFilter(config)
+        self.registry = registry or shared_registry(config)
+        self.crisis_detector = CrisisDetector(config, self.registry)
+        self.content_filter = ContentFilter(config, self.registry)
     
-    def check_input(self, text: str) -> GuardrailResult:
+    @traced("guardrails_in")
+    def check_input(self, text: str, normalized: Optional[NormalizedText] = None) -> GuardrailResult:
         """
         Verifica input del usuario (pre-filtro)
         
         Args:
             text: Texto del usuario
+            normalized: Texto ya normalizado, compartido con la sesión
             
         Returns:
             GuardrailResult
@@ -202,8 +464,9 @@ class GuardrailsEngine:
                 should_terminate=False
             )
         
-        return self.crisis_detector.detect_crisis(text)
+        return self.crisis_detector.detect_crisis(text, normalized)
     
+    @traced("guardrails_out")
     def check_output(self, response: str) -> Tuple[bool, list]:
         """
         Verifica respuesta del modelo (post-filtro)
@@ -216,6 +479,116 @@ class GuardrailsEngine:
         """
         return self.content_filter.validate_response(response)
     
+    def stream_output_filter(self) -> StreamingContentFilter:
+        """Post-filtro incremental para una respuesta en generación"""
+        return StreamingContentFilter(
+            self.content_filter,
+            lookback=getattr(self.config, "GUARDRAIL_STREAM_LOOKBACK", 64)
+        )
+    
+    def check_trajectory(self, trajectory: RiskTrajectory, result: GuardrailResult) -> GuardrailResult:
+        """
+        Acumula el resultado del turno en la sesión y escala si hace falta
+        
+        Varios mensajes de riesgo medio seguidos suben el acumulado por encima
+        de RISK_TRAJECTORY_THRESHOLD: el turno pasa a HIGH aunque por sí solo
+        no lo sea.
+        
+        Args:
+            trajectory: Riesgo acumulado de la sesión (se actualiza)
+            result: Resultado de check_input para el mensaje actual
+        
+        Returns:
+            El mismo resultado o uno escalado a HIGH
+        """
+        score = trajectory.observe(result.risk_level, self.config.RISK_DECAY)
+        if score < self.config.RISK_TRAJECTORY_THRESHOLD or \
+                result.risk_level in (RiskLevel.HIGH, RiskLevel.CRITICAL):
+            return result
+        
+        trajectory.escalations += 1
+        logger.warning(f"📈 Riesgo acumulado de la sesión {score:.2f}: escalado a HIGH")
+        return GuardrailResult(
+            is_safe=False,
+            risk_level=RiskLevel.HIGH,
+            triggered_rules=result.triggered_rules + [f"trajectory: {score:.2f}"],
+            should_terminate=False,
+            emergency_response=self.crisis_detector._build_emergency_response()
+        )
+    
+    def check_input_batch(self, texts: Sequence[str], workers: Optional[int] = None) -> BatchInputResult:
+        """
+        Pre-filtro de muchos textos (auditorías, datasets)
+        
+        Mismas reglas y niveles que check_input, sin log por mensaje ni
+        trayectoria de sesión. Los lotes de al menos
+        GUARDRAIL_BATCH_PARALLEL_MIN textos se reparten entre `workers`
+        procesos (GUARDRAIL_BATCH_WORKERS por defecto; 1 = en este proceso).
+        
+        Raises:
+            RuntimeError: si NumPy no está instalado
+        """
+        checker = self._batch_checker()
+        columns = self._run_batch(checker, _batch_input_chunk, checker.check_input, texts, workers)
+        result = BatchInputResult(
+            *columns,
+            crisis_keywords=checker.rules.crisis_keywords,
+            pattern_count=len(checker.rules.crisis_patterns),
+            risk_threshold=checker.risk_threshold,
+            rules_version=checker.rules.version
+        )
+        logger.info(f"🔍 Crisis detection (lote de {len(result)}): {result.counts()}")
+        return result
+    
+    def check_output_batch(self, responses: Sequence[str], workers: Optional[int] = None) -> BatchOutputResult:
+        """
+        Post-filtro de muchas respuestas (mismas reglas que check_output)
+        
+        Raises:
+            RuntimeError: si NumPy no está instalado
+        """
+        checker = self._batch_checker()
+        is_valid, violation_mask = self._run_batch(
+            checker, _batch_output_chunk, checker.check_output, responses, workers
+        )
+        result = BatchOutputResult(
+            is_valid=is_valid,
+            violation_mask=violation_mask,
+            pattern_count=len(checker.rules.forbidden_patterns),
+            rules_version=checker.rules.version
+        )
+        logger.info(f"🔍 Filtro de contenido (lote de {len(result)}): {int((~is_valid).sum())} inválidas")
+        return result
+    
+    def _batch_checker(self) -> _BatchChecker:
+        if np is None:
+            raise RuntimeError("NumPy no instalado: la API por lotes no está disponible")
+        detector = self.crisis_detector
+        return _BatchChecker(
+            detector.rules,
+            detector.classifier,
+            detector.risk_threshold,
+            self.config.ENABLE_CRISIS_DETECTION
+        )
+    
+    def _run_batch(self, checker: _BatchChecker, chunk_fn, local_fn, texts: Sequence[str],
+                   workers: Optional[int]) -> tuple:
+        """Ejecuta el lote aquí o repartido en procesos y concatena las columnas"""
+        texts = list(texts)
+        if workers is None:
+            workers = getattr(self.config, "GUARDRAIL_BATCH_WORKERS", 0) or os.cpu_count() or 1
+        parallel_min = getattr(self.config, "GUARDRAIL_BATCH_PARALLEL_MIN", 5000)
+        if workers <= 1 or len(texts) < parallel_min:
+            return local_fn(texts)
+        
+        # Varios trozos por proceso para repartir bien textos de longitud desigual
+        size = -(-len(texts) // (workers * 4))
+        chunks = [texts[i:i + size] for i in range(0, len(texts), size)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                                 initargs=(checker,)) as pool:
+            parts = list(pool.map(chunk_fn, chunks))
+        return tuple(np.concatenate(column) for column in zip(*parts))
+    
     def get_fallback_response(self) -> str:
         """Respuesta de fallback si el modelo genera algo inapropiado"""
         return (
@@ -0,0 +1,394 @@
+"""
+Inference Worker - Hilo dedicado de inferencia con cola acotada
+
+El modelo MLX es bloqueante: llamarlo desde un handler async congela el
+event loop de uvicorn. Este worker es el único hilo que ejecuta el modelo;
+los handlers encolan trabajos y esperan un asyncio.Future.
+
+Si se le asigna un ContinuousBatchScheduler, las peticiones de generación
+se admiten en el batch en curso entre token y token en vez de ejecutarse
+una detrás de otra.
+
+Las peticiones de fondo (p.ej. resúmenes de conversación) esperan en una
+cola aparte y solo entran cuando el modelo está ocioso.
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+from app.core.batch_scheduler import (
+    ContinuousBatchScheduler,
+    GenerationRequest,
+    GenerationResult,
+)
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Marca de fin de stream / parada del worker
+_SENTINEL = object()
+
+# Despierta al worker bloqueado para que revise la cola de fondo
+_WAKE = object()
+
+
+class QueueFullError(Exception):
+    """La cola de inferencia está llena"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Cola de inferencia llena")
+        self.retry_after = retry_after
+
+
+@dataclass
+class _Job:
+    """Trabajo pendiente para el hilo de inferencia"""
+    fn: Optional[Callable]
+    args: tuple
+    kwargs: dict
+    loop: asyncio.AbstractEventLoop
+    future: Optional[asyncio.Future] = None
+    stream_queue: Optional[asyncio.Queue] = None
+    request: Optional[GenerationRequest] = None
+    enqueued_at: float = field(default_factory=time.perf_counter)
+    cancelled: bool = False
+    background: bool = False
+
+
+class InferenceStream:
+    """Iterador async sobre los fragmentos producidos por un trabajo en streaming"""
+
+    def __init__(self, job: _Job):
+        self._job = job
+        self.result: Optional[GenerationResult] = None
+
+    def __aiter__(self) -> AsyncIterator[Any]:
+        return self
+
+    async def __anext__(self) -> Any:
+        item = await self._job.stream_queue.get()
+        if item is _SENTINEL:
+            raise StopAsyncIteration
+        if isinstance(item, GenerationResult):
+            self.result = item
+            if item.error is not None:
+                raise item.error
+            raise StopAsyncIteration
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    async def read_all(self) -> str:
+        """Consume el stream completo y devuelve el texto"""
+        chunks = [chunk async for chunk in self]
+        if self.result is not None:
+            return self.result.text
+        return "".join(chunks).strip()
+
+    def cancel(self):
+        """Pide al worker que deje de generar (p.ej. cliente desconectado)"""
+        self._job.cancelled = True
+        if self._job.request is not None:
+            self._job.request.cancelled = True
+
+
+class InferenceWorker:
+    """Ejecuta las llamadas al modelo en un único hilo con cola acotada"""
+
+    def __init__(
+        self,
+        max_queue_size: int = 8,
+        retry_after: int = 5,
+        stats_window: int = 256,
+        scheduler: Optional[ContinuousBatchScheduler] = None,
+        max_background: int = 4
+    ):
+        self.max_queue_size = max_queue_size
+        self.max_background = max_background
+        self.retry_after = retry_after
+        self.scheduler = scheduler
+        self._stopping = False
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue_size)
+        self._background: deque = deque()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._wait_times = deque(maxlen=stats_window)
+        self._processed = 0
+        self._rejected = 0
+        self._busy = False
+
+    def start(self):
+        """Arranca el hilo de inferencia"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._run,
+            name="inference-worker",
+            daemon=True
+        )
+        self._thread.start()
+        logger.info(f"🧵 Inference worker iniciado (cola={self.max_queue_size})")
+
+    def stop(self, timeout: float = 30.0):
+        """Detiene el hilo tras terminar el trabajo en curso"""
+        if not self._thread:
+            return
+        self._queue.put(_SENTINEL)
+        self._thread.join(timeout=timeout)
+        self._thread = None
+        logger.info("🛑 Inference worker detenido")
+
+    def check_capacity(self):
+        """Lanza QueueFullError si no cabe otro trabajo"""
+        if self._queue.full():
+            with self._lock:
+                self._rejected += 1
+            raise QueueFullError(self.retry_after)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> asyncio.Future:
+        """
+        Encola una llamada bloqueante
+
+        Returns:
+            asyncio.Future que se resuelve con el resultado de fn
+
+        Raises:
+            QueueFullError: si la cola está llena
+        """
+        loop = asyncio.get_running_loop()
+        job = _Job(fn=fn, args=args, kwargs=kwargs, loop=loop, future=loop.create_future())
+        job.future.add_done_callback(lambda f: setattr(job, "cancelled", f.cancelled()))
+        self._enqueue(job)
+        return job.future
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Ejecuta fn en el hilo de inferencia y espera el resultado"""
+        return await self.submit(fn, *args, **kwargs)
+
+    def submit_stream(self, fn: Callable, *args, **kwargs) -> InferenceStream:
+        """
+        Encola una función generadora; sus elementos se reenvían al event loop
+
+        Raises:
+            QueueFullError: si la cola está llena
+        """
+        loop = asyncio.get_running_loop()
+        job = _Job(fn=fn, args=args, kwargs=kwargs, loop=loop, stream_queue=asyncio.Queue())
+        self._enqueue(job)
+        return InferenceStream(job)
+
+    def submit_generation(self, request: GenerationRequest) -> InferenceStream:
+        """
+        Encola una petición para el scheduler de batching continuo
+
+        Raises:
+            QueueFullError: si la cola está llena
+            RuntimeError: si el worker no tiene scheduler
+        """
+        job = self._generation_job(request)
+        self._enqueue(job)
+        return InferenceStream(job)
+
+    def submit_background(self, request: GenerationRequest) -> InferenceStream:
+        """
+        Encola una petición de baja prioridad
+
+        Solo se admite en el scheduler cuando no hay peticiones de usuario
+        en cola ni en el batch, así no compite con los turnos en curso.
+
+        Raises:
+            QueueFullError: si ya hay `max_background` peticiones de fondo
+            RuntimeError: si el worker no tiene scheduler
+        """
+        job = self._generation_job(request)
+        job.background = True
+        with self._lock:
+            if len(self._background) >= self.max_background:
+                raise QueueFullError(self.retry_after)
+            self._background.append(job)
+        try:
+            self._queue.put_nowait(_WAKE)
+        except queue.Full:
+            # Cola llena: el worker está ocupado y revisará la de fondo después
+            pass
+        return InferenceStream(job)
+
+    def _generation_job(self, request: GenerationRequest) -> _Job:
+        if self.scheduler is None:
+            raise RuntimeError("Inference worker sin scheduler de batching")
+
+        loop = asyncio.get_running_loop()
+        stream_queue = asyncio.Queue()
+        job = _Job(
+            fn=None,
+            args=(),
+            kwargs={},
+            loop=loop,
+            stream_queue=stream_queue,
+            request=request
+        )
+        request.on_delta = lambda delta: _post(loop, stream_queue.put_nowait, delta)
+        request.on_finish = lambda result: _post(loop, stream_queue.put_nowait, result)
+        return job
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Profundidad de cola y tiempos de espera recientes (ms)"""
+        with self._lock:
+            waits = sorted(self._wait_times)
+            processed = self._processed
+            rejected = self._rejected
+            background = len(self._background)
+            busy = self._busy or bool(self.scheduler and self.scheduler.has_work())
+
+        stats = {
+            "queue_depth": self._queue.qsize(),
+            "background_depth": background,
+            "max_queue_size": self.max_queue_size,
+            "busy": busy,
+            "processed": processed,
+            "rejected": rejected,
+            "avg_wait_ms": round(sum(waits) / len(waits) * 1000, 2) if waits else 0.0,
+            "p95_wait_ms": round(waits[int(0.95 * (len(waits) - 1))] * 1000, 2) if waits else 0.0,
+        }
+        if self.scheduler is not None:
+            stats["batching"] = self.scheduler.get_stats()
+        return stats
+
+    def _enqueue(self, job: _Job):
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            raise QueueFullError(self.retry_after)
+
+    def _run(self):
+        while not self._stopping:
+            if self.scheduler is not None and self.scheduler.has_work():
+                # Frontera de token: admitir trabajos nuevos sin bloquear
+                self._drain_queue()
+                self._step_scheduler()
+                continue
+
+            self._handle(self._next_job())
+
+        if self.scheduler is not None and self.scheduler.has_work():
+            self.scheduler.fail_all(RuntimeError("Inference worker detenido"))
+
+        # Peticiones de fondo que no llegaron a entrar
+        with self._lock:
+            pending = list(self._background)
+            self._background.clear()
+        for job in pending:
+            _post(job.loop, job.stream_queue.put_nowait, RuntimeError("Inference worker detenido"))
+
+    def _next_job(self):
+        """Siguiente trabajo; los de fondo solo con la cola principal vacía"""
+        with self._lock:
+            has_background = bool(self._background)
+        if not has_background:
+            return self._queue.get()
+        try:
+            return self._queue.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                return self._background.popleft()
+
+    def _drain_queue(self):
+        while self.scheduler.has_capacity() and not self._stopping:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            self._handle(job)
+
+    def _step_scheduler(self):
+        try:
+            self.scheduler.step()
+        except Exception as e:
+            logger.error(f"❌ Error en paso de decodificación: {e}", exc_info=True)
+            self.scheduler.fail_all(e)
+
+    def _handle(self, job):
+        if job is _SENTINEL:
+            self._stopping = True
+            return
+        if job is _WAKE or job.cancelled:
+            return
+
+        if not job.background:
+            wait = time.perf_counter() - job.enqueued_at
+            with self._lock:
+                self._wait_times.append(wait)
+            metrics.observe_queue_wait(wait)
+
+        if job.request is not None:
+            # La petición entra en el batch; se cuenta al admitirla
+            self.scheduler.submit(job.request)
+            with self._lock:
+                self._processed += 1
+            return
+
+        with self._lock:
+            self._busy = True
+        try:
+            if job.stream_queue is not None:
+                self._run_stream(job)
+            else:
+                self._run_call(job)
+        finally:
+            with self._lock:
+                self._processed += 1
+                self._busy = False
+
+    def _run_call(self, job: _Job):
+        try:
+            result = job.fn(*job.args, **job.kwargs)
+        except Exception as e:
+            _post(job.loop, _resolve, job.future, None, e)
+        else:
+            _post(job.loop, _resolve, job.future, result, None)
+
+    def _run_stream(self, job: _Job):
+        put = job.stream_queue.put_nowait
+        try:
+            iterator = job.fn(*job.args, **job.kwargs)
+            try:
+                for item in iterator:
+                    if job.cancelled:
+                        break
+                    _post(job.loop, put, item)
+            finally:
+                close = getattr(iterator, "close", None)
+                if close:
+                    close()
+        except Exception as e:
+            logger.error(f"❌ Error en trabajo de streaming: {e}")
+            _post(job.loop, put, e)
+        _post(job.loop, put, _SENTINEL)
+
+
+def _post(loop: asyncio.AbstractEventLoop, callback: Callable, *args):
+    """Programa un callback en el event loop desde el hilo de inferencia"""
+    try:
+        loop.call_soon_threadsafe(callback, *args)
+    except RuntimeError:
+        # El loop ya se cerró (shutdown): nadie espera el resultado
+        pass
+
+
+def _resolve(future: asyncio.Future, result: Any, error: Optional[BaseException]):
+    """Completa el future desde el event loop (ignora si ya se canceló)"""
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
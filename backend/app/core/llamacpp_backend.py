@@ -0,0 +1,233 @@
+"""
+Backend llama.cpp - GGUF cuantizado en CPU (Linux x86)
+
+Usa llama-cpp-python. El fichero GGUF se elige según Settings.QUANTIZATION
+(4bit -> Q4_K_M, 8bit -> Q8_0, none -> F16) cuando MODEL_PATH es un
+directorio.
+
+llama.cpp mantiene un único contexto por modelo, así que el decoder
+atiende una secuencia a la vez (batch de 1). Entre peticiones se conserva
+el KV del contexto y se reutiliza el prefijo común con el prompt siguiente
+(prompt de sistema, turnos previos de la misma sesión).
+"""
+
+import logging
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.core.batch_scheduler import BatchDecoder, ContinuousBatchScheduler, GenerationRequest
+from app.core.model_backend import QWEN_STOP_STRINGS, ModelBackend, render_chatml
+from app.core.prompt_cache import PromptCacheEntry, common_prefix_length
+
+try:
+    from llama_cpp import Llama
+except ImportError:  # Dependencia opcional (solo nodos CPU)
+    Llama = None
+
+logger = logging.getLogger(__name__)
+
+# Sufijos de fichero GGUF por nivel de cuantización, en orden de preferencia
+GGUF_QUANT_PATTERNS = {
+    "4bit": ["q4_k_m", "q4_k_s", "q4_0"],
+    "8bit": ["q8_0"],
+    "none": ["f16", "bf16", "f32"],
+}
+
+
+def find_gguf_file(model_path: Path, quantization: str) -> Optional[Path]:
+    """
+    Localiza el GGUF que corresponde a la cuantización pedida
+
+    Args:
+        model_path: Fichero .gguf o directorio con varios
+        quantization: 4bit, 8bit o none
+
+    Returns:
+        Path del fichero o None si no hay ninguno adecuado
+    """
+    if model_path.is_file():
+        return model_path
+    if not model_path.is_dir():
+        return None
+
+    patterns = GGUF_QUANT_PATTERNS.get(quantization.lower())
+    if patterns is None:
+        raise ValueError(f"Cuantización desconocida: {quantization} (opciones: {', '.join(GGUF_QUANT_PATTERNS)})")
+
+    candidates = sorted(model_path.glob("*.gguf"))
+    for pattern in patterns:
+        for path in candidates:
+            if pattern in path.name.lower():
+                return path
+    return None
+
+
+class LlamaCppBatchDecoder(BatchDecoder):
+    """BatchDecoder de una sola secuencia sobre el contexto de llama.cpp"""
+
+    def __init__(self, llama):
+        self.llama = llama
+        self.eos_token_ids = {llama.token_eos()}
+        # <|im_end|> es un token especial: detokenize() no lo renderiza
+        for stop in QWEN_STOP_STRINGS:
+            ids = llama.tokenize(stop.encode("utf-8"), add_bos=False, special=True)
+            if len(ids) == 1:
+                self.eos_token_ids.add(ids[0])
+
+        self._seq_id: Optional[int] = None
+        self._request: Optional[GenerationRequest] = None
+        self._last_token: Optional[int] = None
+        self.reused_tokens = 0
+
+    def add(
+        self,
+        seq_id: int,
+        request: GenerationRequest,
+        cached: Optional[PromptCacheEntry] = None
+    ):
+        if self._seq_id is not None:
+            raise RuntimeError("El contexto de llama.cpp ya tiene una secuencia activa")
+
+        # El KV de la petición anterior sigue en el contexto: reutilizar prefijo
+        prompt = request.prompt_tokens
+        reuse = min(
+            common_prefix_length(list(self.llama._input_ids), prompt),
+            len(prompt) - 1
+        )
+        self.llama.n_tokens = reuse  # eval() descarta el KV desde aquí
+        self.llama.eval(prompt[reuse:])
+        self.reused_tokens += reuse
+
+        self._seq_id = seq_id
+        self._request = request
+        self._last_token = None
+
+    def step(self) -> Dict[int, int]:
+        if self._seq_id is None:
+            return {}
+
+        if self._last_token is not None:
+            self.llama.eval([self._last_token])
+        token = self.llama.sample(
+            temp=self._request.temperature,
+            top_p=self._request.top_p
+        )
+        self._last_token = token
+        return {self._seq_id: token}
+
+    def remove(self, seq_id: int) -> Optional[PromptCacheEntry]:
+        if seq_id == self._seq_id:
+            self._seq_id = None
+            self._request = None
+            self._last_token = None
+        # El KV queda en el contexto de llama.cpp, no en el SessionPromptCache
+        return None
+
+    def decode(self, tokens: List[int]) -> str:
+        return self.llama.detokenize(tokens).decode("utf-8", errors="replace")
+
+
+class LlamaCppBackend(ModelBackend):
+    """Backend CPU con llama-cpp-python y un modelo GGUF cuantizado"""
+
+    name = "llamacpp"
+
+    def __init__(
+        self,
+        model_path: str = None,
+        quantization: str = "4bit",
+        n_ctx: int = 4096,
+        n_threads: Optional[int] = None,
+        max_batch_size: int = 8,
+        prompt_cache_max_mb: int = 1024
+    ):
+        super().__init__(max_batch_size=max_batch_size, prompt_cache_max_mb=prompt_cache_max_mb)
+        if model_path is None:
+            project_root = Path(__file__).parent.parent.parent.parent
+            model_path = project_root / "models" / "qwen2.5-7b-gguf"
+        self.model_path = Path(model_path)
+        self.quantization = quantization
+        self.n_ctx = n_ctx
+        self.n_threads = n_threads
+        self.gguf_file: Optional[Path] = None
+
+    def load_model(self) -> bool:
+        """
+        Carga el GGUF con llama.cpp
+
+        Returns:
+            bool: True si se cargó exitosamente
+        """
+        try:
+            if Llama is None:
+                logger.error("llama-cpp-python no instalado (pip install llama-cpp-python)")
+                return False
+
+            self.gguf_file = find_gguf_file(self.model_path, self.quantization)
+            if self.gguf_file is None:
+                logger.error(f"GGUF {self.quantization} no encontrado en {self.model_path}")
+                return False
+
+            logger.info(f"🔄 Cargando GGUF desde {self.gguf_file}...")
+            self.model = Llama(
+                model_path=str(self.gguf_file),
+                n_ctx=self.n_ctx,
+                n_threads=self.n_threads,
+                verbose=False
+            )
+
+            if self.max_batch_size > 1:
+                logger.info("ℹ️  llama.cpp atiende una secuencia a la vez (batch=1)")
+            self.scheduler = ContinuousBatchScheduler(
+                LlamaCppBatchDecoder(self.model),
+                max_batch_size=1,
+                prompt_cache=self.prompt_cache
+            )
+
+            self.is_loaded = True
+            logger.info("✅ Modelo GGUF cargado exitosamente")
+            return True
+
+        except Exception as e:
+            logger.error(f"❌ Error cargando modelo GGUF: {e}")
+            return False
+
+    def apply_chat_template(
+        self,
+        messages: List[Dict[str, str]],
+        add_generation_prompt: bool = True
+    ) -> str:
+        # Qwen2.5 usa ChatML
+        return render_chatml(messages, add_generation_prompt)
+
+    def encode(self, text: str) -> List[int]:
+        return self.model.tokenize(text.encode("utf-8"), add_bos=False, special=True)
+
+    def _stream_text(
+        self,
+        prompt: str,
+        max_tokens: int,
+        temperature: float,
+        top_p: float
+    ) -> Iterator[str]:
+        for chunk in self.model.create_completion(
+            prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            stream=True
+        ):
+            yield chunk["choices"][0]["text"]
+
+    def _release(self):
+        self.gguf_file = None
+
+    def _describe(self) -> Dict[str, Any]:
+        return {
+            "model_path": str(self.gguf_file),
+            "framework": "llama.cpp",
+            "device": "CPU",
+            "quantization": self.quantization,
+            "n_ctx": self.n_ctx,
+            "n_threads": self.n_threads or "auto",
+        }
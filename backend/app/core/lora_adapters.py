@@ -0,0 +1,146 @@
+"""
+LoRA Adapters - Adaptadores por programa sobre un único modelo base
+
+Cada subdirectorio de LORA_PATH es un adaptador entrenado con mlx_lm
+(adapter_config.json + adapters.safetensors). Los pesos se cargan bajo
+demanda y solo quedan residentes los usados más recientemente (LRU); el
+modelo base se carga una sola vez.
+
+El directorio se vuelve a leer en cada consulta: se pueden añadir o
+retirar adaptadores sin reiniciar el servidor.
+"""
+
+import json
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ADAPTER_CONFIG = "adapter_config.json"
+ADAPTER_WEIGHTS = "adapters.safetensors"
+
+
+class AdapterError(Exception):
+    """Adaptador desconocido o no utilizable"""
+
+
+@dataclass
+class LoRAAdapter:
+    """Adaptador residente en memoria"""
+    name: str
+    path: Path
+    config: Dict[str, Any]
+    weights: Any
+    nbytes: int
+
+
+class LoRAAdapterRegistry:
+    """LRU de adaptadores LoRA residentes"""
+
+    def __init__(
+        self,
+        lora_path: Path,
+        load_weights: Callable[[Path], Tuple[Any, int]],
+        max_resident: int = 4
+    ):
+        """
+        Args:
+            lora_path: Directorio con un subdirectorio por adaptador
+            load_weights: Carga adapters.safetensors -> (pesos, bytes)
+            max_resident: Adaptadores que se mantienen en memoria
+        """
+        self.lora_path = Path(lora_path)
+        self.max_resident = max_resident
+        self._load_weights = load_weights
+        self._resident: "OrderedDict[str, LoRAAdapter]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Estadísticas
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def available(self) -> List[str]:
+        """Adaptadores presentes en disco"""
+        if not self.lora_path.is_dir():
+            return []
+        return sorted(
+            path.name for path in self.lora_path.iterdir()
+            if (path / ADAPTER_CONFIG).exists() and (path / ADAPTER_WEIGHTS).exists()
+        )
+
+    def resident(self) -> List[str]:
+        """Adaptadores en memoria, del menos al más reciente"""
+        with self._lock:
+            return list(self._resident)
+
+    def validate(self, name: str):
+        """Lanza AdapterError si el adaptador no existe en disco"""
+        if name not in self.available():
+            raise AdapterError(f"Adaptador LoRA desconocido: {name}")
+
+    def get(self, name: str) -> LoRAAdapter:
+        """
+        Devuelve el adaptador, cargándolo si no está residente
+
+        Raises:
+            AdapterError: si no existe o no se puede cargar
+        """
+        with self._lock:
+            adapter = self._resident.get(name)
+            if adapter is not None:
+                self._resident.move_to_end(name)
+                self.hits += 1
+                return adapter
+
+        self.validate(name)
+        path = self.lora_path / name
+        try:
+            with open(path / ADAPTER_CONFIG) as f:
+                config = json.load(f)
+            weights, nbytes = self._load_weights(path / ADAPTER_WEIGHTS)
+        except Exception as e:
+            raise AdapterError(f"No se pudo cargar el adaptador {name}: {e}") from e
+
+        adapter = LoRAAdapter(name=name, path=path, config=config, weights=weights, nbytes=nbytes)
+        with self._lock:
+            self._resident[name] = adapter
+            self.loads += 1
+            while len(self._resident) > self.max_resident:
+                evicted, _ = self._resident.popitem(last=False)
+                self.evictions += 1
+                logger.info(f"🗑️  Adaptador LoRA desalojado: {evicted}")
+
+        logger.info(f"🧬 Adaptador LoRA cargado: {name} ({nbytes / 1e6:.1f} MB)")
+        return adapter
+
+    def unload(self, name: str) -> bool:
+        """
+        Libera un adaptador residente
+
+        Si el modelo lo está usando, sigue activo hasta el siguiente cambio
+        de adaptador; la próxima petición que lo pida lo recarga de disco.
+        """
+        with self._lock:
+            adapter = self._resident.pop(name, None)
+        if adapter is not None:
+            logger.info(f"🧹 Adaptador LoRA descargado: {name}")
+        return adapter is not None
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            resident = list(self._resident)
+            nbytes = sum(a.nbytes for a in self._resident.values())
+        return {
+            "path": str(self.lora_path),
+            "resident": resident,
+            "resident_bytes": nbytes,
+            "max_resident": self.max_resident,
+            "hits": self.hits,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
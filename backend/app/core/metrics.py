@@ -0,0 +1,178 @@
+"""
+Metrics - Exportador Prometheus (ENABLE_METRICS / METRICS_PORT)
+
+Histogramas de tiempos por fase (guardrails, cola, prefill, decode,
+latencia extremo a extremo por ruta) y de tokens, contadores por nivel de
+riesgo y familia de regla, y gauges de sesiones activas y su memoria
+estimada. Las etiquetas solo usan valores de un conjunto cerrado (plantilla
+de ruta, nivel, familia): nunca texto del usuario ni IDs de sesión.
+
+`metrics` es una instancia global deshabilitada hasta configure(); sin
+prometheus_client o con ENABLE_METRICS=False cada observe_* es un no-op.
+"""
+
+import logging
+import re
+from typing import Any, Callable, Iterable, Optional
+
+try:
+    from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, start_http_server
+except ImportError:  # Dependencia opcional
+    CollectorRegistry = Counter = Gauge = Histogram = start_http_server = None
+
+logger = logging.getLogger(__name__)
+
+# Buckets en segundos: de sub-milisegundo (guardrails) a generaciones largas
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+_RULE_SUFFIX = re.compile(r"_\d+$")
+
+
+def rule_family(rule: str) -> str:
+    """Familia de una regla sin el detalle: "keyword: morir" -> "keyword", "forbidden_pattern_2" -> "forbidden_pattern" """
+    family = rule.split(":", 1)[0].strip()
+    return _RULE_SUFFIX.sub("", family)
+
+
+class Metrics:
+    """Métricas de la aplicación sobre un CollectorRegistry propio"""
+
+    def __init__(self):
+        self.enabled = False
+        self.registry = None
+        self.port: Optional[int] = None
+
+    def configure(self, enabled: bool = True, registry: Any = None) -> bool:
+        """
+        Crea las métricas (idempotente con el mismo registry)
+
+        Returns:
+            True si quedan habilitadas
+        """
+        if not enabled:
+            self.enabled = False
+            return False
+        if CollectorRegistry is None:
+            logger.warning("⚠️  prometheus_client no instalado: métricas deshabilitadas")
+            self.enabled = False
+            return False
+        if self.enabled and (registry is None or registry is self.registry):
+            return True
+
+        self.registry = registry or CollectorRegistry()
+        r = self.registry
+        self.guardrail_seconds = Histogram(
+            "guardrail_check_seconds", "Tiempo de los guardrails",
+            ["stage"], buckets=FAST_BUCKETS, registry=r
+        )
+        self.queue_wait_seconds = Histogram(
+            "inference_queue_wait_seconds", "Espera en la cola de inferencia",
+            buckets=LATENCY_BUCKETS, registry=r
+        )
+        self.prefill_seconds = Histogram(
+            "generation_prefill_seconds", "Tiempo de prefill por petición",
+            buckets=LATENCY_BUCKETS, registry=r
+        )
+        self.decode_seconds = Histogram(
+            "generation_decode_seconds", "Tiempo de decodificación por petición",
+            buckets=LATENCY_BUCKETS, registry=r
+        )
+        self.prompt_tokens = Histogram(
+            "generation_prompt_tokens", "Tokens de entrada por petición",
+            buckets=TOKEN_BUCKETS, registry=r
+        )
+        self.generated_tokens = Histogram(
+            "generation_output_tokens", "Tokens generados por petición",
+            buckets=TOKEN_BUCKETS, registry=r
+        )
+        self.request_seconds = Histogram(
+            "http_request_duration_seconds", "Latencia extremo a extremo por ruta",
+            ["method", "route", "status"], buckets=LATENCY_BUCKETS, registry=r
+        )
+        self.risk_levels = Counter(
+            "guardrail_risk_level_total", "Mensajes por nivel de riesgo",
+            ["level"], registry=r
+        )
+        self.rule_families = Counter(
+            "guardrail_rule_triggered_total", "Reglas disparadas por familia",
+            ["stage", "family"], registry=r
+        )
+        self.active_sessions = Gauge(
+            "sessions_active", "Sesiones en memoria", registry=r
+        )
+        self.session_memory = Gauge(
+            "sessions_memory_bytes", "Memoria estimada de las sesiones",
+            ["kind"], registry=r
+        )
+        self.enabled = True
+        return True
+
+    def serve(self, port: int) -> bool:
+        """Expone /metrics en `port` (hilo propio de prometheus_client)"""
+        if not self.enabled:
+            return False
+        try:
+            start_http_server(port, registry=self.registry)
+        except OSError as e:
+            logger.error(f"❌ No se pudo abrir el puerto de métricas {port}: {e}")
+            return False
+        self.port = port
+        logger.info(f"📈 Métricas Prometheus en :{port}/metrics")
+        return True
+
+    def track_sessions(
+        self,
+        count: Callable[[], int],
+        text_bytes: Callable[[], int],
+        kv_bytes: Optional[Callable[[], int]] = None
+    ):
+        """Gauges evaluados en cada scrape, sin coste en el request path"""
+        if not self.enabled:
+            return
+        self.active_sessions.set_function(count)
+        self.session_memory.labels(kind="text").set_function(text_bytes)
+        if kv_bytes is not None:
+            self.session_memory.labels(kind="kv_cache").set_function(kv_bytes)
+
+    def observe_input_check(self, seconds: float, risk_level: str, rules: Iterable[str]):
+        if not self.enabled:
+            return
+        self.guardrail_seconds.labels(stage="input").observe(seconds)
+        self.risk_levels.labels(level=risk_level).inc()
+        for rule in rules:
+            self.rule_families.labels(stage="input", family=rule_family(rule)).inc()
+
+    def observe_output_check(self, seconds: float, rules: Iterable[str]):
+        if not self.enabled:
+            return
+        self.guardrail_seconds.labels(stage="output").observe(seconds)
+        for rule in rules:
+            self.rule_families.labels(stage="output", family=rule_family(rule)).inc()
+
+    def observe_queue_wait(self, seconds: float):
+        if self.enabled:
+            self.queue_wait_seconds.observe(seconds)
+
+    def observe_generation(
+        self,
+        prefill_seconds: float,
+        decode_seconds: float,
+        prompt_tokens: int,
+        generated_tokens: int
+    ):
+        if not self.enabled:
+            return
+        self.prefill_seconds.observe(prefill_seconds)
+        self.decode_seconds.observe(decode_seconds)
+        self.prompt_tokens.observe(prompt_tokens)
+        self.generated_tokens.observe(generated_tokens)
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float):
+        if self.enabled:
+            self.request_seconds.labels(method=method, route=route, status=str(status)).observe(seconds)
+
+
+# Instancia global (se configura en main.py)
+metrics = Metrics()
@@ -0,0 +1,551 @@
+"""
+Model Backend - Interfaz común de los motores de generación
+
+El resto de la aplicación (API, worker, scheduler) solo conoce esta
+interfaz. Cada backend aporta el tokenizer, el bucle de generación token a
+token y un BatchDecoder para el batching continuo:
+
+- mlx: ModelManagerMLX (Apple Silicon)
+- llamacpp: GGUF cuantizado en CPU con llama-cpp-python (Linux x86)
+- stub: modelo determinista sin pesos (tests, benchmarks, CI)
+
+Los módulos de cada backend se importan bajo demanda en
+create_model_backend(), así la API arranca sin mlx instalado.
+"""
+
+import importlib.util
+import logging
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from app.core.batch_scheduler import ContinuousBatchScheduler, GenerationRequest
+from app.core.decoding import StopSequenceMatcher
+from app.core.lora_adapters import AdapterError, LoRAAdapterRegistry
+from app.core.prompt_cache import SessionPromptCache
+
+logger = logging.getLogger(__name__)
+
+# Stop strings del chat template de Qwen
+QWEN_STOP_STRINGS = ["<|im_end|>", "<|endoftext|>"]
+
+MODEL_BACKENDS = ("mlx", "llamacpp", "stub")
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent.parent
+
+
+def resolve_project_path(path: str) -> Path:
+    """Rutas relativas de Settings (./models/...) respecto a la raíz del proyecto"""
+    path = Path(path)
+    return path if path.is_absolute() else PROJECT_ROOT / path
+
+
+def render_chatml(messages: List[Dict[str, str]], add_generation_prompt: bool = True) -> str:
+    """Chat template ChatML de Qwen (para backends sin template propio)"""
+    prompt = "".join(
+        f"<|im_start|>{m['role']}\n{m['content']}<|im_end|>\n" for m in messages
+    )
+    if add_generation_prompt:
+        prompt += "<|im_start|>assistant\n"
+    return prompt
+
+
+class ModelBackend(ABC):
+    """
+    Backend de generación
+
+    Las subclases implementan la carga del modelo, el chat template, la
+    tokenización y el stream de fragmentos de texto; la lógica de stop
+    strings, peticiones de chat y prefijo de sistema es común.
+    """
+
+    name: str = "base"
+
+    def __init__(self, max_batch_size: int = 8, prompt_cache_max_mb: int = 1024):
+        self.model = None
+        self.tokenizer = None
+        self.is_loaded = False
+        self.max_batch_size = max_batch_size
+        self.scheduler: Optional[ContinuousBatchScheduler] = None
+
+        # KV-cache por sesión entre turnos (LRU con presupuesto de memoria)
+        self.prompt_cache = SessionPromptCache(max_bytes=prompt_cache_max_mb * 1024 * 1024)
+        # Nº de tokens del bloque de sistema, por contenido del prompt
+        self._system_prefix: Optional[tuple] = None
+
+        # Paradas anticipadas por stop string (generate/generate_stream)
+        self.early_stops = 0
+        self.tokens_saved = 0
+
+        # Adaptadores LoRA (solo backends que los admiten)
+        self.adapters: Optional[LoRAAdapterRegistry] = None
+
+    @abstractmethod
+    def load_model(self) -> bool:
+        """
+        Carga el modelo y crea el scheduler
+
+        Returns:
+            bool: True si se cargó exitosamente
+        """
+
+    @abstractmethod
+    def apply_chat_template(
+        self,
+        messages: List[Dict[str, str]],
+        add_generation_prompt: bool = True
+    ) -> str:
+        """Renderiza los mensajes con el chat template del modelo"""
+
+    @abstractmethod
+    def encode(self, text: str) -> List[int]:
+        """Convierte texto a token ids"""
+
+    def count_tokens(self, text: str) -> int:
+        """Nº de tokens del texto con el tokenizer del modelo"""
+        return len(self.encode(text))
+
+    @abstractmethod
+    def _stream_text(
+        self,
+        prompt: str,
+        max_tokens: int,
+        temperature: float,
+        top_p: float
+    ) -> Iterator[str]:
+        """Fragmentos de texto, uno por token generado"""
+
+    @abstractmethod
+    def _release(self):
+        """Libera los recursos propios del backend"""
+
+    @abstractmethod
+    def _describe(self) -> Dict[str, Any]:
+        """Información propia del backend para get_model_info()"""
+
+    def generate(
+        self,
+        prompt: str,
+        max_tokens: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        repetition_penalty: float = 1.1,
+        stop_strings: Optional[List[str]] = None
+    ) -> str:
+        """
+        Genera respuesta usando el modelo
+
+        Args:
+            prompt: Texto de entrada
+            max_tokens: Máximo de tokens a generar
+            temperature: Control de aleatoriedad (0.0-2.0)
+            top_p: Nucleus sampling
+            repetition_penalty: Penalización por repetición
+            stop_strings: Strings que detienen la generación
+
+        Returns:
+            str: Texto generado
+        """
+        if not self.is_loaded:
+            raise RuntimeError("Modelo no cargado. Llama a load_model() primero")
+
+        try:
+            # Mismo bucle que el streaming: se detiene en el stop string
+            response = "".join(self.generate_stream(
+                prompt=prompt,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                repetition_penalty=repetition_penalty,
+                stop_strings=stop_strings
+            ))
+
+            return response.strip()
+
+        except Exception as e:
+            logger.error(f"❌ Error generando respuesta: {e}")
+            raise
+
+    def generate_chat(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        repetition_penalty: float = 1.1
+    ) -> str:
+        """
+        Genera respuesta en formato chat
+
+        Args:
+            messages: Lista de mensajes [{"role": "user/assistant", "content": "..."}]
+            max_tokens: Máximo de tokens a generar
+            temperature: Control de aleatoriedad
+            top_p: Nucleus sampling
+            repetition_penalty: Penalización por repetición
+
+        Returns:
+            str: Respuesta del asistente
+        """
+        if not self.is_loaded:
+            raise RuntimeError("Modelo no cargado. Llama a load_model() primero")
+
+        try:
+            return self.generate(
+                prompt=self.apply_chat_template(messages),
+                max_tokens=max_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                repetition_penalty=repetition_penalty,
+                stop_strings=QWEN_STOP_STRINGS
+            )
+
+        except Exception as e:
+            logger.error(f"❌ Error generando chat: {e}")
+            raise
+
+    def generate_stream(
+        self,
+        prompt: str,
+        max_tokens: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        repetition_penalty: float = 1.1,
+        stop_strings: Optional[List[str]] = None
+    ) -> Iterator[str]:
+        """
+        Genera respuesta en streaming
+
+        Args:
+            prompt: Texto de entrada
+            max_tokens: Máximo de tokens a generar
+            temperature: Control de aleatoriedad (0.0-2.0)
+            top_p: Nucleus sampling
+            repetition_penalty: Penalización por repetición
+            stop_strings: Strings que detienen la generación
+
+        Yields:
+            str: Fragmentos de texto a medida que se decodifican
+        """
+        if not self.is_loaded:
+            raise RuntimeError("Modelo no cargado. Llama a load_model() primero")
+
+        matcher = StopSequenceMatcher(stop_strings)
+        generated = 0
+
+        stream = self._stream_text(prompt, max_tokens, temperature, top_p)
+        try:
+            for text in stream:
+                generated += 1
+                delta = matcher.feed(text)
+                if delta:
+                    yield delta
+                if matcher.stopped:
+                    # Cortar aquí: no se decodifica ningún token más
+                    self.early_stops += 1
+                    self.tokens_saved += max(max_tokens - generated, 0)
+                    return
+
+            delta = matcher.flush()
+            if delta:
+                yield delta
+        finally:
+            close = getattr(stream, "close", None)
+            if close:
+                close()
+
+    def generate_chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        repetition_penalty: float = 1.1
+    ) -> Iterator[str]:
+        """
+        Genera respuesta en formato chat, token a token
+
+        Args:
+            messages: Lista de mensajes [{"role": "user/assistant", "content": "..."}]
+            max_tokens: Máximo de tokens a generar
+            temperature: Control de aleatoriedad
+            top_p: Nucleus sampling
+            repetition_penalty: Penalización por repetición
+
+        Yields:
+            str: Fragmentos de la respuesta del asistente
+        """
+        if not self.is_loaded:
+            raise RuntimeError("Modelo no cargado. Llama a load_model() primero")
+
+        yield from self.generate_stream(
+            prompt=self.apply_chat_template(messages),
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            repetition_penalty=repetition_penalty,
+            stop_strings=QWEN_STOP_STRINGS
+        )
+
+    def build_chat_request(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        session_id: Optional[str] = None,
+        adapter: Optional[str] = None
+    ) -> GenerationRequest:
+        """
+        Prepara una petición de chat para el scheduler de batching continuo
+
+        Args:
+            messages: Lista de mensajes [{"role": "user/assistant", "content": "..."}]
+            max_tokens: Máximo de tokens a generar
+            temperature: Control de aleatoriedad
+            top_p: Nucleus sampling
+            session_id: Sesión cuyo KV-cache se reutiliza entre turnos
+            adapter: Adaptador LoRA (None = modelo base)
+
+        Returns:
+            GenerationRequest con el prompt tokenizado
+
+        Raises:
+            AdapterError: si el adaptador no existe o el backend no los admite
+        """
+        if not self.is_loaded:
+            raise RuntimeError("Modelo no cargado. Llama a load_model() primero")
+
+        prompt_tokens = self.encode(self.apply_chat_template(messages))
+
+        return self.build_request(
+            prompt_tokens,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            session_id=session_id,
+            adapter=adapter,
+            shared_prefix_len=self._shared_prefix_len(messages, prompt_tokens)
+        )
+
+    def build_request(
+        self,
+        prompt_tokens: List[int],
+        max_tokens: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        session_id: Optional[str] = None,
+        adapter: Optional[str] = None,
+        shared_prefix_len: Optional[int] = None,
+        output_filter: Optional[Callable[[str], List[str]]] = None
+    ) -> GenerationRequest:
+        """
+        Prepara una petición a partir de un prompt ya tokenizado
+
+        Evita re-tokenizar el historial cuando el llamador mantiene los
+        token ids (SessionManager.render_prompt).
+
+        Args:
+            prompt_tokens: Prompt completo, con la cabecera de generación
+            shared_prefix_len: Tokens del prefijo de sistema compartible;
+                None lo detecta comparando con el prompt de sistema cacheado
+            output_filter: Validación incremental del texto generado
+                (p.ej. StreamingContentFilter.feed); corta al primer fallo
+
+        Raises:
+            AdapterError: si el adaptador no existe o el backend no los admite
+        """
+        if not self.is_loaded:
+            raise RuntimeError("Modelo no cargado. Llama a load_model() primero")
+
+        self.check_adapter(adapter)
+
+        if shared_prefix_len is None:
+            shared_prefix_len = self._token_prefix_len(prompt_tokens)
+
+        return GenerationRequest(
+            prompt_tokens=prompt_tokens,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            stop_strings=list(QWEN_STOP_STRINGS),
+            session_id=session_id,
+            shared_prefix_len=shared_prefix_len,
+            adapter=adapter,
+            output_filter=output_filter
+        )
+
+    def _system_prefix_tokens(self, system_prompt: str) -> List[int]:
+        """Tokens del bloque de sistema tal como lo renderiza el chat template"""
+        text = self.apply_chat_template(
+            [{"role": "system", "content": system_prompt}],
+            add_generation_prompt=False
+        )
+        return self.encode(text)
+
+    def _shared_prefix_len(self, messages: List[Dict[str, str]], prompt_tokens: List[int]) -> int:
+        """Longitud del prefijo de sistema compartible (0 si no aplica)"""
+        if not messages or messages[0]["role"] != "system":
+            return 0
+
+        content = messages[0]["content"]
+        if self._system_prefix is None or self._system_prefix[0] != content:
+            self._system_prefix = (content, self._system_prefix_tokens(content))
+        return self._token_prefix_len(prompt_tokens)
+
+    def _token_prefix_len(self, prompt_tokens: List[int]) -> int:
+        """Longitud del prefijo de sistema cacheado si el prompt empieza por él"""
+        if self._system_prefix is None:
+            return 0
+        prefix = self._system_prefix[1]
+        # El template podría fusionar tokens en la frontera: validar
+        if prompt_tokens[:len(prefix)] != prefix:
+            return 0
+        return len(prefix)
+
+    def warm_prefix_cache(self, system_prompt: str) -> bool:
+        """
+        Calcula el KV del prompt de sistema una vez (al arrancar)
+
+        Args:
+            system_prompt: Prompt de sistema común a todas las sesiones
+
+        Returns:
+            bool: True si el prefijo quedó cacheado
+        """
+        if not self.is_loaded or self.scheduler is None:
+            return False
+
+        self._system_prefix = (system_prompt, self._system_prefix_tokens(system_prompt))
+        return self.scheduler.warm_prefix(self._system_prefix[1])
+
+    def check_adapter(self, adapter: Optional[str]):
+        """Lanza AdapterError si el adaptador no se puede usar"""
+        if adapter is None:
+            return
+        if self.adapters is None:
+            raise AdapterError(f"El backend {self.name} no admite adaptadores LoRA")
+        self.adapters.validate(adapter)
+
+    def list_adapters(self) -> Dict[str, Any]:
+        """Adaptadores disponibles, residentes y activo"""
+        if self.adapters is None:
+            return {"enabled": False, "available": [], "active": None}
+        return {
+            "enabled": True,
+            "available": self.adapters.available(),
+            "active": self.scheduler.active_adapter if self.scheduler else None,
+            **self.adapters.get_stats()
+        }
+
+    def drop_session(self, session_id: str):
+        """Libera el KV-cache de una sesión que ya no existe"""
+        dropped = self.prompt_cache.drop(session_id)
+        if dropped:
+            logger.info(f"🗑️  Prompt cache liberado: {session_id} ({dropped})")
+
+    def unload_adapter(self, name: str) -> bool:
+        """Libera de memoria un adaptador residente (sin reiniciar)"""
+        if self.adapters is None:
+            return False
+        return self.adapters.unload(name)
+
+    def cleanup(self):
+        """Libera recursos del modelo"""
+        if self.is_loaded:
+            logger.info("🧹 Liberando recursos del modelo...")
+            self.model = None
+            self.tokenizer = None
+            self.scheduler = None
+            self.prompt_cache = SessionPromptCache(max_bytes=self.prompt_cache.max_bytes)
+            self._system_prefix = None
+            self.is_loaded = False
+            self._release()
+            logger.info("✅ Recursos liberados")
+
+    def get_model_info(self) -> Dict[str, Any]:
+        """
+        Obtiene información del modelo
+
+        Returns:
+            Dict con información del modelo
+        """
+        if not self.is_loaded:
+            return {"loaded": False, "backend": self.name}
+
+        return {
+            "loaded": True,
+            "backend": self.name,
+            **self._describe(),
+            "batching": self.scheduler.get_stats() if self.scheduler else None,
+            # Medido sobre las últimas peticiones, no estimado
+            "performance": self.scheduler.live_stats.snapshot() if self.scheduler else None,
+            "adapters": self.adapters.get_stats() if self.adapters else None,
+            "stop_sequences": {
+                "early_stops": self.early_stops,
+                "tokens_saved": self.tokens_saved,
+            }
+        }
+
+
+def resolve_backend_name(name: str) -> str:
+    """Traduce "auto" al backend disponible en esta máquina"""
+    name = name.lower()
+    if name != "auto":
+        if name not in MODEL_BACKENDS:
+            raise ValueError(f"Backend desconocido: {name} (opciones: auto, {', '.join(MODEL_BACKENDS)})")
+        return name
+
+    if importlib.util.find_spec("mlx_lm") is not None:
+        return "mlx"
+    if importlib.util.find_spec("llama_cpp") is not None:
+        return "llamacpp"
+    return "stub"
+
+
+def create_model_backend(settings) -> ModelBackend:
+    """
+    Crea el backend indicado en Settings.MODEL_BACKEND
+
+    Solo se importa el módulo del backend elegido.
+
+    Args:
+        settings: Configuración de la aplicación
+
+    Returns:
+        ModelBackend sin cargar (llamar a load_model())
+    """
+    name = resolve_backend_name(settings.MODEL_BACKEND)
+    common = dict(
+        max_batch_size=settings.MAX_BATCH_SIZE,
+        prompt_cache_max_mb=settings.PROMPT_CACHE_MAX_MB
+    )
+    logger.info(f"🧩 Backend de inferencia: {name}")
+
+    if name == "mlx":
+        from app.core.model_manager_mlx import ModelManagerMLX
+        return ModelManagerMLX(
+            draft_model_path=settings.DRAFT_MODEL_PATH or None,
+            num_draft_tokens=settings.NUM_DRAFT_TOKENS,
+            lora_path=resolve_project_path(settings.LORA_PATH),
+            max_resident_adapters=settings.MAX_RESIDENT_ADAPTERS,
+            **common
+        )
+
+    if name == "llamacpp":
+        from app.core.llamacpp_backend import LlamaCppBackend
+        return LlamaCppBackend(
+            model_path=resolve_project_path(settings.GGUF_MODEL_PATH),
+            quantization=settings.QUANTIZATION,
+            n_ctx=settings.MAX_CONTEXT_LENGTH,
+            n_threads=settings.LLAMA_N_THREADS or None,
+            **common
+        )
+
+    from app.core.stub_backend import StubModelBackend
+    return StubModelBackend(
+        token_delay=settings.STUB_TOKEN_DELAY_MS / 1000,
+        lora_path=resolve_project_path(settings.LORA_PATH),
+        max_resident_adapters=settings.MAX_RESIDENT_ADAPTERS,
+        **common
+    )
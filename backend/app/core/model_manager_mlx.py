@@ -1,27 +1,419 @@
 """
 Gestor del modelo Qwen usando MLX (optimizado para Apple Silicon)
 """
+import inspect
 import logging
-from typing import Optional, List, Dict, Any
+from importlib.metadata import PackageNotFoundError, version
+from typing import Optional, List, Dict, Any, Iterator
 from pathlib import Path
-import mlx.core as mx
-from mlx_lm import load, generate
-from mlx_lm.sample_utils import make_sampler
+
+from app.core.batch_scheduler import (
+    BatchDecoder,
+    ContinuousBatchScheduler,
+    GenerationRequest,
+)
+from app.core.decoding import SpeculativeStats
+from app.core.lora_adapters import AdapterError, LoRAAdapterRegistry
+from app.core.model_backend import ModelBackend
+from app.core.prompt_cache import PromptCacheEntry, SharedPrefixCache
+
+try:
+    import mlx.core as mx
+    from mlx_lm import load, stream_generate
+    from mlx_lm.generate import BatchGenerator, speculative_generate_step
+    from mlx_lm.models.cache import can_trim_prompt_cache, make_prompt_cache, trim_prompt_cache
+    from mlx_lm.sample_utils import make_sampler
+    from mlx_lm.tuner.utils import linear_to_lora_layers, remove_lora_layers
+except ImportError:  # Linux/CI: MLX solo existe en Apple Silicon
+    mx = None
+    load = stream_generate = make_sampler = BatchGenerator = speculative_generate_step = None
+    can_trim_prompt_cache = make_prompt_cache = trim_prompt_cache = None
+    linear_to_lora_layers = remove_lora_layers = None
 
 logger = logging.getLogger(__name__)
 
-class ModelManagerMLX:
+# Primera versión de mlx-lm cuyo BatchGenerator tiene la API que usa
+# MLXBatchDecoder: insert(caches=, samplers=), next_generated() y
+# remove(return_prompt_caches=)
+MLX_LM_MIN_VERSION = "0.32.0"
+
+
+def _accepts(method, name: str) -> bool:
+    params = inspect.signature(method).parameters
+    return name in params or any(p.kind is inspect.Parameter.VAR_KEYWORD for p in params.values())
+
+
+def batch_generator_api_error(generator_cls) -> Optional[str]:
+    """
+    Motivo por el que el BatchGenerator instalado no sirve a MLXBatchDecoder
+    
+    Returns:
+        None si tiene toda la API necesaria
+    """
+    missing = []
+    insert = getattr(generator_cls, "insert", None)
+    if insert is None:
+        missing.append("insert()")
+    else:
+        missing += [f"insert({name}=)" for name in ("caches", "samplers") if not _accepts(insert, name)]
+    if not hasattr(generator_cls, "next_generated"):
+        missing.append("next_generated()")
+    remove = getattr(generator_cls, "remove", None)
+    if remove is None or not _accepts(remove, "return_prompt_caches"):
+        missing.append("remove(return_prompt_caches=)")
+    if not missing:
+        return None
+    
+    try:
+        installed = version("mlx-lm")
+    except PackageNotFoundError:
+        installed = "desconocida"
+    return (
+        f"mlx-lm {installed} no es compatible: a BatchGenerator le falta {', '.join(missing)}. "
+        f"Actualiza con: pip install -U 'mlx-lm>={MLX_LM_MIN_VERSION}'"
+    )
+
+
+# Falla al importar el backend, no con un AttributeError en la primera petición
+if BatchGenerator is not None:
+    _batch_api_error = batch_generator_api_error(BatchGenerator)
+    if _batch_api_error:
+        raise ImportError(_batch_api_error)
+
+
+def _reuse_prompt_cache(cached: PromptCacheEntry) -> Any:
+    """Recorta del cache los tokens que ya no coinciden con el prompt nuevo"""
+    extra = len(cached.tokens) - cached.reuse_tokens
+    if extra > 0:
+        if not can_trim_prompt_cache(cached.cache):
+            raise ValueError("Prompt cache no recortable")
+        trim_prompt_cache(cached.cache, extra)
+    return cached.cache
+
+
+def _cache_nbytes(cache) -> int:
+    return sum(getattr(c, "nbytes", 0) for c in cache)
+
+
+def _load_adapter_weights(path: Path):
+    """Pesos de un adaptador (adapters.safetensors) y su tamaño en bytes"""
+    weights = mx.load(str(path))
+    return weights, sum(w.nbytes for w in weights.values())
+
+
+class MLXLoRASwitcher:
+    """
+    Cambia en caliente el adaptador LoRA del modelo base
+    
+    Sustituye las capas lineales por capas LoRA (que envuelven las
+    originales, sin copiar los pesos base) y carga los pesos del
+    adaptador; volver al modelo base deshace la sustitución.
+    """
+    
+    def __init__(self, model, registry: LoRAAdapterRegistry):
+        self.model = model
+        self.registry = registry
+        self.active: Optional[str] = None
+    
+    def activate(self, name: Optional[str]):
+        if name == self.active:
+            return
+        
+        remove_lora_layers(self.model)
+        self.active = None
+        if name is None:
+            return
+        
+        adapter = self.registry.get(name)
+        config = adapter.config
+        try:
+            if config.get("fine_tune_type", "lora") != "lora":
+                raise AdapterError(f"Solo se admiten adaptadores LoRA ({name})")
+            linear_to_lora_layers(self.model, config["num_layers"], config["lora_parameters"])
+            self.model.load_weights(list(adapter.weights.items()), strict=False)
+            self.model.eval()  # Sin dropout de LoRA en inferencia
+        except Exception:
+            remove_lora_layers(self.model)
+            raise
+        self.active = name
+
+
+class MLXBatchDecoder(BatchDecoder):
+    """BatchDecoder sobre mlx_lm.BatchGenerator (un forward por paso para todo el batch)"""
+    
+    def __init__(self, model, tokenizer, max_batch_size: int = 8, lora: Optional[MLXLoRASwitcher] = None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.lora = lora
+        self.eos_token_ids = set(tokenizer.eos_token_ids)
+        self._generator = BatchGenerator(
+            model,
+            completion_batch_size=max_batch_size,
+            prefill_batch_size=max_batch_size
+        )
+        self._uid_to_seq: Dict[int, int] = {}
+        self._seq_to_uid: Dict[int, int] = {}
+        self._prompts: Dict[int, List[int]] = {}
+        self._generated: Dict[int, List[int]] = {}
+    
+    def add(
+        self,
+        seq_id: int,
+        request: GenerationRequest,
+        cached: Optional[PromptCacheEntry] = None
+    ):
+        sampler = make_sampler(temp=request.temperature, top_p=request.top_p)
+        prompt = request.prompt_tokens
+        caches = None
+        
+        if cached is not None:
+            caches = [_reuse_prompt_cache(cached)]
+            prompt = prompt[cached.reuse_tokens:]
+        
+        # +1: el scheduler decide cuándo parar; el generador solo acota
+        (uid,) = self._generator.insert(
+            [prompt],
+            max_tokens=[request.max_tokens + 1],
+            caches=caches,
+            samplers=[sampler]
+        )
+        self._uid_to_seq[uid] = seq_id
+        self._seq_to_uid[seq_id] = uid
+        self._prompts[seq_id] = list(request.prompt_tokens)
+        self._generated[seq_id] = []
+    
+    def step(self) -> Dict[int, int]:
+        tokens = {}
+        for response in self._generator.next_generated():
+            seq_id = self._uid_to_seq.get(response.uid)
+            if seq_id is None:
+                continue
+            tokens[seq_id] = response.token
+            self._generated[seq_id].append(response.token)
+            if response.finish_reason is not None:
+                # El generador ya la retiró del batch
+                del self._uid_to_seq[response.uid]
+                del self._seq_to_uid[seq_id]
+        return tokens
+    
+    def remove(self, seq_id: int) -> Optional[PromptCacheEntry]:
+        prompt = self._prompts.pop(seq_id, [])
+        generated = self._generated.pop(seq_id, [])
+        uid = self._seq_to_uid.pop(seq_id, None)
+        if uid is None:
+            return None
+        del self._uid_to_seq[uid]
+        
+        extracted = self._generator.remove([uid], return_prompt_caches=True)
+        if uid not in extracted or not generated:
+            return None
+        
+        cache = extracted[uid][0]
+        # El último token muestreado aún no pasó por el modelo
+        return PromptCacheEntry(
+            tokens=prompt + generated[:-1],
+            cache=cache,
+            nbytes=_cache_nbytes(cache)
+        )
+    
+    def set_adapter(self, name: Optional[str]):
+        if self.lora is None:
+            return super().set_adapter(name)
+        self.lora.activate(name)
+    
+    def decode(self, tokens: List[int]) -> str:
+        return self.tokenizer.decode(tokens)
+    
+    def build_prefix_cache(self, tokens: List[int]) -> Optional[PromptCacheEntry]:
+        cache = make_prompt_cache(self.model)
+        self.model(mx.array(tokens)[None], cache=cache)
+        mx.eval([c.state for c in cache])
+        return PromptCacheEntry(
+            tokens=list(tokens),
+            cache=cache,
+            nbytes=_cache_nbytes(cache)
+        )
+
+
+class _DraftSequence:
+    """Secuencia con su propio generador especulativo y KV-cache"""
+    
+    def __init__(self, generator, cache, prompt: List[int], tracker):
+        self.generator = generator
+        self.cache = cache
+        self.prompt = prompt
+        self.tracker = tracker
+        self.generated: List[int] = []
+        self.pending: Optional[int] = None
+
+
+class MLXSpeculativeDecoder(BatchDecoder):
+    """
+    BatchDecoder con decodificación especulativa (modelo borrador)
+    
+    El borrador propone k tokens y el modelo principal los verifica en un
+    solo forward. mlx_lm no combina la especulación con BatchGenerator, así
+    que cada secuencia lleva su propio generador y los pasos las recorren
+    por turnos: baja la latencia con pocas sesiones a costa del throughput
+    con muchas.
+    
+    El KV-cache de cada secuencia es la lista [capas del principal] +
+    [capas del borrador], y así se guarda en el SessionPromptCache.
+    """
+    
+    def __init__(
+        self,
+        model,
+        draft_model,
+        tokenizer,
+        num_draft_tokens: int,
+        stats: SpeculativeStats,
+        lora: Optional[MLXLoRASwitcher] = None
+    ):
+        self.model = model
+        self.lora = lora
+        self.draft_model = draft_model
+        self.tokenizer = tokenizer
+        self.num_draft_tokens = num_draft_tokens
+        self.stats = stats
+        self.eos_token_ids = set(tokenizer.eos_token_ids)
+        self._sequences: Dict[int, _DraftSequence] = {}
+    
+    def add(
+        self,
+        seq_id: int,
+        request: GenerationRequest,
+        cached: Optional[PromptCacheEntry] = None
+    ):
+        prompt = request.prompt_tokens
+        if cached is not None:
+            cache = _reuse_prompt_cache(cached)
+            prompt = prompt[cached.reuse_tokens:]
+        else:
+            cache = self._make_cache()
+        
+        # +1: el scheduler decide cuándo parar; el generador solo acota
+        max_tokens = request.max_tokens + 1
+        generator = speculative_generate_step(
+            mx.array(prompt),
+            self.model,
+            self.draft_model,
+            num_draft_tokens=self.num_draft_tokens,
+            max_tokens=max_tokens,
+            sampler=make_sampler(temp=request.temperature, top_p=request.top_p),
+            prompt_cache=cache
+        )
+        seq = _DraftSequence(generator, cache, list(request.prompt_tokens), self.stats.tracker(max_tokens))
+        
+        # Prefill ahora: un cache inservible falla aquí y no en step()
+        seq.pending = self._next(seq)
+        self._sequences[seq_id] = seq
+    
+    def step(self) -> Dict[int, int]:
+        tokens = {}
+        for seq_id, seq in self._sequences.items():
+            token = seq.pending if seq.pending is not None else self._next(seq)
+            seq.pending = None
+            if token is None:
+                continue
+            seq.generated.append(token)
+            tokens[seq_id] = token
+        return tokens
+    
+    def remove(self, seq_id: int) -> Optional[PromptCacheEntry]:
+        seq = self._sequences.pop(seq_id, None)
+        if seq is None:
+            return None
+        
+        # Cerrar el generador rebobina los tokens de borrador rechazados
+        seq.generator.close()
+        if not seq.generated:
+            return None
+        
+        # El principal puede ir por delante (ronda a medio consumir) y el
+        # borrador un token por detrás: quedarse con el prefijo común
+        tokens = seq.prompt + seq.generated[:-1]
+        n_layers = len(self.model.layers)
+        parts = [seq.cache[:n_layers], seq.cache[n_layers:]]
+        keep = min([len(tokens)] + [part[0].offset for part in parts])
+        for part in parts:
+            extra = part[0].offset - keep
+            if extra > 0:
+                trim_prompt_cache(part, extra)
+        
+        return PromptCacheEntry(
+            tokens=tokens[:keep],
+            cache=seq.cache,
+            nbytes=_cache_nbytes(seq.cache)
+        )
+    
+    def set_adapter(self, name: Optional[str]):
+        if self.lora is None:
+            return super().set_adapter(name)
+        self.lora.activate(name)
+    
+    def decode(self, tokens: List[int]) -> str:
+        return self.tokenizer.decode(tokens)
+    
+    def build_prefix_cache(self, tokens: List[int]) -> Optional[PromptCacheEntry]:
+        cache = self._make_cache()
+        n_layers = len(self.model.layers)
+        prompt = mx.array(tokens)[None]
+        self.model(prompt, cache=cache[:n_layers])
+        self.draft_model(prompt, cache=cache[n_layers:])
+        mx.eval([c.state for c in cache])
+        return PromptCacheEntry(
+            tokens=list(tokens),
+            cache=cache,
+            nbytes=_cache_nbytes(cache)
+        )
+    
+    def _make_cache(self) -> list:
+        return make_prompt_cache(self.model) + make_prompt_cache(self.draft_model)
+    
+    def _next(self, seq: _DraftSequence) -> Optional[int]:
+        try:
+            token, _, from_draft = next(seq.generator)
+        except StopIteration:
+            return None
+        seq.tracker.observe(from_draft)
+        return int(token)
+
+
+class ModelManagerMLX(ModelBackend):
     """Gestor del modelo Qwen2.5-7B usando MLX"""
     
-    def __init__(self, model_path: str = None):
+    name = "mlx"
+    
+    def __init__(
+        self,
+        model_path: str = None,
+        max_batch_size: int = 8,
+        prompt_cache_max_mb: int = 1024,
+        draft_model_path: Optional[str] = None,
+        num_draft_tokens: int = 3,
+        lora_path: Optional[Path] = None,
+        max_resident_adapters: int = 4
+    ):
+        super().__init__(max_batch_size=max_batch_size, prompt_cache_max_mb=prompt_cache_max_mb)
         if model_path is None:
             # Buscar modelo relativo al directorio del proyecto
             project_root = Path(__file__).parent.parent.parent.parent
             model_path = project_root / "models" / "qwen2.5-7b-mlx"
         self.model_path = Path(model_path)
-        self.model = None
-        self.tokenizer = None
-        self.is_loaded = False
+        
+        # Decodificación especulativa (opcional)
+        self.draft_model_path = Path(draft_model_path) if draft_model_path else None
+        self.draft_model = None
+        self.speculative_stats = SpeculativeStats(num_draft_tokens)
+        
+        # Adaptadores LoRA sobre el mismo modelo base
+        if lora_path is not None:
+            self.adapters = LoRAAdapterRegistry(
+                lora_path,
+                _load_adapter_weights,
+                max_resident=max_resident_adapters
+            )
         
     def load_model(self) -> bool:
         """
@@ -31,6 +423,10 @@ class ModelManagerMLX:
             bool: True si se cargó exitosamente
         """
         try:
+            if load is None:
+                logger.error("mlx_lm no disponible en esta plataforma")
+                return False
+            
             if not self.model_path.exists():
                 logger.error(f"Modelo no encontrado en {self.model_path}")
                 return False
@@ -40,6 +436,28 @@ class ModelManagerMLX:
             # MLX carga modelo y tokenizer automáticamente
             self.model, self.tokenizer = load(str(self.model_path))
             
+            lora = MLXLoRASwitcher(self.model, self.adapters) if self.adapters else None
+            self._load_draft_model()
+            if self.draft_model is not None:
+                decoder = MLXSpeculativeDecoder(
+                    self.model,
+                    self.draft_model,
+                    self.tokenizer,
+                    self.speculative_stats.num_draft_tokens,
+                    self.speculative_stats,
+                    lora=lora
+                )
+            else:
+                # Batching continuo para sesiones concurrentes
+                decoder = MLXBatchDecoder(self.model, self.tokenizer, self.max_batch_size, lora=lora)
+            
+            self.scheduler = ContinuousBatchScheduler(
+                decoder,
+                max_batch_size=self.max_batch_size,
+                prompt_cache=self.prompt_cache,
+                prefix_cache=SharedPrefixCache()  # nuevo por modelo cargado
+            )
+            
             self.is_loaded = True
             logger.info("✅ Modelo cargado exitosamente")
             
@@ -53,144 +471,109 @@ class ModelManagerMLX:
             logger.error(f"❌ Error cargando modelo: {e}")
             return False
     
-    def generate(
-        self,
-        prompt: str,
-        max_tokens: int = 512,
-        temperature: float = 0.7,
-        top_p: float = 0.9,
-        repetition_penalty: float = 1.1,
-        stop_strings: Optional[List[str]] = None
-    ) -> str:
-        """
-        Genera respuesta usando el modelo
-        
-        Args:
-            prompt: Texto de entrada
-            max_tokens: Máximo de tokens a generar
-            temperature: Control de aleatoriedad (0.0-2.0)
-            top_p: Nucleus sampling
-            repetition_penalty: Penalización por repetición
-            stop_strings: Strings que detienen la generación
-            
-        Returns:
-            str: Texto generado
-        """
-        if not self.is_loaded:
-            raise RuntimeError("Modelo no cargado. Llama a load_model() primero")
+    def _load_draft_model(self):
+        """Carga el modelo borrador; si no es utilizable se sigue sin él"""
+        self.draft_model = None
+        if self.draft_model_path is None:
+            return
+        
+        if not self.draft_model_path.exists():
+            logger.warning(f"⚠️  Modelo borrador no encontrado en {self.draft_model_path}: sin decodificación especulativa")
+            return
         
         try:
-            # Crear sampler con parámetros (MLX usa temp/top_p directamente)
-            sampler = make_sampler(
-                temp=temperature,
-                top_p=top_p
-            )
-            
-            # MLX genera directamente
-            response = generate(
-                self.model,
-                self.tokenizer,
-                prompt=prompt,
-                max_tokens=max_tokens,
-                sampler=sampler,
-                verbose=False
-            )
-            
-            # Limpiar prompt de la respuesta si viene incluido
-            if response.startswith(prompt):
-                response = response[len(prompt):].strip()
-            
-            # Aplicar stop strings si se especifican
-            if stop_strings:
-                for stop in stop_strings:
-                    if stop in response:
-                        response = response[:response.index(stop)]
-            
-            return response.strip()
-            
+            draft_model, draft_tokenizer = load(str(self.draft_model_path))
         except Exception as e:
-            logger.error(f"❌ Error generando respuesta: {e}")
-            raise
+            logger.warning(f"⚠️  Error cargando modelo borrador: {e}: sin decodificación especulativa")
+            return
+        
+        # Los tokens del borrador se verifican tal cual: mismo vocabulario
+        if draft_tokenizer.vocab_size != self.tokenizer.vocab_size:
+            logger.warning("⚠️  El modelo borrador usa otro vocabulario: sin decodificación especulativa")
+            return
+        
+        self.draft_model = draft_model
+        logger.info(
+            f"🚀 Decodificación especulativa activa "
+            f"({self.draft_model_path.name}, k={self.speculative_stats.num_draft_tokens})"
+        )
     
-    def generate_chat(
+    def apply_chat_template(
         self,
         messages: List[Dict[str, str]],
-        max_tokens: int = 512,
-        temperature: float = 0.7,
-        top_p: float = 0.9,
-        repetition_penalty: float = 1.1
+        add_generation_prompt: bool = True
     ) -> str:
-        """
-        Genera respuesta en formato chat
-        
-        Args:
-            messages: Lista de mensajes [{"role": "user/assistant", "content": "..."}]
-            max_tokens: Máximo de tokens a generar
-            temperature: Control de aleatoriedad
-            top_p: Nucleus sampling
-            repetition_penalty: Penalización por repetición
-            
-        Returns:
-            str: Respuesta del asistente
-        """
-        if not self.is_loaded:
-            raise RuntimeError("Modelo no cargado. Llama a load_model() primero")
-        
-        try:
-            # Aplicar chat template de Qwen
-            prompt = self.tokenizer.apply_chat_template(
-                messages,
-                tokenize=False,
-                add_generation_prompt=True
-            )
-            
-            # Generar con stop strings de Qwen
-            response = self.generate(
-                prompt=prompt,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                top_p=top_p,
-                repetition_penalty=repetition_penalty,
-                stop_strings=["<|im_end|>", "<|endoftext|>"]
-            )
-            
-            return response
-            
-        except Exception as e:
-            logger.error(f"❌ Error generando chat: {e}")
-            raise
+        return self.tokenizer.apply_chat_template(
+            messages,
+            tokenize=False,
+            add_generation_prompt=add_generation_prompt
+        )
     
-    def cleanup(self):
-        """Libera recursos del modelo"""
-        if self.is_loaded:
-            logger.info("🧹 Liberando recursos del modelo...")
-            self.model = None
-            self.tokenizer = None
-            self.is_loaded = False
-            
-            # MLX libera memoria automáticamente
-            mx.metal.clear_cache()
-            
-            logger.info("✅ Recursos liberados")
+    def encode(self, text: str) -> List[int]:
+        return self.tokenizer.encode(text)
     
-    def get_model_info(self) -> Dict[str, Any]:
-        """
-        Obtiene información del modelo
+    def _stream_text(
+        self,
+        prompt: str,
+        max_tokens: int,
+        temperature: float,
+        top_p: float
+    ) -> Iterator[str]:
+        # Crear sampler con parámetros (MLX usa temp/top_p directamente)
+        sampler = make_sampler(
+            temp=temperature,
+            top_p=top_p
+        )
         
-        Returns:
-            Dict con información del modelo
-        """
-        if not self.is_loaded:
-            return {"loaded": False}
+        kwargs = {}
+        tracker = None
+        if self.draft_model is not None:
+            kwargs = dict(
+                draft_model=self.draft_model,
+                num_draft_tokens=self.speculative_stats.num_draft_tokens
+            )
+            tracker = self.speculative_stats.tracker(max_tokens)
         
+        for chunk in stream_generate(
+            self.model,
+            self.tokenizer,
+            prompt=prompt,
+            max_tokens=max_tokens,
+            sampler=sampler,
+            **kwargs
+        ):
+            if tracker is not None:
+                tracker.observe(chunk.from_draft)
+            yield chunk.text
+    
+    def _release(self):
+        self.draft_model = None
+        # MLX libera memoria automáticamente
+        mx.metal.clear_cache()
+    
+    def _memory_gb(self) -> Optional[Dict[str, float]]:
+        """Memoria Metal en uso y pico desde el arranque (pesos + KV-caches)"""
+        if mx is None:
+            return None
+        # mlx >= 0.24 expone los contadores en mx; antes, en mx.metal
+        source = mx if hasattr(mx, "get_active_memory") else mx.metal
+        return {
+            "active": round(source.get_active_memory() / 1e9, 2),
+            "peak": round(source.get_peak_memory() / 1e9, 2),
+        }
+    
+    def _describe(self) -> Dict[str, Any]:
         return {
-            "loaded": True,
             "model_path": str(self.model_path),
             "framework": "MLX",
             "device": "Apple Silicon (Metal)",
             "quantization": "4-bit",
-            "estimated_memory_gb": 5,
-            "estimated_tokens_per_sec": "15-25"
+            "memory_gb": self._memory_gb(),
+            "speculative": {
+                "enabled": self.draft_model is not None,
+                "draft_model": self.draft_model_path.name if self.draft_model_path else None,
+                **self.speculative_stats.get_stats()
+            }
         }
 
 
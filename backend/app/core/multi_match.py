@@ -0,0 +1,198 @@
+"""
+Multi Match - Búsqueda de muchas reglas en una sola pasada por el texto
+
+Los guardrails comprobaban cada keyword con `in` y cada regex con
+`search`: O(reglas × texto). Aquí todas las reglas comparten un autómata
+Aho-Corasick que recorre el texto una vez, con un coste que no depende del
+número de reglas:
+
+- Las keywords entran tal cual en el autómata.
+- De cada regex se extrae un literal obligatorio (o varios alternativos:
+  `(cortar|lastimar)me` -> "cortar", "lastimar"); la regex solo se ejecuta
+  si alguno aparece. Las regex sin literal extraíble se ejecutan siempre.
+
+La búsqueda del autómata es sobre el texto plegado (casefold), así que es
+un superconjunto de lo que encontraría `re` con o sin IGNORECASE; después
+cada candidata se confirma con la comprobación original (`in` sobre el
+texto en minúsculas o `pattern.search`). El resultado es exactamente el de
+los bucles por regla, en el orden original de las reglas.
+
+Unir las regex en una alternancia con grupos con nombre no sirve con el
+motor de `re`: prueba cada alternativa en cada posición (el coste sigue
+siendo O(reglas × texto)) y con muchos grupos se vuelve cuadrático.
+"""
+
+import re
+from collections import deque
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+# Equivalencias de re.IGNORECASE que casefold() no unifica (İ -> "i̇", ı -> "ı");
+# sin el punto combinante, fold(text.lower()) == fold(text) también para "İ"
+_FOLD_EXTRA = str.maketrans({"İ": "i", "ı": "i", "\u0307": None})
+
+_LITERAL = sre_parse.LITERAL
+_SUBPATTERN = sre_parse.SUBPATTERN
+_BRANCH = sre_parse.BRANCH
+
+
+def fold(text: str) -> str:
+    """Plegado de mayúsculas compatible con re.IGNORECASE (para prefiltrar)"""
+    return text.translate(_FOLD_EXTRA).casefold()
+
+
+class KeywordAutomaton:
+    """Aho-Corasick sobre subcadenas literales (sensible a mayúsculas)"""
+
+    def __init__(self, keywords: Sequence[str]):
+        self.keywords = list(keywords)
+        self._always = [i for i, k in enumerate(self.keywords) if not k]
+
+        # Trie: goto[estado][carácter] -> estado; out[estado] -> índices de keyword
+        goto: List[Dict[str, int]] = [{}]
+        out: List[List[int]] = [[]]
+        for index, keyword in enumerate(self.keywords):
+            if not keyword:
+                continue
+            state = 0
+            for char in keyword:
+                nxt = goto[state].get(char)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][char] = nxt
+                    goto.append({})
+                    out.append([])
+                state = nxt
+            out[state].append(index)
+
+        # Enlaces de fallo en BFS y transiciones completas (DFA): el bucle de
+        # búsqueda hace un único dict.get por carácter
+        fail = [0] * len(goto)
+        delta: List[Dict[str, int]] = [dict(goto[0])]
+        delta.extend({} for _ in range(len(goto) - 1))
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            out[state] = out[state] + out[fail[state]]
+            # Transiciones heredadas del estado de fallo, sobrescritas por las propias
+            delta[state] = dict(delta[fail[state]])
+            for char, nxt in goto[state].items():
+                fail[nxt] = delta[fail[state]].get(char, 0)
+                delta[state][char] = nxt
+                queue.append(nxt)
+
+        self._delta = delta
+        self._out = [tuple(o) for o in out]
+
+    def __len__(self) -> int:
+        return len(self.keywords)
+
+    def find(self, text: str) -> List[int]:
+        """Índices (ordenados) de las keywords que aparecen en `text`"""
+        delta = self._delta
+        out = self._out
+        found = set(self._always)
+        state = 0
+        for char in text:
+            state = delta[state].get(char, 0)
+            if out[state]:
+                found.update(out[state])
+        return sorted(found)
+
+
+def _sequence_literals(items) -> Optional[List[str]]:
+    """Mejor conjunto de literales obligatorios de una secuencia de la regex"""
+    options = []
+    run = []
+    for op, av in items:
+        if op is _LITERAL:
+            run.append(chr(av))
+            continue
+        if run:
+            options.append(["".join(run)])
+            run = []
+        if op is _SUBPATTERN:
+            inner = _sequence_literals(av[-1])
+            if inner:
+                options.append(inner)
+        elif op is _BRANCH:
+            branches = [_sequence_literals(branch) for branch in av[1]]
+            if all(branches):
+                options.append([lit for branch in branches for lit in branch])
+    if run:
+        options.append(["".join(run)])
+    if not options:
+        return None
+    # El conjunto cuyo literal más corto es más largo filtra mejor
+    return max(options, key=lambda lits: (min(len(lit) for lit in lits), -len(lits)))
+
+
+def required_literals(pattern: str, flags: int = 0) -> Optional[List[str]]:
+    """
+    Literales de los que al menos uno aparece en todo texto que encaja con `pattern`
+
+    Returns:
+        Lista de literales alternativos, o None si no se puede garantizar ninguno
+    """
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except re.error:
+        return None
+    literals = _sequence_literals(list(parsed))
+    if not literals or not all(literals):
+        return None
+    return literals
+
+
+class RuleMatcher:
+    """
+    Keywords (subcadena del texto en minúsculas) y regex en una sola pasada
+
+    match() devuelve los mismos índices que:
+        [i for i, k in enumerate(keywords) if k in text.lower()]
+        [i for i, p in enumerate(compiled) if p.search(text)]
+    """
+
+    def __init__(self, keywords: Sequence[str] = (), patterns: Sequence[str] = (), flags: int = re.IGNORECASE):
+        self.keywords = list(keywords)
+        self.patterns = list(patterns)
+        self.compiled = [re.compile(p, flags) for p in self.patterns]
+
+        # Literal plegado -> reglas candidatas (("k", i) keyword, ("p", i) regex)
+        owners: Dict[str, List[Tuple[str, int]]] = {}
+        for i, keyword in enumerate(self.keywords):
+            owners.setdefault(fold(keyword), []).append(("k", i))
+        self.always_patterns = []
+        for i, pattern in enumerate(self.patterns):
+            literals = required_literals(pattern, flags)
+            if literals is None:
+                self.always_patterns.append(i)
+                continue
+            for literal in {fold(lit) for lit in literals}:
+                owners.setdefault(literal, []).append(("p", i))
+
+        self._literals = list(owners)
+        self._owners = [owners[lit] for lit in self._literals]
+        self.automaton = KeywordAutomaton(self._literals)
+
+    def match(self, text: str) -> Tuple[List[int], List[int]]:
+        """(índices de keywords, índices de regex) que encajan con `text`"""
+        keyword_candidates = set()
+        pattern_candidates = set(self.always_patterns)
+        for literal_index in self.automaton.find(fold(text)):
+            for kind, i in self._owners[literal_index]:
+                if kind == "k":
+                    keyword_candidates.add(i)
+                else:
+                    pattern_candidates.add(i)
+
+        keywords = []
+        if keyword_candidates:
+            text_lower = text.lower()
+            keywords = [i for i in sorted(keyword_candidates) if self.keywords[i] in text_lower]
+        patterns = [i for i in sorted(pattern_candidates) if self.compiled[i].search(text)]
+        return keywords, patterns
@@ -0,0 +1,120 @@
+"""
+Sampling Profiler - Perfil estadístico de 1 de cada N peticiones
+
+Opcional (PROFILE_SAMPLE_EVERY > 0). Mientras dura una petición
+muestreada, un hilo toma las pilas de todos los hilos del proceso
+(sys._current_frames) cada `interval` segundos; así se ven tanto el event
+loop (sesión, guardrails, render) como el hilo de inferencia (prefill,
+decode). Al terminar se escribe un fichero en formato "folded stacks":
+
+    MainThread;app/api/chat.py:send_message;app/core/guardrails.py:check_input 12
+
+que aceptan directamente flamegraph.pl, speedscope o inferno.
+
+Deshabilitado no hay coste: el middleware no crea el profiler. Habilitado,
+las peticiones no muestreadas solo incrementan un contador.
+"""
+
+import itertools
+import logging
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+_UNSAFE_CHARS = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    parts = Path(code.co_filename).parts
+    return f"{'/'.join(parts[-3:])}:{code.co_name}"
+
+
+class ProfileSession:
+    """Muestreo en curso de una petición"""
+
+    def __init__(self, output_dir: Path, number: int, interval: float, max_depth: int):
+        self.output_dir = output_dir
+        self.number = number
+        self.started = time.strftime('%Y%m%d-%H%M%S')
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self._thread.start()
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self, label: str = "request") -> Optional[Path]:
+        """
+        Detiene el muestreo y escribe el fichero
+
+        Args:
+            label: Parte del nombre del fichero (plantilla de ruta, sin IDs)
+
+        Returns:
+            Ruta del fichero o None si no hubo muestras
+        """
+        self._stop.set()
+        self._thread.join()
+        if not self.stacks:
+            return None
+        name = _UNSAFE_CHARS.sub("_", label).strip("_") or "request"
+        path = self.output_dir / f"{self.started}-{self.number}-{name}.folded"
+        try:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            with open(path, "w") as f:
+                for stack, count in sorted(self.stacks.items()):
+                    f.write(f"{stack} {count}\n")
+        except OSError as e:
+            logger.error(f"❌ No se pudo escribir el perfil {path}: {e}")
+            return None
+        logger.info(f"🔬 Perfil guardado ({self.samples} muestras): {path}")
+        return path
+
+
+class SamplingProfiler:
+    """Decide qué peticiones se perfilan (1 de cada `every`) y dónde se guardan"""
+
+    def __init__(
+        self,
+        every: int,
+        output_dir: str,
+        interval: float = 0.005,
+        max_depth: int = 64
+    ):
+        if every < 1:
+            raise ValueError("every debe ser >= 1")
+        self.every = every
+        self.output_dir = Path(output_dir)
+        self.interval = interval
+        self.max_depth = max_depth
+        self._counter = itertools.count(1)
+
+    def maybe_start(self) -> Optional[ProfileSession]:
+        """Empieza a muestrear si a esta petición le toca; si no, None"""
+        n = next(self._counter)
+        if n % self.every:
+            return None
+        return ProfileSession(self.output_dir, n, self.interval, self.max_depth)
@@ -0,0 +1,222 @@
+"""
+Prompt Cache - KV-cache por sesión entre turnos
+
+Cada turno vuelve a renderizar todo el historial, pero los tokens del
+turno anterior ya están en el KV-cache de la generación previa. Guardando
+ese cache por sesión, el siguiente turno solo hace prefill de la parte
+nueva (el mensaje del usuario). Los caches se desalojan por LRU cuando se
+supera el presupuesto de memoria.
+
+Las sesiones nuevas parten del KV del prompt de sistema, común a todas y
+calculado una sola vez (SharedPrefixCache).
+"""
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PromptCacheEntry:
+    """Tokens ya procesados y su estado KV"""
+    tokens: List[int]
+    cache: Any
+    nbytes: int
+    reuse_tokens: int = 0  # Prefijo de tokens aprovechable en la petición actual
+
+
+def common_prefix_length(a: List[int], b: List[int]) -> int:
+    """Número de tokens iniciales compartidos"""
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+
+class SessionPromptCache:
+    """LRU de prompt caches por sesión con presupuesto en bytes"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, PromptCacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+
+        # Estadísticas
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reused_tokens = 0
+
+    def take(self, session_id: str, prompt_tokens: List[int]) -> Optional[PromptCacheEntry]:
+        """
+        Retira el cache de la sesión si comparte prefijo con el prompt
+
+        El cache se saca del LRU mientras la secuencia lo usa (se modifica
+        en el sitio durante la generación) y vuelve con put() al terminar.
+
+        Returns:
+            PromptCacheEntry con reuse_tokens > 0, o None (prefill completo)
+        """
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is not None:
+                self.total_bytes -= entry.nbytes
+
+            # Siempre queda al menos un token para el prefill
+            reuse = 0
+            if entry is not None:
+                reuse = min(common_prefix_length(entry.tokens, prompt_tokens), len(prompt_tokens) - 1)
+
+            if reuse <= 0:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.reused_tokens += reuse
+            entry.reuse_tokens = reuse
+            return entry
+
+    def put(self, session_id: str, entry: PromptCacheEntry):
+        """Guarda el cache de la sesión y desaloja por LRU si hace falta"""
+        if entry.nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(session_id, None)
+            if previous is not None:
+                self.total_bytes -= previous.nbytes
+
+            self._entries[session_id] = entry
+            self.total_bytes += entry.nbytes
+
+            while self.total_bytes > self.max_bytes:
+                evicted_id, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= evicted.nbytes
+                self.evictions += 1
+                logger.info(f"🗑️  Prompt cache desalojado: {evicted_id}")
+
+    def drop(self, session_id: str) -> int:
+        """
+        Elimina los caches de una sesión (p.ej. sesión expirada)
+
+        Incluye los de cada adaptador LoRA ("sesión@adaptador").
+
+        Returns:
+            Nº de caches eliminados
+        """
+        prefix = f"{session_id}@"
+        with self._lock:
+            keys = [
+                key for key in self._entries
+                if key == session_id or key.startswith(prefix)
+            ]
+            for key in keys:
+                self.total_bytes -= self._entries.pop(key).nbytes
+        return len(keys)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._entries
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Uso de memoria y aciertos del cache"""
+        lookups = self.hits + self.misses
+        return {
+            "sessions": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "reused_tokens": self.reused_tokens,
+        }
+
+
+class SharedPrefixCache:
+    """
+    KV del prefijo de sistema compartido por todas las sesiones
+
+    Se recalcula solo cuando cambian los tokens del prefijo (otro prompt de
+    sistema). Cada generación recibe una copia, nunca el original.
+    """
+
+    def __init__(self):
+        self.entry: Optional[PromptCacheEntry] = None
+        self.version: Optional[str] = None
+        self._tokens: Optional[List[int]] = None
+        self.hits = 0
+        self.rebuilds = 0
+
+    def ensure(
+        self,
+        tokens: List[int],
+        build: Callable[[List[int]], Optional[PromptCacheEntry]]
+    ) -> bool:
+        """
+        Garantiza que el cache corresponde a estos tokens
+
+        Returns:
+            True si el prefijo está disponible
+        """
+        if self._tokens == tokens:
+            return self.entry is not None
+
+        # Si build() falla no se reintenta con los mismos tokens
+        self._tokens = list(tokens)
+        self.entry = None
+        self.version = None
+        self.rebuilds += 1
+        self.entry = build(list(tokens))
+        if self.entry is not None:
+            digest = hashlib.sha256(repr(tokens).encode()).hexdigest()
+            self.version = digest[:12]
+            logger.info(
+                f"📌 Prefijo de sistema cacheado: {len(tokens)} tokens "
+                f"(versión {self.version})"
+            )
+        return self.entry is not None
+
+    def match(
+        self,
+        prompt_tokens: List[int],
+        clone: Callable[[Any], Any]
+    ) -> Optional[PromptCacheEntry]:
+        """Copia del cache si el prompt empieza por el prefijo"""
+        entry = self.entry
+        if entry is None:
+            return None
+
+        n = len(entry.tokens)
+        if len(prompt_tokens) <= n or prompt_tokens[:n] != entry.tokens:
+            return None
+
+        self.hits += 1
+        return PromptCacheEntry(
+            tokens=list(entry.tokens),
+            cache=clone(entry.cache),
+            nbytes=entry.nbytes,
+            reuse_tokens=n
+        )
+
+    def clear(self):
+        self.entry = None
+        self.version = None
+        self._tokens = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "tokens": len(self.entry.tokens) if self.entry else 0,
+            "version": self.version,
+            "hits": self.hits,
+            "rebuilds": self.rebuilds,
+        }
@@ -0,0 +1,239 @@
+"""
+Risk Classifier - Segunda etapa de la detección de crisis
+
+Regresión logística sobre n-gramas de caracteres con hashing: los pesos son
+un único array NumPy de `n_features` float32 y puntuar un mensaje consiste
+en hashear sus n-gramas (vectorizado, sin bucle por n-grama en Python) y
+sumar los pesos indexados. Sin vocabulario, sin matrices dispersas y sin
+dependencias de ML: unas decenas de microsegundos por mensaje.
+
+CrisisDetector solo lo consulta cuando la primera etapa (keywords + regex)
+es ambigua, p.ej. "morir" sin ningún patrón: la probabilidad se compara con
+Settings.RISK_THRESHOLD y, si la supera, el riesgo sube a HIGH.
+
+Los pesos se cargan de RISK_MODEL_PATH (.npz, ver
+scripts/train_risk_classifier.py); si no existe se entrenan al arrancar con
+el corpus semilla RISK_SEED_PATH (JSONL con "text" y "label").
+"""
+
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # Dependencia opcional: sin NumPy no hay segunda etapa
+    np = None
+
+from app.core.model_backend import resolve_project_path
+from app.core.text_normalization import fold_text
+
+logger = logging.getLogger(__name__)
+
+# Multiplicador del hash polinómico y mezcla final (Fibonacci hashing)
+_HASH_MULT = 0x100000001B3
+_HASH_MIX = 0x9E3779B97F4A7C15
+
+
+def _hashed_windows(
+    texts: Sequence[str],
+    bits: int,
+    ngram_range: Tuple[int, int],
+    folded: bool = False
+):
+    """
+    (fila, índice) de los n-gramas de caracteres de todos los textos (normalizados)
+
+    Los textos se concatenan en un solo array de códigos y los hashes de
+    cada tamaño de n-grama se calculan a la vez para todo el lote; las
+    ventanas que cruzan de un texto al siguiente se descartan.
+    """
+    normalized = [f" {text if folded else fold_text(text)} " for text in texts]
+    codes = np.frombuffer("".join(normalized).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    owner = np.repeat(np.arange(len(normalized)), [len(text) for text in normalized])
+    mult = np.uint64(_HASH_MULT)
+    rows, hashes = [], []
+    for n in range(ngram_range[0], ngram_range[1] + 1):
+        count = len(codes) - n + 1
+        if count <= 0:
+            break
+        # Hash polinómico de todas las ventanas de tamaño n (módulo 2**64)
+        h = np.full(count, n, dtype=np.uint64)
+        for k in range(n):
+            h = h * mult + codes[k:k + count]
+        inside = owner[:count] == owner[n - 1:]
+        rows.append(owner[:count][inside])
+        hashes.append(h[inside])
+    if not rows:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    mixed = np.concatenate(hashes) * np.uint64(_HASH_MIX)
+    return np.concatenate(rows), (mixed >> np.uint64(64 - bits)).astype(np.intp)
+
+
+def hash_ngrams(text: str, bits: int, ngram_range: Tuple[int, int], folded: bool = False) -> "np.ndarray":
+    """
+    Índices (en [0, 2**bits)) de los n-gramas de caracteres del texto
+
+    Un n-grama repetido aparece repetido: sumar los pesos indexados equivale
+    al producto escalar con el vector de frecuencias.
+    """
+    return _hashed_windows([text], bits, ngram_range, folded)[1]
+
+
+def _sparse_rows(texts: Sequence[str], bits: int, ngram_range: Tuple[int, int], folded: bool = False):
+    """(fila, columna, valor) de la matriz de features normalizada (L2 aproximada)"""
+    rows, cols = _hashed_windows(texts, bits, ngram_range, folded)
+    sizes = np.bincount(rows, minlength=len(texts))
+    scale = 1.0 / np.sqrt(np.maximum(sizes, 1))
+    return rows, cols, scale[rows].astype(np.float32)
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-z))
+
+
+class RiskClassifier:
+    """Clasificador lineal de riesgo sobre n-gramas de caracteres con hashing"""
+
+    def __init__(self, weights: "np.ndarray", bias: float, ngram_range: Tuple[int, int] = (2, 4)):
+        bits = int(weights.size).bit_length() - 1
+        if weights.ndim != 1 or weights.size != 1 << bits:
+            raise ValueError("weights debe ser un vector de tamaño potencia de 2")
+        self.weights = weights.astype(np.float32, copy=False)
+        self.bias = float(bias)
+        self.ngram_range = (int(ngram_range[0]), int(ngram_range[1]))
+        self.bits = bits
+
+    @classmethod
+    def fit(
+        cls,
+        texts: Sequence[str],
+        labels: Sequence[int],
+        bits: int = 14,
+        ngram_range: Tuple[int, int] = (2, 4),
+        epochs: int = 300,
+        learning_rate: float = 0.5,
+        l2: float = 1e-4
+    ) -> "RiskClassifier":
+        """
+        Entrena con descenso de gradiente (Adam) sobre el batch completo
+
+        Las clases se pesan por igual aunque el corpus esté desbalanceado.
+        """
+        y = np.asarray(labels, dtype=np.float32)
+        n = len(y)
+        rows, cols, vals = _sparse_rows(texts, bits, ngram_range)
+        positives = max(float(y.sum()), 1.0)
+        negatives = max(n - float(y.sum()), 1.0)
+        sample_weight = np.where(y > 0, n / (2 * positives), n / (2 * negatives)).astype(np.float32)
+
+        weights = np.zeros(1 << bits, dtype=np.float32)
+        bias = 0.0
+        m = np.zeros_like(weights)
+        v = np.zeros_like(weights)
+        beta1, beta2, eps = 0.9, 0.999, 1e-8
+        for step in range(1, epochs + 1):
+            z = bias + np.bincount(rows, weights=weights[cols] * vals, minlength=n)
+            error = (_sigmoid(z) - y) * sample_weight / n
+            grad = np.bincount(cols, weights=error[rows] * vals, minlength=weights.size) + l2 * weights
+            m = beta1 * m + (1 - beta1) * grad
+            v = beta2 * v + (1 - beta2) * grad * grad
+            m_hat = m / (1 - beta1 ** step)
+            v_hat = v / (1 - beta2 ** step)
+            weights = (weights - learning_rate * m_hat / (np.sqrt(v_hat) + eps)).astype(np.float32)
+            bias -= learning_rate * float(error.sum())
+        return cls(weights, bias, ngram_range)
+
+    def predict(self, text: str, folded: bool = False) -> float:
+        """
+        Probabilidad de riesgo de un mensaje
+
+        Con `folded` el texto ya viene normalizado (NormalizedText.folded)
+        """
+        idx = hash_ngrams(text, self.bits, self.ngram_range, folded)
+        if not idx.size:
+            return float(_sigmoid(self.bias))
+        z = self.bias + float(self.weights[idx].sum()) / np.sqrt(idx.size)
+        return float(_sigmoid(z))
+
+    def predict_many(self, texts: Sequence[str], folded: bool = False) -> "np.ndarray":
+        """Probabilidades de riesgo de varios mensajes (un solo gather + bincount)"""
+        if not texts:
+            return np.empty(0, dtype=np.float32)
+        rows, cols, vals = _sparse_rows(texts, self.bits, self.ngram_range, folded)
+        z = self.bias + np.bincount(rows, weights=self.weights[cols] * vals, minlength=len(texts))
+        return _sigmoid(z).astype(np.float32)
+
+    def save(self, path: Path):
+        """Guarda pesos y configuración en un .npz"""
+        np.savez_compressed(
+            path,
+            weights=self.weights,
+            bias=np.float32(self.bias),
+            ngram_range=np.array(self.ngram_range)
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "RiskClassifier":
+        with np.load(path) as data:
+            return cls(data["weights"], float(data["bias"]), tuple(data["ngram_range"]))
+
+
+def load_seed(path: Path) -> Tuple[List[str], List[int]]:
+    """Corpus semilla: una línea JSON por ejemplo con "text" y "label" (0/1)"""
+    texts, labels = [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            example = json.loads(line)
+            texts.append(example["text"])
+            labels.append(int(example["label"]))
+    return texts, labels
+
+
+_classifiers: Dict[Tuple, Optional[RiskClassifier]] = {}
+_classifiers_lock = threading.Lock()
+
+
+def _build_classifier(model_path: Path, seed_path: Path) -> Optional[RiskClassifier]:
+    if model_path.exists():
+        try:
+            classifier = RiskClassifier.load(model_path)
+            logger.info(f"🧮 Clasificador de riesgo cargado de {model_path}")
+            return classifier
+        except (OSError, KeyError, ValueError) as e:
+            logger.error(f"❌ No se pudo cargar {model_path}: {e}")
+    if seed_path.exists():
+        texts, labels = load_seed(seed_path)
+        classifier = RiskClassifier.fit(texts, labels)
+        logger.info(f"🧮 Clasificador de riesgo entrenado con {len(texts)} ejemplos de {seed_path}")
+        return classifier
+    logger.warning("⚠️  Sin pesos ni corpus semilla: detección de crisis solo con reglas")
+    return None
+
+
+def shared_classifier(config) -> Optional[RiskClassifier]:
+    """
+    Clasificador compartido para la configuración dada
+
+    Returns:
+        None si está desactivado, falta NumPy o no hay pesos ni corpus
+    """
+    if not getattr(config, "ENABLE_RISK_CLASSIFIER", False):
+        return None
+    if np is None:
+        logger.warning("⚠️  NumPy no instalado: detección de crisis solo con reglas")
+        return None
+    key = (config.RISK_MODEL_PATH, config.RISK_SEED_PATH)
+    if key not in _classifiers:
+        with _classifiers_lock:
+            if key not in _classifiers:
+                _classifiers[key] = _build_classifier(
+                    resolve_project_path(config.RISK_MODEL_PATH),
+                    resolve_project_path(config.RISK_SEED_PATH)
+                )
+    return _classifiers[key]
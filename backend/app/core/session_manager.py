@@ -1,15 +1,60 @@
 """
 Session Manager - Gestión de sesiones y contexto conversacional
+
+Las sesiones activas viven en memoria; la persistencia (si la hay) la hace
+un SessionStore (ver session_store.py, SESSION_STORE).
 """
 
+import asyncio
 import logging
-from typing import Dict, List, Optional
+import sys
+from typing import Callable, Dict, List, Optional
 from datetime import datetime, timedelta
 from dataclasses import dataclass, field
 import uuid
 
+from app.core.guardrails import RiskTrajectory
+from app.core.text_normalization import NormalizedText, fold_text, normalize_text
+from app.core.tracing import traced
+
 logger = logging.getLogger(__name__)
 
+# Cabecera que abre la respuesta del asistente en ChatML
+GENERATION_PROMPT = "<|im_start|>assistant\n"
+
+
+class MessageTooLongError(Exception):
+    """Un mensaje no cabe por sí solo en el presupuesto de contexto"""
+    
+    def __init__(self, tokens: int, budget: int):
+        super().__init__(
+            f"Mensaje demasiado largo: {tokens} tokens con el prompt de sistema "
+            f"(máximo {budget})"
+        )
+        self.tokens = tokens
+        self.budget = budget
+
+
+# Emociones del resumen heurístico y sus palabras (normalizadas, sin tildes)
+_EMOTION_WORDS = [
+    (emotion, tuple(fold_text(word) for word in words))
+    for emotion, words in [
+        ('ansiedad', ['ansiedad', 'ansioso', 'nervioso']),
+        ('tristeza', ['triste', 'depresión', 'deprimido']),
+        ('estrés', ['estrés', 'estresado', 'agobiado']),
+    ]
+]
+
+
+def chatml_block(role: str, content: str) -> str:
+    """Bloque ChatML de un mensaje, tal como aparece en el prompt"""
+    return f"<|im_start|>{role}\n{content}<|im_end|>\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación conservadora (~3 caracteres por token) sin tokenizer"""
+    return len(text) // 3 + 1
+
 
 @dataclass
 class Message:
@@ -18,6 +63,52 @@ class Message:
     content: str
     timestamp: datetime = field(default_factory=datetime.now)
     metadata: Dict = field(default_factory=dict)
+    token_count: Optional[int] = None  # Tokens del bloque ChatML (cacheado)
+    # Texto normalizado (guardrails, resúmenes), calculado una vez al crearlo
+    normalized: Optional[NormalizedText] = field(default=None, repr=False)
+    
+    def __post_init__(self):
+        if self.normalized is None:
+            self.normalized = normalize_text(self.content)
+
+
+@dataclass
+class ContextWindow:
+    """Mensajes que entran en el prompt y su coste en tokens"""
+    messages: List[Dict]
+    prompt_tokens: int
+    budget: int
+    dropped: int = 0  # Mensajes antiguos que quedaron fuera
+
+
+@dataclass
+class RenderedPrompt:
+    """Prompt ChatML listo para el modelo"""
+    text: str
+    tokens: Optional[List[int]]  # None si el SessionManager no tiene tokenizer
+    prompt_tokens: int
+    budget: int
+    dropped: int = 0  # Mensajes antiguos resumidos o fuera de la ventana
+    rebuilt: bool = False  # Se renderizó desde cero en lugar de ampliar
+
+
+@dataclass
+class PromptRenderCache:
+    """Prompt renderizado de una sesión; solo crece por el final"""
+    key: tuple  # Parámetros de ventana con que se construyó
+    start: int  # Primer mensaje de conversación incluido (los anteriores, resumidos)
+    end: int  # Mensajes de conversación ya renderizados
+    parts: List[str]
+    tokens: Optional[List[int]]
+    token_count: int
+
+
+@dataclass
+class SessionSummary:
+    """Resumen acumulado por el modelo (ConversationSummarizer)"""
+    text: str
+    covered: int  # Mensajes de conversación que resume, desde el principio
+    created_at: datetime = field(default_factory=datetime.now)
 
 
 @dataclass
@@ -28,12 +119,23 @@ class Session:
     created_at: datetime = field(default_factory=datetime.now)
     last_activity: datetime = field(default_factory=datetime.now)
     metadata: Dict = field(default_factory=dict)
+    prompt_render: Optional[PromptRenderCache] = field(default=None, repr=False)
+    summary: Optional[SessionSummary] = None
+    risk: RiskTrajectory = field(default_factory=RiskTrajectory)
+    archived: int = 0  # Mensajes persistidos que no se cargaron en memoria (anteriores a la ventana)
     
-    def add_message(self, role: str, content: str, metadata: Dict = None):
-        """Añade mensaje a la sesión"""
-        msg = Message(role=role, content=content, metadata=metadata or {})
+    def add_message(
+        self,
+        role: str,
+        content: str,
+        metadata: Dict = None,
+        normalized: Optional[NormalizedText] = None
+    ):
+        """Añade mensaje a la sesión (reutiliza `normalized` si ya se calculó)"""
+        msg = Message(role=role, content=content, metadata=metadata or {}, normalized=normalized)
         self.messages.append(msg)
         self.last_activity = datetime.now()
+        return msg
     
     def get_context_window(self, max_messages: int = 10) -> List[Message]:
         """Obtiene ventana de contexto reciente"""
@@ -51,10 +153,45 @@ class Session:
 class SessionManager:
     """Gestiona múltiples sesiones de usuario"""
     
-    def __init__(self, config):
+    def __init__(
+        self,
+        config,
+        count_tokens: Optional[Callable[[str], int]] = None,
+        encode: Optional[Callable[[str], List[int]]] = None,
+        store=None,
+        on_session_removed: Optional[Callable[[str], None]] = None
+    ):
+        """
+        Args:
+            config: Settings de la aplicación
+            count_tokens: Tokenizer del modelo (texto -> nº de tokens); sin él
+                se usa `encode` o una estimación por caracteres
+            encode: Tokenizer del modelo (texto -> token ids); con él
+                render_prompt() devuelve también los token ids
+            store: SessionStore; por defecto el de SESSION_STORE
+            on_session_removed: Se llama con el ID de cada sesión eliminada
+                (p.ej. para liberar su KV-cache)
+        """
+        # Import diferido: session_store depende de las clases de este módulo
+        from app.core.session_store import create_session_store
+        
         self.config = config
         self.sessions: Dict[str, Session] = {}
+        self.store = store if store is not None else create_session_store(config)
+        self.on_session_removed = on_session_removed
         self.system_prompt = self._build_system_prompt()
+        self.encode = encode
+        if count_tokens is None and encode is not None:
+            count_tokens = lambda text: len(encode(text))
+        self.count_tokens = count_tokens or estimate_tokens
+        self._generation_prompt_ids = encode(GENERATION_PROMPT) if encode else None
+        self._generation_prompt_tokens = self.count_tokens(GENERATION_PROMPT)
+        
+        # Estadísticas de ensamblado de contexto
+        self.prompts_built = 0
+        self.prompt_tokens_total = 0
+        self.prompt_tokens_max = 0
+        self.truncated_prompts = 0
     
     def _build_system_prompt(self) -> str:
         """Construye el prompt de sistema base"""
@@ -88,7 +225,9 @@ LÍMITES:
         session = Session(session_id=session_id)
         
         # Añadir prompt de sistema
-        session.add_message("system", self.system_prompt)
+        msg = session.add_message("system", self.system_prompt)
+        self._count_message(msg)
+        self.store.append_message(session, msg)
         
         self.sessions[session_id] = session
         logger.info(f"✅ Sesión creada: {session_id}")
@@ -96,22 +235,189 @@ LÍMITES:
         return session_id
     
     def get_session(self, session_id: str) -> Optional[Session]:
-        """Obtiene sesión por ID"""
-        return self.sessions.get(session_id)
+        """
+        Obtiene sesión por ID
+        
+        Si no está en memoria se busca en el store (solo la ventana reciente)
+        y queda en memoria para los siguientes turnos.
+        """
+        session = self.sessions.get(session_id)
+        if session is not None or not session_id:
+            return session
+        
+        session = self.store.load(session_id)
+        if session is None:
+            return None
+        if session.is_expired(self.config.SESSION_TIMEOUT):
+            self.store.delete(session_id)
+            return None
+        self.sessions[session_id] = session
+        logger.info(f"💾 Sesión recuperada: {session_id} ({len(session.messages)} mensajes en memoria)")
+        return session
     
+    @traced("session")
     def add_message(
         self,
         session_id: str,
         role: str,
         content: str,
-        metadata: Dict = None
-    ):
+        metadata: Dict = None,
+        normalized: Optional[NormalizedText] = None
+    ) -> Message:
         """Añade mensaje a sesión existente"""
         session = self.get_session(session_id)
         if not session:
             raise ValueError(f"Sesión no encontrada: {session_id}")
         
-        session.add_message(role, content, metadata)
+        msg = session.add_message(role, content, metadata, normalized)
+        self._count_message(msg)
+        self.store.append_message(session, msg)
+        return msg
+    
+    def discard_message(
+        self,
+        session_id: str,
+        msg: Message,
+        risk: Optional[RiskTrajectory] = None
+    ) -> bool:
+        """
+        Retira un mensaje que quedó sin respuesta (cola llena, error de generación)
+        
+        Solo si sigue siendo el último de la sesión: así un reintento no
+        repite el turno en el prompt. `risk` restaura el riesgo acumulado
+        previo a ese mensaje.
+        
+        Returns:
+            True si se retiró
+        """
+        session = self.sessions.get(session_id)
+        if not session or not session.messages or session.messages[-1] is not msg:
+            return False
+        
+        session.messages.pop()
+        if risk is not None:
+            session.risk = risk
+        # El prompt renderizado puede incluirlo: se reconstruye en el siguiente turno
+        session.prompt_render = None
+        self.store.delete_message(session, session.archived + len(session.messages))
+        logger.info(f"↩️  Mensaje sin respuesta retirado de la sesión {session_id}")
+        return True
+    
+    def _count_message(self, msg: Message) -> int:
+        """Tokens del mensaje en el prompt, calculados una sola vez"""
+        if msg.token_count is None:
+            msg.token_count = self.count_tokens(chatml_block(msg.role, msg.content))
+        return msg.token_count
+    
+    def _context_budget(self, max_new_tokens: Optional[int] = None) -> int:
+        """Tokens disponibles para el prompt, reservando los de la respuesta"""
+        if max_new_tokens is None:
+            max_new_tokens = self.config.MAX_TOKENS
+        return self.config.MAX_CONTEXT_LENGTH - max_new_tokens
+    
+    def check_message_fits(
+        self,
+        session_id: str,
+        msg: Message,
+        max_new_tokens: Optional[int] = None
+    ):
+        """
+        Comprueba que el mensaje cabe junto al prompt de sistema
+        
+        Raises:
+            MessageTooLongError: si por sí solo supera el presupuesto
+        """
+        session = self.get_session(session_id)
+        system_msg, _ = self._split_system(session)
+        tokens = self._generation_prompt_tokens + self._count_message(msg)
+        if system_msg:
+            tokens += self._count_message(system_msg)
+        budget = self._context_budget(max_new_tokens)
+        if tokens > budget:
+            raise MessageTooLongError(tokens, budget)
+    
+    def _fit_recent(self, messages: List[Message], budget: int) -> List[Message]:
+        """
+        Mensajes más recientes que caben en `budget` tokens
+        
+        Se recorre del más nuevo al más antiguo y se corta en el primero que
+        no cabe (sin saltar huecos). El último mensaje entra siempre: los
+        que no caben por sí solos se rechazan antes con check_message_fits().
+        """
+        used = 0
+        start = len(messages)
+        for i in range(len(messages) - 1, -1, -1):
+            cost = self._count_message(messages[i])
+            if used + cost > budget and start < len(messages):
+                break
+            used += cost
+            start = i
+        return messages[start:]
+    
+    def build_context(self, session_id: str, max_new_tokens: Optional[int] = None) -> ContextWindow:
+        """
+        Ensambla los mensajes para el modelo dentro del presupuesto de tokens
+        
+        El mensaje de sistema se incluye siempre; el resto se añade del más
+        reciente al más antiguo mientras quepa en MAX_CONTEXT_LENGTH menos
+        los `max_new_tokens` reservados para la respuesta (MAX_TOKENS por
+        defecto). El coste usa los recuentos cacheados de cada mensaje.
+        
+        Args:
+            session_id: ID de la sesión
+            max_new_tokens: Tokens reservados para generar
+        
+        Returns:
+            ContextWindow con los mensajes en orden y su coste en tokens
+        """
+        session = self.get_session(session_id)
+        budget = self._context_budget(max_new_tokens)
+        if not session:
+            return ContextWindow(messages=[], prompt_tokens=0, budget=budget)
+        
+        system_msg, conversation_msgs = self._split_system(session)
+        system_msgs = [system_msg] if system_msg else []
+        
+        used = self._generation_prompt_tokens + sum(self._count_message(m) for m in system_msgs)
+        recent = self._fit_recent(conversation_msgs, budget - used)
+        used += sum(m.token_count for m in recent)
+        
+        window = ContextWindow(
+            messages=[{"role": m.role, "content": m.content} for m in system_msgs + recent],
+            prompt_tokens=used,
+            budget=budget,
+            dropped=len(conversation_msgs) - len(recent)
+        )
+        
+        self._record_prompt(used, budget, window.dropped)
+        return window
+    
+    def select_adapter(
+        self,
+        session_id: str,
+        metadata: Optional[Dict] = None,
+        validate: Optional[Callable[[Optional[str]], None]] = None
+    ) -> Optional[str]:
+        """
+        Adaptador LoRA de la sesión
+        
+        Si la petición trae metadata["adapter"], pasa a ser el de la sesión
+        (vacío o None vuelve al modelo base); si no, se usa el guardado.
+        `validate` puede rechazarlo (excepción) antes de guardarlo.
+        """
+        session = self.get_session(session_id)
+        if not session:
+            return None
+        
+        adapter = session.metadata.get("adapter")
+        if metadata and "adapter" in metadata:
+            adapter = metadata["adapter"] or None
+        if validate:
+            validate(adapter)
+        if "adapter" not in session.metadata or session.metadata["adapter"] != adapter:
+            session.metadata["adapter"] = adapter
+            self.store.save_session(session)
+        return adapter
     
     def get_conversation_history(
         self,
@@ -136,24 +442,44 @@ LÍMITES:
             for msg in messages
         ]
     
+    def get_risk(self, session_id: str) -> Optional[RiskTrajectory]:
+        """Riesgo acumulado de la sesión (None si no existe)"""
+        session = self.get_session(session_id)
+        return session.risk if session else None
+    
+    def set_summary(self, session_id: str, text: str, covered: int) -> bool:
+        """
+        Guarda el resumen del modelo para los primeros `covered` mensajes de conversación
+        
+        Se ignora si la sesión ya no existe o si ya tiene uno más reciente.
+        El siguiente render_prompt reconstruye el prefijo con él.
+        """
+        session = self.get_session(session_id)
+        if not session or not text:
+            return False
+        if session.summary and session.summary.covered >= covered:
+            return False
+        session.summary = SessionSummary(text=text, covered=covered)
+        self.store.save_session(session)
+        logger.info(f"📝 Resumen del modelo actualizado ({covered} mensajes) en sesión {session_id}")
+        return True
+    
     def _generate_summary(self, messages: List[Message]) -> str:
         """
-        Genera resumen de mensajes antiguos
-        En producción, usarías el modelo para esto
+        Genera resumen heurístico de mensajes antiguos
+        Respaldo para lo que el resumen del modelo aún no cubre
         """
         topics = []
         emotions = []
         
         for msg in messages:
             if msg.role == "user":
-                content_lower = msg.content.lower()
+                # Texto normalizado al crear el mensaje: no se repite en cada turno
+                folded = msg.normalized.folded
                 # Detectar emociones mencionadas
-                if any(word in content_lower for word in ['ansiedad', 'ansioso', 'nervioso']):
-                    emotions.append('ansiedad')
-                if any(word in content_lower for word in ['triste', 'depresión', 'deprimido']):
-                    emotions.append('tristeza')
-                if any(word in content_lower for word in ['estrés', 'estresado', 'agobiado']):
-                    emotions.append('estrés')
+                for emotion, words in _EMOTION_WORDS:
+                    if any(word in folded for word in words):
+                        emotions.append(emotion)
         
         # Construir resumen
         summary = "RESUMEN DE CONVERSACIÓN PREVIA:\n"
@@ -165,7 +491,13 @@ LÍMITES:
         
         return summary
     
-    def format_for_model(self, session_id: str, max_context: int = 20, summary_threshold: int = 40) -> str:
+    def format_for_model(
+        self,
+        session_id: str,
+        max_context: int = 20,
+        summary_threshold: int = 40,
+        max_new_tokens: Optional[int] = None
+    ) -> str:
         """
         Formatea conversación para el modelo con resúmenes automáticos
         
@@ -173,51 +505,196 @@ LÍMITES:
             session_id: ID de la sesión
             max_context: Máximo de mensajes recientes a incluir completos
             summary_threshold: Cuando se supera, se genera resumen de mensajes antiguos
+            max_new_tokens: Tokens reservados para la respuesta (MAX_TOKENS por defecto);
+                los mensajes recientes se recortan para que el prompt quepa
+        """
+        prompt = self.render_prompt(session_id, max_context, summary_threshold, max_new_tokens)
+        return prompt.text if prompt else ""
+    
+    @traced("render")
+    def render_prompt(
+        self,
+        session_id: str,
+        max_context: int = 20,
+        summary_threshold: int = 40,
+        max_new_tokens: Optional[int] = None
+    ) -> Optional[RenderedPrompt]:
+        """
+        Prompt ChatML de la sesión (texto y token ids), construido de forma incremental
+        
+        El prompt renderizado se guarda en la sesión y cada turno solo añade
+        (y tokeniza) los mensajes nuevos. Se reconstruye únicamente cuando el
+        resumen reescribe el prefijo: la ventana supera `summary_threshold`
+        mensajes o el presupuesto de tokens, o llega un resumen nuevo del
+        modelo. Entonces se conservan los últimos `max_context` mensajes que
+        quepan (y ninguno de los que ya cubre el resumen del modelo) y el resto
+        se resume en el bloque de sistema. Así el prefijo es estable entre resúmenes y el KV-cache de la
+        sesión se reutiliza.
+        
+        Returns:
+            RenderedPrompt o None si la sesión no existe
         """
         session = self.get_session(session_id)
         if not session:
-            return ""
+            return None
         
-        messages = session.messages
-        system_msg = messages[0] if messages and messages[0].role == "system" else None
-        conversation_msgs = [m for m in messages if m.role != "system"]
-        
-        # Determinar si necesita resumen
-        if len(conversation_msgs) > summary_threshold:
-            # Resumir primeros N mensajes
-            messages_to_summarize = conversation_msgs[:summary_threshold - max_context]
-            recent_messages = conversation_msgs[-(max_context):]
-            
-            summary = self._generate_summary(messages_to_summarize)
-            
-            # Construir prompt con resumen
-            formatted = ""
-            if system_msg:
-                formatted += f"<|im_start|>system\n{system_msg.content}\n\n{summary}<|im_end|>\n"
-            
-            for msg in recent_messages:
-                if msg.role == "user":
-                    formatted += f"<|im_start|>user\n{msg.content}<|im_end|>\n"
-                elif msg.role == "assistant":
-                    formatted += f"<|im_start|>assistant\n{msg.content}<|im_end|>\n"
+        budget = self._context_budget(max_new_tokens)
+        space = budget - self._generation_prompt_tokens
+        system_msg, conversation = self._split_system(session)
+        summary = session.summary
+        key = (
+            max_context,
+            summary_threshold,
+            budget,
+            system_msg.content if system_msg else None,
+            summary.covered if summary else 0
+        )
+        
+        cache = session.prompt_render
+        rebuilt = False
+        if cache is None or cache.key != key or cache.end > len(conversation):
+            cache = self._rebuild_render(system_msg, conversation, summary, key, max_context, space)
+            rebuilt = True
         else:
-            # Conversación corta, incluir todo
-            recent_messages = conversation_msgs[-max_context:] if len(conversation_msgs) > max_context else conversation_msgs
-            
-            formatted = ""
+            new = conversation[cache.end:]
+            cost = sum(self._count_message(m) for m in new)
+            if len(conversation) - cache.start > summary_threshold or cache.token_count + cost > space:
+                cache = self._rebuild_render(system_msg, conversation, summary, key, max_context, space)
+                rebuilt = True
+            else:
+                for msg in new:
+                    self._append_render(cache, msg)
+                cache.end = len(conversation)
+        session.prompt_render = cache
+        
+        tokens = None
+        if cache.tokens is not None:
+            tokens = cache.tokens + self._generation_prompt_ids
+        prompt = RenderedPrompt(
+            text="".join(cache.parts) + GENERATION_PROMPT,
+            tokens=tokens,
+            prompt_tokens=cache.token_count + self._generation_prompt_tokens,
+            budget=budget,
+            dropped=cache.start,
+            rebuilt=rebuilt
+        )
+        self._record_prompt(prompt.prompt_tokens, budget, prompt.dropped)
+        return prompt
+    
+    def _split_system(self, session: Session):
+        """(mensaje de sistema o None, mensajes de conversación)"""
+        messages = session.messages
+        if messages and messages[0].role == "system":
+            return messages[0], messages[1:]
+        return None, messages
+    
+    def _append_render(self, cache: PromptRenderCache, msg: Message):
+        """Añade el bloque de un mensaje al prompt renderizado"""
+        block = chatml_block(msg.role, msg.content)
+        cache.parts.append(block)
+        if cache.tokens is not None:
+            ids = self.encode(block)
+            cache.tokens.extend(ids)
+            msg.token_count = len(ids)
+        cache.token_count += self._count_message(msg)
+    
+    def _rebuild_render(
+        self,
+        system_msg: Optional[Message],
+        conversation: List[Message],
+        summary: Optional[SessionSummary],
+        key: tuple,
+        max_context: int,
+        space: int
+    ) -> PromptRenderCache:
+        """Renderiza la ventana desde cero, resumiendo los mensajes que quedan fuera"""
+        start = max(0, len(conversation) - max_context)
+        if summary:
+            start = max(start, min(summary.covered, len(conversation)))
+        while True:
+            header = ""
             if system_msg:
-                formatted += f"<|im_start|>system\n{system_msg.content}<|im_end|>\n"
-            
-            for msg in recent_messages:
-                if msg.role == "user":
-                    formatted += f"<|im_start|>user\n{msg.content}<|im_end|>\n"
-                elif msg.role == "assistant":
-                    formatted += f"<|im_start|>assistant\n{msg.content}<|im_end|>\n"
+                content = system_msg.content
+                if start:
+                    content += "\n\n" + self._summary_text(conversation, start, summary)
+                header = chatml_block("system", content)
+            header_tokens = self.count_tokens(header) if header else 0
+            recent = self._fit_recent(conversation[start:], space - header_tokens)
+            fitted = len(conversation) - len(recent)
+            if fitted == start:
+                break
+            start = fitted  # El resumen cambia con el punto de corte
         
-        # Preparar para siguiente respuesta
-        formatted += "<|im_start|>assistant\n"
+        if start:
+            logger.info(f"📝 Resumidos {start} mensajes antiguos")
         
-        return formatted
+        cache = PromptRenderCache(
+            key=key,
+            start=start,
+            end=start,
+            parts=[header] if header else [],
+            tokens=(self.encode(header) if header else []) if self.encode else None,
+            token_count=header_tokens
+        )
+        for msg in recent:
+            self._append_render(cache, msg)
+        cache.end = len(conversation)
+        return cache
+    
+    def _summary_text(
+        self,
+        conversation: List[Message],
+        start: int,
+        summary: Optional[SessionSummary]
+    ) -> str:
+        """Resumen de conversation[:start]: el del modelo más el heurístico de lo que no cubre"""
+        if not summary:
+            return self._generate_summary(conversation[:start])
+        
+        text = f"RESUMEN DE CONVERSACIÓN PREVIA:\n{summary.text.strip()}\n"
+        if start > summary.covered:
+            text += "\n" + self._generate_summary(conversation[summary.covered:start])
+        return text
+    
+    def _record_prompt(self, prompt_tokens: int, budget: int, dropped: int):
+        """Registra el coste de un prompt ensamblado"""
+        self.prompts_built += 1
+        self.prompt_tokens_total += prompt_tokens
+        self.prompt_tokens_max = max(self.prompt_tokens_max, prompt_tokens)
+        if dropped:
+            self.truncated_prompts += 1
+        if prompt_tokens > budget:
+            logger.warning(f"⚠️  Prompt de {prompt_tokens} tokens supera el presupuesto ({budget})")
+    
+    def estimate_memory_bytes(self) -> int:
+        """
+        Memoria aproximada de las sesiones: textos y prompts renderizados
+        
+        Recorre todas las sesiones; pensado para el scrape de métricas,
+        no para el request path.
+        """
+        total = 0
+        for session in list(self.sessions.values()):
+            total += sum(sys.getsizeof(m.content) for m in session.messages)
+            render = session.prompt_render
+            if render is not None:
+                total += sum(sys.getsizeof(part) for part in render.parts)
+                if render.tokens is not None:
+                    total += sys.getsizeof(render.tokens)
+        return total
+    
+    def get_stats(self) -> Dict:
+        """Coste de los prompts ensamblados (build_context y render_prompt) y persistencia"""
+        return {
+            "prompts_built": self.prompts_built,
+            "avg_prompt_tokens": (
+                round(self.prompt_tokens_total / self.prompts_built, 1)
+                if self.prompts_built else 0.0
+            ),
+            "max_prompt_tokens": self.prompt_tokens_max,
+            "truncated_prompts": self.truncated_prompts,
+            "store": self.store.get_stats(),
+        }
     
     def cleanup_expired_sessions(self):
         """Limpia sesiones expiradas"""
@@ -229,12 +706,19 @@ LÍMITES:
         
         for sid in expired:
             del self.sessions[sid]
+            self.store.delete(sid)
+            if self.on_session_removed:
+                self.on_session_removed(sid)
             logger.info(f"🗑️  Sesión expirada eliminada: {sid}")
+        # También las persistidas que no llegaron a cargarse
+        self.store.delete_expired(datetime.now() - timedelta(seconds=timeout))
         
         if expired:
             logger.info(f"🧹 {len(expired)} sesiones eliminadas")
     
     async def cleanup(self):
-        """Limpieza al cerrar"""
+        """Limpieza al cerrar: vacía la memoria y guarda lo pendiente en el store"""
         logger.info("🧹 Limpiando sesiones...")
+        # close() espera al hilo escritor: fuera del event loop
+        await asyncio.to_thread(self.store.close)
         self.sessions.clear()
@@ -0,0 +1,405 @@
+"""
+Session Store - Persistencia de las sesiones
+
+SessionManager guarda las sesiones activas en memoria (`sessions`) y
+delega la persistencia en un SessionStore:
+
+- memory: sin persistencia (comportamiento por defecto); un reinicio
+  pierde las conversaciones
+- sqlite: fichero SQLite en modo WAL (SESSION_DB_PATH)
+
+El store SQLite escribe en segundo plano (write-behind): append_message()
+solo encola la fila y un hilo escritor agrupa lo pendiente durante
+SESSION_STORE_FLUSH_MS (o hasta SESSION_STORE_BATCH operaciones) y lo
+confirma en una sola transacción. Con WAL y synchronous=NORMAL los commits
+no hacen fsync; el coste por mensaje en el event loop es un put() en una
+cola.
+
+Al arrancar no se lee nada: la primera vez que se pide una sesión que no
+está en memoria se cargan su fila, el mensaje de sistema y los últimos
+SESSION_LOAD_WINDOW mensajes (Session.archived cuenta los anteriores, que
+quedan solo en disco y cubiertos por el resumen).
+"""
+
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.core.guardrails import RiskTrajectory
+from app.core.model_backend import resolve_project_path
+from app.core.session_manager import Message, Session, SessionSummary
+
+logger = logging.getLogger(__name__)
+
+SESSION_STORES = ("memory", "sqlite")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    last_activity REAL NOT NULL,
+    message_count INTEGER NOT NULL,
+    metadata TEXT NOT NULL,
+    risk TEXT NOT NULL,
+    summary TEXT,
+    summary_covered INTEGER,
+    summary_created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS sessions_last_activity ON sessions (last_activity);
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    PRIMARY KEY (session_id, seq)
+) WITHOUT ROWID;
+"""
+
+_UPSERT_SESSION = """
+INSERT INTO sessions (
+    session_id, created_at, last_activity, message_count, metadata, risk,
+    summary, summary_covered, summary_created_at
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (session_id) DO UPDATE SET
+    last_activity = excluded.last_activity,
+    message_count = excluded.message_count,
+    metadata = excluded.metadata,
+    risk = excluded.risk,
+    summary = excluded.summary,
+    summary_covered = excluded.summary_covered,
+    summary_created_at = excluded.summary_created_at
+"""
+
+_INSERT_MESSAGE = """
+INSERT OR REPLACE INTO messages (session_id, seq, role, content, timestamp, metadata)
+VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+
+class SessionStore(ABC):
+    """
+    Persistencia de sesiones
+
+    Las escrituras no bloquean: pueden aplicarse más tarde, en orden.
+    load() ve todo lo escrito antes de un flush().
+    """
+
+    name: str = "base"
+
+    @abstractmethod
+    def load(self, session_id: str) -> Optional[Session]:
+        """Sesión persistida (ventana reciente) o None"""
+
+    @abstractmethod
+    def save_session(self, session: Session):
+        """Guarda el estado de la sesión (actividad, metadata, resumen, riesgo)"""
+
+    @abstractmethod
+    def append_message(self, session: Session, msg: Message):
+        """Guarda el último mensaje de la sesión (y su estado)"""
+
+    @abstractmethod
+    def delete_message(self, session: Session, seq: int):
+        """Elimina el mensaje `seq`, ya retirado del final de la sesión (y guarda su estado)"""
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        """Elimina una sesión y sus mensajes"""
+
+    @abstractmethod
+    def delete_expired(self, before: datetime):
+        """Elimina las sesiones sin actividad desde `before`"""
+
+    def flush(self):
+        """Espera a que se apliquen las escrituras pendientes"""
+
+    def close(self):
+        """Aplica lo pendiente y libera recursos"""
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+
+class MemorySessionStore(SessionStore):
+    """Sin persistencia: las sesiones solo viven en SessionManager.sessions"""
+
+    name = "memory"
+
+    def load(self, session_id: str) -> Optional[Session]:
+        return None
+
+    def save_session(self, session: Session):
+        pass
+
+    def append_message(self, session: Session, msg: Message):
+        pass
+
+    def delete_message(self, session: Session, seq: int):
+        pass
+
+    def delete(self, session_id: str):
+        pass
+
+    def delete_expired(self, before: datetime):
+        pass
+
+
+def _dumps(data: Dict) -> str:
+    # La mayoría de metadatos están vacíos: sin pasar por el encoder
+    return json.dumps(data, ensure_ascii=False, default=str) if data else "{}"
+
+
+def _session_row(session: Session) -> tuple:
+    summary = session.summary
+    return (
+        session.session_id,
+        session.created_at.isoformat(),
+        session.last_activity.timestamp(),
+        session.archived + len(session.messages),
+        _dumps(session.metadata),
+        json.dumps(vars(session.risk)),
+        summary.text if summary else None,
+        session.archived + summary.covered if summary else None,
+        summary.created_at.isoformat() if summary else None,
+    )
+
+
+def _message_row(session: Session, seq: int, msg: Message) -> tuple:
+    return (
+        session.session_id,
+        seq,
+        msg.role,
+        msg.content,
+        msg.timestamp.isoformat(),
+        _dumps(msg.metadata),
+    )
+
+
+class SQLiteSessionStore(SessionStore):
+    """SQLite en modo WAL con escritura diferida por lotes en un hilo propio"""
+
+    name = "sqlite"
+
+    def __init__(
+        self,
+        path: Path,
+        load_window: int = 40,
+        flush_interval: float = 0.05,
+        batch_size: int = 512,
+        purge_interval: float = 60.0
+    ):
+        """
+        Args:
+            path: Fichero de la base de datos (se crea si no existe)
+            load_window: Mensajes de conversación cargados al recuperar una sesión
+            flush_interval: Segundos que se agrupan escrituras antes del commit
+            batch_size: Operaciones máximas por transacción
+            purge_interval: Segundos mínimos entre dos delete_expired()
+        """
+        self.path = Path(path)
+        self.load_window = load_window
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.purge_interval = purge_interval
+        self._next_purge = 0.0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Lecturas (load) desde el hilo que llame; las escrituras, solo del hilo escritor
+        self._reader = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._reader.execute("PRAGMA journal_mode=WAL")
+        self._reader.executescript(_SCHEMA)
+        self._reader_lock = threading.Lock()
+
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._closed = False
+
+        # Estadísticas
+        self.loaded = 0
+        self.written = 0
+        self.coalesced = 0  # Estados de sesión sustituidos por uno posterior del mismo lote
+        self.batches = 0
+        self.errors = 0
+        self.max_batch = 0
+
+        self._writer = threading.Thread(target=self._write_loop, name="session-store-writer", daemon=True)
+        self._writer.start()
+        logger.info(f"💾 Sesiones persistidas en {self.path} (SQLite WAL)")
+
+    def load(self, session_id: str) -> Optional[Session]:
+        with self._reader_lock:
+            row = self._reader.execute(
+                "SELECT created_at, last_activity, message_count, metadata, risk, "
+                "summary, summary_covered, summary_created_at FROM sessions WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            (created_at, last_activity, message_count, metadata, risk,
+             summary, summary_covered, summary_created_at) = row
+            # Mensaje de sistema (seq 0) + los últimos `load_window`
+            first_recent = max(1, message_count - self.load_window)
+            messages = self._reader.execute(
+                "SELECT role, content, timestamp, metadata FROM messages "
+                "WHERE session_id = ? AND (seq = 0 OR seq >= ?) ORDER BY seq",
+                (session_id, first_recent)
+            ).fetchall()
+
+        session = Session(
+            session_id=session_id,
+            messages=[
+                Message(
+                    role=role,
+                    content=content,
+                    timestamp=datetime.fromisoformat(timestamp),
+                    metadata=json.loads(meta)
+                )
+                for role, content, timestamp, meta in messages
+            ],
+            created_at=datetime.fromisoformat(created_at),
+            last_activity=datetime.fromtimestamp(last_activity),
+            metadata=json.loads(metadata),
+            risk=RiskTrajectory(**json.loads(risk)),
+            archived=message_count - len(messages)
+        )
+        if summary is not None:
+            session.summary = SessionSummary(
+                text=summary,
+                covered=max(0, summary_covered - session.archived),
+                created_at=datetime.fromisoformat(summary_created_at)
+            )
+        self.loaded += 1
+        return session
+
+    def _enqueue(self, op: tuple):
+        if self._closed:
+            raise RuntimeError("SessionStore cerrado")
+        self._queue.put(op)
+
+    def save_session(self, session: Session):
+        self._enqueue((_UPSERT_SESSION, _session_row(session)))
+
+    def append_message(self, session: Session, msg: Message):
+        seq = session.archived + len(session.messages) - 1
+        self._enqueue((_INSERT_MESSAGE, _message_row(session, seq, msg)))
+        self.save_session(session)
+
+    def delete_message(self, session: Session, seq: int):
+        self._enqueue(("DELETE FROM messages WHERE session_id = ? AND seq = ?", (session.session_id, seq)))
+        self.save_session(session)
+
+    def delete(self, session_id: str):
+        self._enqueue(("DELETE FROM messages WHERE session_id = ?", (session_id,)))
+        self._enqueue(("DELETE FROM sessions WHERE session_id = ?", (session_id,)))
+
+    def delete_expired(self, before: datetime):
+        # Se llama en cada petición; basta con purgar de vez en cuando
+        if time.monotonic() < self._next_purge:
+            return
+        self._next_purge = time.monotonic() + self.purge_interval
+        cutoff = before.timestamp()
+        self._enqueue((
+            "DELETE FROM messages WHERE session_id IN "
+            "(SELECT session_id FROM sessions WHERE last_activity < ?)",
+            (cutoff,)
+        ))
+        self._enqueue(("DELETE FROM sessions WHERE last_activity < ?", (cutoff,)))
+
+    def _write_loop(self):
+        """Hilo escritor: agrupa operaciones y las confirma en una transacción"""
+        conn = sqlite3.connect(str(self.path))
+        conn.execute("PRAGMA synchronous=NORMAL")  # Con WAL: sin fsync por commit
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            # Se duerme en lugar de esperar en la cola: un put() no despierta al hilo
+            if batch[0] is not None and self._queue.qsize() < self.batch_size:
+                time.sleep(self.flush_interval)
+            while len(batch) < self.batch_size and batch[-1] is not None:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            ops = [op for op in batch if op is not None]
+            stop = len(ops) < len(batch)
+            if ops:
+                try:
+                    applied = self._coalesce(ops)
+                    with conn:
+                        for sql, params in applied:
+                            conn.execute(sql, params)
+                    self.written += len(ops)
+                    self.coalesced += len(ops) - len(applied)
+                    self.batches += 1
+                    self.max_batch = max(self.max_batch, len(ops))
+                except sqlite3.Error as e:
+                    self.errors += 1
+                    logger.error(f"❌ No se pudieron guardar {len(ops)} operaciones de sesión: {e}")
+            for _ in batch:
+                self._queue.task_done()
+        conn.close()
+
+    @staticmethod
+    def _coalesce(ops: List[tuple]) -> List[tuple]:
+        """Solo el último estado de cada sesión del lote (en su posición, tras los anteriores)"""
+        last = {params[0]: i for i, (sql, params) in enumerate(ops) if sql is _UPSERT_SESSION}
+        return [
+            op for i, op in enumerate(ops)
+            if op[0] is not _UPSERT_SESSION or last[op[1][0]] == i
+        ]
+
+    def flush(self):
+        self._queue.join()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+        with self._reader_lock:
+            self._reader.close()
+        logger.info(f"💾 Sesiones guardadas ({self.written} escrituras en {self.batches} commits)")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "path": str(self.path),
+            "pending": self._queue.qsize(),
+            "loaded": self.loaded,
+            "written": self.written,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+            "avg_batch": round(self.written / self.batches, 1) if self.batches else 0.0,
+            "max_batch": self.max_batch,
+            "errors": self.errors,
+        }
+
+
+def create_session_store(settings) -> SessionStore:
+    """
+    Crea el store indicado en Settings.SESSION_STORE
+
+    Raises:
+        ValueError: si el backend no existe
+    """
+    name = settings.SESSION_STORE.lower()
+    if name == "memory":
+        return MemorySessionStore()
+    if name == "sqlite":
+        return SQLiteSessionStore(
+            resolve_project_path(settings.SESSION_DB_PATH),
+            load_window=settings.SESSION_LOAD_WINDOW,
+            flush_interval=settings.SESSION_STORE_FLUSH_MS / 1000,
+            batch_size=settings.SESSION_STORE_BATCH
+        )
+    raise ValueError(f"SESSION_STORE desconocido: {settings.SESSION_STORE!r} (opciones: {SESSION_STORES})")
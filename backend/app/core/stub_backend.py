@@ -0,0 +1,168 @@
+"""
+Stub Backend - Modelo determinista sin pesos
+
+Tokenizer a nivel de carácter y una respuesta fija, generada token a token
+por el mismo camino que un modelo real (scheduler, stop strings, prompt
+cache). Sirve para tests, CI y para medir la sobrecarga del servidor sin
+el coste del modelo.
+"""
+
+import logging
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.core.batch_scheduler import BatchDecoder, ContinuousBatchScheduler, GenerationRequest
+from app.core.lora_adapters import LoRAAdapterRegistry
+from app.core.model_backend import ModelBackend, render_chatml
+from app.core.prompt_cache import PromptCacheEntry, SharedPrefixCache
+
+logger = logging.getLogger(__name__)
+
+EOS_TOKEN = 0
+
+DEFAULT_REPLY = (
+    " Gracias por compartirlo. Lo que sientes es importante y tiene sentido "
+    "hablarlo. ¿Quieres contarme un poco más sobre cómo te sientes?<|im_end|>"
+)
+
+
+class StubTokenizer:
+    """Tokenizer a nivel de carácter (token id = código Unicode)"""
+
+    eos_token_ids = {EOS_TOKEN}
+
+    def encode(self, text: str) -> List[int]:
+        return [ord(c) for c in text]
+
+    def decode(self, tokens: List[int]) -> str:
+        return "".join(chr(t) for t in tokens if t != EOS_TOKEN)
+
+
+class StubBatchDecoder(BatchDecoder):
+    """Cada secuencia genera `reply` carácter a carácter y después EOS"""
+
+    eos_token_ids = {EOS_TOKEN}
+
+    def __init__(
+        self,
+        reply: str = DEFAULT_REPLY,
+        token_delay: float = 0.0,
+        adapters: Optional[LoRAAdapterRegistry] = None
+    ):
+        self.reply = reply
+        self.token_delay = token_delay
+        self.adapters = adapters
+        self.adapter: Optional[str] = None
+        self.tokenizer = StubTokenizer()
+        self._pending: Dict[int, List[int]] = {}
+        self._tokens: Dict[int, List[int]] = {}
+
+    def add(self, seq_id: int, request: GenerationRequest, cached: Optional[PromptCacheEntry] = None):
+        self._tokens[seq_id] = list(request.prompt_tokens)
+        self._pending[seq_id] = self.tokenizer.encode(self.reply) + [EOS_TOKEN]
+
+    def step(self) -> Dict[int, int]:
+        if self.token_delay:
+            # Un forward por paso, independiente del tamaño del batch
+            time.sleep(self.token_delay)
+        tokens = {}
+        for seq_id, pending in list(self._pending.items()):
+            tokens[seq_id] = pending.pop(0)
+            self._tokens[seq_id].append(tokens[seq_id])
+            if not pending:
+                del self._pending[seq_id]
+        return tokens
+
+    def remove(self, seq_id: int) -> Optional[PromptCacheEntry]:
+        self._pending.pop(seq_id, None)
+        tokens = self._tokens.pop(seq_id, None)
+        if not tokens:
+            return None
+        # El último token muestreado aún no pasó por el modelo
+        tokens = tokens[:-1]
+        return PromptCacheEntry(tokens=tokens, cache=None, nbytes=4 * len(tokens))
+
+    def decode(self, tokens: List[int]) -> str:
+        return self.tokenizer.decode(tokens)
+
+    def build_prefix_cache(self, tokens: List[int]) -> Optional[PromptCacheEntry]:
+        return PromptCacheEntry(tokens=list(tokens), cache=None, nbytes=4 * len(tokens))
+
+    def set_adapter(self, name: Optional[str]):
+        if name is not None:
+            if self.adapters is None:
+                return super().set_adapter(name)
+            self.adapters.get(name)  # Misma carga/LRU que un backend real
+        self.adapter = name
+
+
+class StubModelBackend(ModelBackend):
+    """Backend determinista: misma respuesta para cualquier prompt"""
+
+    name = "stub"
+
+    def __init__(
+        self,
+        reply: str = DEFAULT_REPLY,
+        token_delay: float = 0.0,
+        max_batch_size: int = 8,
+        prompt_cache_max_mb: int = 1024,
+        lora_path: Optional[Path] = None,
+        max_resident_adapters: int = 4
+    ):
+        super().__init__(max_batch_size=max_batch_size, prompt_cache_max_mb=prompt_cache_max_mb)
+        self.reply = reply
+        self.token_delay = token_delay
+        if lora_path is not None:
+            # Sin pesos: solo se comprueba que el adaptador existe
+            self.adapters = LoRAAdapterRegistry(
+                lora_path,
+                lambda path: (None, path.stat().st_size),
+                max_resident=max_resident_adapters
+            )
+
+    def load_model(self) -> bool:
+        self.tokenizer = StubTokenizer()
+        self.scheduler = ContinuousBatchScheduler(
+            StubBatchDecoder(self.reply, self.token_delay, self.adapters),
+            max_batch_size=self.max_batch_size,
+            prompt_cache=self.prompt_cache,
+            prefix_cache=SharedPrefixCache()
+        )
+        self.is_loaded = True
+        logger.info("✅ Backend stub listo (sin modelo)")
+        return True
+
+    def apply_chat_template(
+        self,
+        messages: List[Dict[str, str]],
+        add_generation_prompt: bool = True
+    ) -> str:
+        return render_chatml(messages, add_generation_prompt)
+
+    def encode(self, text: str) -> List[int]:
+        return self.tokenizer.encode(text)
+
+    def _stream_text(
+        self,
+        prompt: str,
+        max_tokens: int,
+        temperature: float,
+        top_p: float
+    ) -> Iterator[str]:
+        for char in self.reply[:max_tokens]:
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            yield char
+
+    def _release(self):
+        pass
+
+    def _describe(self) -> Dict[str, Any]:
+        return {
+            "framework": "stub",
+            "device": "CPU",
+            "quantization": "none",
+            "token_delay_ms": round(self.token_delay * 1000, 3),
+        }
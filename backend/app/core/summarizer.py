@@ -0,0 +1,160 @@
+"""
+Conversation Summarizer - Resumen de sesiones con el modelo, fuera del request path
+
+Generar el resumen dentro del turno del usuario le añadiría una generación
+completa. Aquí se encola como petición de fondo del InferenceWorker, que
+solo la admite cuando el modelo está ocioso. El resumen es incremental:
+cada pasada pliega los mensajes nuevos sobre el resumen anterior y lo
+guarda en la sesión. SessionManager.render_prompt usa siempre el último
+resumen terminado, sin esperar al que esté en curso.
+"""
+
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Set
+
+from app.core.inference_worker import InferenceWorker, QueueFullError
+from app.core.model_backend import ModelBackend
+from app.core.session_manager import Message, SessionManager
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_INSTRUCTIONS = """Resumes conversaciones entre una persona y un asistente de psicoeducación.
+Escribe en español, en 3 a 6 viñetas breves: emociones y situaciones que la persona ha compartido, técnicas ya practicadas y acuerdos o metas pendientes.
+No inventes datos, no diagnostiques y no incluyas nombres propios ni datos de contacto."""
+
+ROLE_LABELS = {"user": "Persona", "assistant": "Asistente"}
+
+
+class ConversationSummarizer:
+    """Programa resúmenes incrementales de las sesiones largas"""
+
+    def __init__(
+        self,
+        session_manager: SessionManager,
+        model_manager: ModelBackend,
+        inference_worker: InferenceWorker,
+        trigger: int = 10,
+        keep_recent: int = 4,
+        max_tokens: int = 192
+    ):
+        """
+        Args:
+            trigger: Mensajes sin resumir (además de los recientes) que disparan una pasada
+            keep_recent: Mensajes más recientes que nunca se resumen
+            max_tokens: Longitud máxima del resumen generado
+        """
+        self.session_manager = session_manager
+        self.model_manager = model_manager
+        self.inference_worker = inference_worker
+        self.trigger = trigger
+        self.keep_recent = keep_recent
+        self.max_tokens = max_tokens
+        self._pending: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+        # Estadísticas
+        self.completed = 0
+        self.failed = 0
+        self.deferred = 0
+        self.messages_folded = 0
+
+    def schedule(self, session_id: str) -> bool:
+        """
+        Encola un resumen si la sesión tiene bastantes mensajes nuevos
+
+        Se llama al terminar un turno y no espera al modelo. Si la cola de
+        fondo está llena se reintenta en el siguiente turno.
+
+        Returns:
+            True si se encoló una pasada de resumen
+        """
+        if session_id in self._pending:
+            return False
+        session = self.session_manager.get_session(session_id)
+        if not session:
+            return False
+
+        conversation = [m for m in session.messages if m.role != "system"]
+        covered = session.summary.covered if session.summary else 0
+        end = len(conversation) - self.keep_recent
+        if end - covered < self.trigger:
+            return False
+
+        previous = session.summary.text if session.summary else None
+        request = self.model_manager.build_request(
+            self.model_manager.encode(
+                self.model_manager.apply_chat_template(
+                    self._build_messages(previous, conversation[covered:end])
+                )
+            ),
+            max_tokens=self.max_tokens,
+            temperature=0.3,
+            shared_prefix_len=0  # No desplazar el prefijo de sistema del chat
+        )
+        try:
+            stream = self.inference_worker.submit_background(request)
+        except QueueFullError:
+            self.deferred += 1
+            return False
+
+        self._pending.add(session_id)
+        task = asyncio.get_running_loop().create_task(
+            self._collect(session_id, stream, end, end - covered)
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _collect(self, session_id: str, stream, covered: int, folded: int):
+        """Espera el resumen en segundo plano y lo guarda en la sesión"""
+        try:
+            text = await stream.read_all()
+        except Exception as e:
+            self.failed += 1
+            logger.warning(f"⚠️  Resumen de sesión {session_id} fallido: {e}")
+            return
+        finally:
+            stream.cancel()
+            self._pending.discard(session_id)
+
+        if stream.result is not None and stream.result.finish_reason not in ("stop", "length"):
+            self.failed += 1
+            return
+        if self.session_manager.set_summary(session_id, text, covered):
+            self.completed += 1
+            self.messages_folded += folded
+
+    def _build_messages(self, previous: Optional[str], messages: List[Message]) -> List[Dict[str, str]]:
+        """Prompt de la pasada: resumen anterior + transcripción de los mensajes nuevos"""
+        transcript = "\n".join(
+            f"{ROLE_LABELS.get(m.role, m.role)}: {m.content}" for m in messages
+        )
+        return [
+            {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+            {
+                "role": "user",
+                "content": (
+                    f"RESUMEN ANTERIOR:\n{previous or '(ninguno)'}\n\n"
+                    f"MENSAJES NUEVOS:\n{transcript}\n\n"
+                    "Devuelve el resumen actualizado."
+                )
+            }
+        ]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Pasadas de resumen realizadas y pendientes"""
+        return {
+            "pending": len(self._pending),
+            "completed": self.completed,
+            "failed": self.failed,
+            "deferred": self.deferred,
+            "messages_folded": self.messages_folded,
+        }
+
+    async def cleanup(self):
+        """Cancela los resúmenes en curso (cierre de la aplicación)"""
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,48 @@
+"""
+Text Normalization - Texto normalizado una sola vez por mensaje
+
+Guardrails, resúmenes y validación del dataset comparan el texto del
+usuario con listas de palabras. Cada uno hacía su propio `.lower()` en
+cada turno y ninguno ignoraba las tildes ("autolesion" no encajaba con
+"autolesión"). normalize_text() calcula una vez:
+
+- folded: casefold, sin tildes ni diéresis (la ñ se conserva) y con los
+  espacios colapsados
+- tokens: palabras de `folded`
+
+El resultado se guarda en el Message y lo reutilizan todos los consumidores.
+Las listas de palabras con las que se compara deben pasar por fold_text().
+"""
+
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import Tuple
+
+# Marcas diacríticas combinantes salvo la tilde de la ñ
+_DIACRITICS = re.compile(r"[\u0300-\u0302\u0304-\u036f]|(?<![nN])\u0303")
+_WORD = re.compile(r"\w+")
+
+
+@dataclass(frozen=True)
+class NormalizedText:
+    """Formas normalizadas de un texto"""
+    folded: str
+    tokens: Tuple[str, ...]
+
+
+def strip_accents(text: str) -> str:
+    """Quita tildes y diéresis ("autolesión" -> "autolesion"), conserva la ñ"""
+    decomposed = unicodedata.normalize("NFD", text)
+    return unicodedata.normalize("NFC", _DIACRITICS.sub("", decomposed))
+
+
+def fold_text(text: str) -> str:
+    """casefold + sin tildes + espacios colapsados"""
+    return " ".join(strip_accents(text.casefold()).split())
+
+
+def normalize_text(text: str) -> NormalizedText:
+    """Normaliza un texto (una vez por mensaje)"""
+    folded = fold_text(text)
+    return NormalizedText(folded=folded, tokens=tuple(_WORD.findall(folded)))
@@ -0,0 +1,92 @@
+"""
+Tracing - Tiempos por fase de cada petición (cabecera Server-Timing)
+
+Cada petición HTTP lleva un RequestTrace en un ContextVar. Los componentes
+(chat, SessionManager, GuardrailsEngine, modelo) abren `span("fase")` sin
+recibir el trace como argumento; fuera de una petición el span es un no-op.
+Las fases con el mismo nombre se acumulan (p. ej. varias escrituras en la
+sesión) y el middleware de main.py las devuelve como:
+
+    Server-Timing: session;dur=0.41, guardrails_in;dur=0.12, render;dur=0.35, ...
+
+Las fases del hilo de inferencia (queue, prefill, decode) no comparten el
+contexto de la petición: el scheduler las deja en GenerationRequest.timings
+y chat.py las añade con `record_timings()`.
+"""
+
+import functools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, Optional
+
+_current_trace: ContextVar[Optional["RequestTrace"]] = ContextVar("request_trace", default=None)
+
+
+class RequestTrace:
+    """Duraciones acumuladas por fase (segundos), en orden de aparición"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.spans: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def server_timing(self, total: bool = True) -> str:
+        """Valor de la cabecera Server-Timing (duraciones en ms)"""
+        entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.spans.items()]
+        if total:
+            entries.append(f"total;dur={(time.perf_counter() - self.started_at) * 1000:.2f}")
+        return ", ".join(entries)
+
+
+def start_trace() -> RequestTrace:
+    """Trace nuevo para el contexto actual (y las tareas que se creen desde él)"""
+    trace = RequestTrace()
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Mide el bloque como fase `name` del trace activo (no-op sin trace)"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - start)
+
+
+def traced(name: str) -> Callable:
+    """Decorador: cada llamada cuenta como fase `name` del trace activo"""
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            trace = _current_trace.get()
+            if trace is None:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                trace.add(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def record_timings(timings: Dict[str, float]):
+    """Añade al trace activo fases medidas en otro hilo"""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    for name, seconds in timings.items():
+        trace.add(name, seconds)
@@ -2,15 +2,24 @@
 FastAPI Application - Main Entry Point
 """
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import logging
+import re
+import time
 
 from app.config import settings
-from app.api import chat, voice, health
-from app.core.model_manager_mlx import ModelManagerMLX
+from app.api import adapters, chat, voice, health
+from app.core.guardrail_rules import shared_registry
+from app.core.guardrails import GuardrailsEngine
+from app.core.model_backend import create_model_backend
 from app.core.session_manager import SessionManager
+from app.core.inference_worker import InferenceWorker
+from app.core.metrics import metrics
+from app.core.profiler import SamplingProfiler
+from app.core.summarizer import ConversationSummarizer
+from app.core.tracing import start_trace
 
 # Configurar logging
 logging.basicConfig(
@@ -22,20 +31,68 @@ logger = logging.getLogger(__name__)
 # Instancias globales
 model_manager = None
 session_manager = None
+inference_worker = None
+summarizer = None
+guardrail_rules = None
+guardrails = None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifecycle manager para inicializar/limpiar recursos"""
-    global model_manager, session_manager
+    global model_manager, session_manager, inference_worker, summarizer, guardrail_rules, guardrails
     
     logger.info("🚀 Iniciando aplicación...")
     
-    # Inicializar componentes
-    model_manager = ModelManagerMLX()
-    model_manager.load_model()  # MLX es síncrono
+    # Reglas de guardrails compiladas una vez (recarga en caliente del fichero)
+    guardrail_rules = shared_registry(settings)
+    logger.info(f"🛡️  Reglas de guardrails: {guardrail_rules.current().version}")
+    # El fichero se revisa en segundo plano, nunca en el camino de una petición
+    guardrail_rules.start_watching()
+    guardrails = GuardrailsEngine(settings, guardrail_rules)
     
-    session_manager = SessionManager(settings)
+    # Inicializar componentes (backend según MODEL_BACKEND)
+    model_manager = create_model_backend(settings)
+    model_manager.load_model()  # La carga es síncrona
+    
+    # Tokenizer real (recuentos y prompt incremental) si el modelo está cargado
+    session_manager = SessionManager(
+        settings,
+        count_tokens=model_manager.count_tokens if model_manager.is_loaded else None,
+        encode=model_manager.encode if model_manager.is_loaded else None,
+        on_session_removed=model_manager.drop_session
+    )
+    
+    # KV del prompt de sistema, compartido por todas las sesiones nuevas
+    model_manager.warm_prefix_cache(session_manager.system_prompt)
+    
+    # El modelo solo se ejecuta desde este hilo
+    inference_worker = InferenceWorker(
+        max_queue_size=settings.INFERENCE_QUEUE_SIZE,
+        retry_after=settings.INFERENCE_RETRY_AFTER,
+        scheduler=model_manager.scheduler
+    )
+    inference_worker.start()
+    
+    # Resúmenes con el modelo en los huecos libres del hilo de inferencia
+    if settings.ENABLE_MODEL_SUMMARY and model_manager.is_loaded:
+        summarizer = ConversationSummarizer(
+            session_manager,
+            model_manager,
+            inference_worker,
+            trigger=settings.SUMMARY_TRIGGER,
+            keep_recent=settings.SUMMARY_KEEP_RECENT,
+            max_tokens=settings.SUMMARY_MAX_TOKENS
+        )
+    
+    # Exportador Prometheus en su propio puerto (sin PII en etiquetas)
+    if metrics.configure(settings.ENABLE_METRICS):
+        metrics.track_sessions(
+            count=lambda: len(session_manager.sessions),
+            text_bytes=session_manager.estimate_memory_bytes,
+            kv_bytes=lambda: model_manager.prompt_cache.total_bytes
+        )
+        metrics.serve(settings.METRICS_PORT)
     
     logger.info("✅ Aplicación lista")
     
@@ -43,8 +100,12 @@ async def lifespan(app: FastAPI):
     
     # Cleanup
     logger.info("🛑 Cerrando aplicación...")
-    model_manager.cleanup()  # MLX es síncrono
+    if summarizer:
+        await summarizer.cleanup()
+    inference_worker.stop()
+    model_manager.cleanup()
     await session_manager.cleanup()
+    guardrail_rules.stop_watching()
 
 
 # Crear aplicación
@@ -64,10 +125,96 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+_PATH_PARAM = re.compile(r"{(\w+)(?::[^}]*)?}")
+
+
+def _route_template(request: Request) -> str:
+    """Plantilla de la ruta (/sessions/{session_id}/...), nunca la URL con IDs"""
+    route = request.scope.get("route")
+    if route is None:
+        return "unmatched"
+    # La ruta de un router incluido no lleva su prefijo: se recupera de la URL
+    params = request.scope.get("path_params", {})
+    rendered = _PATH_PARAM.sub(lambda m: str(params.get(m.group(1), m.group(0))), route.path)
+    path = request.scope["path"]
+    prefix = path[:-len(rendered)] if rendered and path.endswith(rendered) else ""
+    return prefix + route.path
+
+
+@app.middleware("http")
+async def request_metrics(request: Request, call_next):
+    """Latencia extremo a extremo por plantilla de ruta (incluye el stream SSE completo)"""
+    if not metrics.enabled:
+        return await call_next(request)
+    
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception:
+        metrics.observe_request(request.method, _route_template(request), 500, time.perf_counter() - start)
+        raise
+    route = _route_template(request)
+    body = response.body_iterator
+    
+    async def observed_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            metrics.observe_request(request.method, route, response.status_code, time.perf_counter() - start)
+    
+    response.body_iterator = observed_body()
+    return response
+
+
+# Profiler opcional: None deja el request path intacto
+profiler = None
+if settings.PROFILE_SAMPLE_EVERY > 0:
+    profiler = SamplingProfiler(
+        settings.PROFILE_SAMPLE_EVERY,
+        settings.PROFILE_DIR,
+        interval=settings.PROFILE_INTERVAL_MS / 1000
+    )
+
+
+@app.middleware("http")
+async def request_timing(request: Request, call_next):
+    """Cabecera Server-Timing por fase y perfil estadístico de 1 de cada N peticiones"""
+    if not settings.ENABLE_SERVER_TIMING and profiler is None:
+        return await call_next(request)
+    
+    trace = start_trace()
+    profile = profiler.maybe_start() if profiler else None
+    try:
+        response = await call_next(request)
+    except Exception:
+        if profile:
+            profile.stop(f"{request.method}-{_route_template(request)}")
+        raise
+    
+    # En SSE la cabecera sale antes de generar: solo incluye las fases previas
+    if settings.ENABLE_SERVER_TIMING:
+        response.headers["Server-Timing"] = trace.server_timing()
+    if profile:
+        label = f"{request.method}-{_route_template(request)}"
+        body = response.body_iterator
+        
+        async def profiled_body():
+            try:
+                async for chunk in body:
+                    yield chunk
+            finally:
+                profile.stop(label)
+        
+        response.body_iterator = profiled_body()
+    return response
+
+
 # Incluir routers
 app.include_router(health.router, prefix="/api", tags=["health"])
 app.include_router(chat.router, prefix="/api/chat", tags=["chat"])
 app.include_router(voice.router, prefix="/api/voice", tags=["voice"])
+app.include_router(adapters.router, prefix="/api/adapters", tags=["adapters"])
 
 
 @app.get("/")
@@ -0,0 +1,235 @@
+"""
+Inferencia offline por lotes sobre conversaciones JSONL (data/DATASET_FORMAT.md)
+
+Para cada conversación se genera la respuesta al último mensaje del usuario
+(o a todos los turnos con --all-turns) usando el batching continuo del
+backend, se pasa por GuardrailsEngine.check_output y se escribe una línea
+JSONL por respuesta. El progreso se guarda en un checkpoint tras cada lote:
+si el proceso se interrumpe, --resume continúa donde se quedó.
+
+Uso:
+    python scripts/batch_inference.py data/training/eval.jsonl \\
+        --output resultados.jsonl --backend stub
+"""
+import json
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+# Añadir backend al path
+backend_path = Path(__file__).parent.parent / 'backend'
+sys.path.insert(0, str(backend_path))
+
+from app.core.batch_scheduler import GenerationResult
+from app.core.guardrails import GuardrailsEngine
+from app.core.model_backend import ModelBackend, create_model_backend
+from app.config import Settings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def iter_samples(path: str, all_turns: bool = False) -> Iterator[Dict]:
+    """
+    Unidades de evaluación del dataset, en orden estable
+
+    Cada unidad es el historial hasta un mensaje del usuario y, si existe,
+    la respuesta de referencia que le sigue en el dataset.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_num, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                messages = json.loads(line)["messages"]
+            except (json.JSONDecodeError, KeyError) as e:
+                logger.warning(f"⚠️  Línea {line_num} ignorada: {e}")
+                continue
+
+            user_turns = [i for i, m in enumerate(messages) if m.get("role") == "user"]
+            if not all_turns:
+                user_turns = user_turns[-1:]
+
+            for i in user_turns:
+                following = messages[i + 1] if i + 1 < len(messages) else None
+                yield {
+                    "id": f"{line_num}:{i}",
+                    "messages": [{"role": m["role"], "content": m["content"]} for m in messages[:i + 1]],
+                    "reference": following["content"] if following and following.get("role") == "assistant" else None,
+                }
+
+
+def load_checkpoint(path: str) -> Dict:
+    """Muestras ya procesadas y tamaño válido del fichero de salida"""
+    if not os.path.exists(path):
+        return {"done": 0, "offset": 0}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_checkpoint(path: str, checkpoint: Dict):
+    """Escritura atómica: un corte a mitad nunca deja el checkpoint roto"""
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, path)
+
+
+def generate_batch(
+    model: ModelBackend,
+    samples: List[Dict],
+    max_tokens: int,
+    temperature: float,
+    top_p: float
+) -> List[GenerationResult]:
+    """Genera un lote completo con el scheduler de batching continuo"""
+    results: List[GenerationResult] = [None] * len(samples)
+
+    for index, sample in enumerate(samples):
+        request = model.build_chat_request(
+            sample["messages"],
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p
+        )
+        request.on_finish = lambda result, index=index: results.__setitem__(index, result)
+        model.scheduler.submit(request)
+
+    model.scheduler.run_until_idle()
+    return results
+
+
+def run(
+    input_path: str,
+    output_path: str,
+    settings: Settings,
+    batch_size: int = 16,
+    all_turns: bool = False,
+    resume: bool = False,
+    limit: int = 0
+) -> Dict:
+    """
+    Ejecuta el dataset completo y devuelve el resumen de throughput
+    """
+    checkpoint_path = f"{output_path}.ckpt"
+    checkpoint = load_checkpoint(checkpoint_path) if resume else {"done": 0, "offset": 0}
+    if checkpoint["done"]:
+        logger.info(f"⏩ Reanudando tras {checkpoint['done']} muestras")
+
+    model = create_model_backend(settings)
+    if not model.load_model():
+        raise RuntimeError("No se pudo cargar el modelo")
+    guardrails = GuardrailsEngine(settings)
+
+    samples = iter_samples(input_path, all_turns)
+    for _ in range(checkpoint["done"]):
+        next(samples, None)
+
+    stats = {"samples": 0, "rejected": 0, "prompt_tokens": 0, "generated_tokens": 0, "errors": 0}
+    start = time.perf_counter()
+
+    mode = 'r+' if resume and os.path.exists(output_path) else 'w'
+    with open(output_path, mode, encoding='utf-8') as out:
+        # Descartar líneas escritas después del último checkpoint
+        out.seek(checkpoint["offset"])
+        out.truncate()
+
+        while not limit or stats["samples"] < limit:
+            size = batch_size if not limit else min(batch_size, limit - stats["samples"])
+            batch = [sample for _, sample in zip(range(size), samples)]
+            if not batch:
+                break
+
+            results = generate_batch(model, batch, settings.MAX_TOKENS, settings.TEMPERATURE, settings.TOP_P)
+
+            for sample, result in zip(batch, results):
+                is_valid, violated_rules = guardrails.check_output(result.text)
+                out.write(json.dumps({
+                    "id": sample["id"],
+                    "response": result.text,
+                    "reference": sample["reference"],
+                    "valid": is_valid,
+                    "violated_rules": violated_rules,
+                    "finish_reason": result.finish_reason,
+                    "prompt_tokens": result.prompt_tokens,
+                    "cached_tokens": result.cached_tokens,
+                    "generated_tokens": result.generated_tokens,
+                }, ensure_ascii=False) + "\n")
+
+                stats["samples"] += 1
+                stats["rejected"] += not is_valid
+                stats["errors"] += result.finish_reason == "error"
+                stats["prompt_tokens"] += result.prompt_tokens
+                stats["generated_tokens"] += result.generated_tokens
+
+            out.flush()
+            os.fsync(out.fileno())
+            checkpoint = {"done": checkpoint["done"] + len(batch), "offset": out.tell()}
+            save_checkpoint(checkpoint_path, checkpoint)
+
+            elapsed = time.perf_counter() - start
+            logger.info(
+                f"📦 {checkpoint['done']} muestras "
+                f"({stats['samples'] / elapsed:.1f} muestras/s, "
+                f"{stats['generated_tokens'] / elapsed:.1f} tokens/s)"
+            )
+
+    elapsed = time.perf_counter() - start
+    report = {
+        **stats,
+        "elapsed_sec": round(elapsed, 3),
+        "samples_per_sec": round(stats["samples"] / elapsed, 2) if elapsed else 0.0,
+        "generated_tokens_per_sec": round(stats["generated_tokens"] / elapsed, 2) if elapsed else 0.0,
+        "total_done": checkpoint["done"],
+        "batching": model.scheduler.get_stats() if model.scheduler else None,
+    }
+    model.cleanup()
+    logger.info(
+        f"✅ {stats['samples']} respuestas en {elapsed:.1f}s "
+        f"({report['samples_per_sec']} muestras/s, {report['generated_tokens_per_sec']} tokens/s), "
+        f"{stats['rejected']} rechazadas por guardrails"
+    )
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inferencia offline por lotes")
+    parser.add_argument("input", type=str, help="Conversaciones JSONL")
+    parser.add_argument("--output", type=str, required=True, help="Resultados JSONL")
+    parser.add_argument("--backend", type=str, help="auto, mlx, llamacpp o stub (MODEL_BACKEND por defecto)")
+    parser.add_argument("--batch-size", type=int, default=16, help="Muestras por lote (y por checkpoint)")
+    parser.add_argument("--max-tokens", type=int, help="Tokens por respuesta (MAX_TOKENS por defecto)")
+    parser.add_argument("--all-turns", action="store_true", help="Evaluar cada turno del usuario, no solo el último")
+    parser.add_argument("--resume", action="store_true", help="Continuar desde el checkpoint")
+    parser.add_argument("--limit", type=int, default=0, help="Máximo de muestras en esta ejecución")
+    parser.add_argument("--report", type=str, help="Guardar el resumen de throughput en JSON")
+
+    args = parser.parse_args()
+
+    overrides = {"MAX_BATCH_SIZE": args.batch_size}
+    if args.backend:
+        overrides["MODEL_BACKEND"] = args.backend
+    if args.max_tokens:
+        overrides["MAX_TOKENS"] = args.max_tokens
+    settings = Settings(**overrides)
+
+    report = run(
+        args.input,
+        args.output,
+        settings,
+        batch_size=args.batch_size,
+        all_turns=args.all_turns,
+        resume=args.resume,
+        limit=args.limit
+    )
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"📄 Reporte guardado en: {args.report}")
@@ -0,0 +1,207 @@
+"""
+Benchmark de generación: TTFT, latencia entre tokens y tokens/s
+
+Recorre longitudes de prompt, niveles de concurrencia y cuantizaciones.
+Cada escenario envía `concurrency` peticiones a la vez al scheduler de
+batching continuo y mide con la misma GenerationStats que alimenta
+get_model_info() en producción. El resultado se guarda en JSON y se puede
+comparar con una ejecución anterior (--compare).
+
+Uso:
+    python scripts/bench_generation.py --backend stub --output bench.json
+    python scripts/bench_generation.py --backend mlx --compare bench.json
+"""
+import json
+import logging
+import platform
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+# Añadir backend al path
+backend_path = Path(__file__).parent.parent / 'backend'
+sys.path.insert(0, str(backend_path))
+
+from app.core.generation_stats import GenerationStats
+from app.core.model_backend import ModelBackend, create_model_backend
+from app.config import Settings
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+FILLER = (
+    "Me cuesta dormir desde hace semanas y durante el día me siento agobiado "
+    "con el trabajo, las clases y las cosas de casa. "
+)
+
+# Métricas comparables entre ejecuciones: (ruta, mayor es mejor)
+COMPARED_METRICS = [
+    (("ttft_ms", "p50"), False),
+    (("ttft_ms", "p95"), False),
+    (("inter_token_ms", "p50"), False),
+    (("inter_token_ms", "p99"), False),
+    (("prefill_tokens_per_sec", "mean"), True),
+    (("decode_tokens_per_sec", "mean"), True),
+    (("aggregate_tokens_per_sec",), True),
+]
+
+
+def synthetic_prompt(model: ModelBackend, prompt_tokens: int, variant: int) -> List[int]:
+    """Prompt de `prompt_tokens` tokens; `variant` al inicio evita el prompt cache"""
+    text = f"[{variant}] " + FILLER * (prompt_tokens // 8 + 1)
+    tokens = model.encode(model.apply_chat_template([{"role": "user", "content": text}]))
+    return tokens[-prompt_tokens:] if len(tokens) > prompt_tokens else tokens
+
+
+def run_scenario(
+    model: ModelBackend,
+    prompt_tokens: int,
+    concurrency: int,
+    max_tokens: int,
+    variant_base: int
+) -> Dict:
+    """Un escenario: `concurrency` peticiones simultáneas hasta terminar"""
+    stats = GenerationStats()
+    model.scheduler.live_stats = stats
+
+    for i in range(concurrency):
+        request = model.build_request(
+            synthetic_prompt(model, prompt_tokens, variant_base + i),
+            max_tokens=max_tokens,
+            shared_prefix_len=0
+        )
+        request.stop_strings = []  # Generar siempre max_tokens
+        model.scheduler.submit(request)
+
+    start = time.perf_counter()
+    model.scheduler.run_until_idle()
+    elapsed = time.perf_counter() - start
+
+    snapshot = stats.snapshot()
+    return {
+        "prompt_tokens": prompt_tokens,
+        "concurrency": concurrency,
+        "max_tokens": max_tokens,
+        "elapsed_sec": round(elapsed, 4),
+        "ttft_ms": snapshot["ttft_ms"],
+        "inter_token_ms": snapshot["inter_token_ms"],
+        "prefill_tokens_per_sec": snapshot["prefill_tokens_per_sec"],
+        "decode_tokens_per_sec": snapshot["decode_tokens_per_sec"],
+        "aggregate_tokens_per_sec": round(snapshot["generated_tokens"] / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def run(args) -> Dict:
+    results = []
+    variant = 0
+    for quantization in args.quantization:
+        overrides = {"QUANTIZATION": quantization, "MAX_BATCH_SIZE": max(args.concurrency)}
+        if args.backend:
+            overrides["MODEL_BACKEND"] = args.backend
+        settings = Settings(**overrides)
+
+        model = create_model_backend(settings)
+        if args.token_delay and hasattr(model, "token_delay"):
+            model.token_delay = args.token_delay / 1000
+        if not model.load_model():
+            raise RuntimeError("No se pudo cargar el modelo")
+
+        # Calentamiento: compilación de kernels y primeras asignaciones
+        run_scenario(model, min(args.prompt_lengths), 1, 4, variant)
+        variant += 1
+
+        for prompt_tokens in args.prompt_lengths:
+            for concurrency in args.concurrency:
+                for _ in range(args.repeats):
+                    result = run_scenario(model, prompt_tokens, concurrency, args.max_tokens, variant)
+                    variant += concurrency
+                    result["quantization"] = quantization
+                    results.append(result)
+                    print(
+                        f"{quantization:>6} prompt={prompt_tokens:>5} conc={concurrency:>3} "
+                        f"ttft_p50={result['ttft_ms']['p50']:>8.1f}ms "
+                        f"itl_p50={result['inter_token_ms']['p50']:>7.2f}ms "
+                        f"prefill={result['prefill_tokens_per_sec']['mean']:>9.1f}t/s "
+                        f"decode={result['decode_tokens_per_sec']['mean']:>7.1f}t/s "
+                        f"total={result['aggregate_tokens_per_sec']:>8.1f}t/s"
+                    )
+
+        backend_name = model.name
+        model.cleanup()
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "backend": backend_name,
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "max_tokens": args.max_tokens,
+            "repeats": args.repeats,
+        },
+        "results": results,
+    }
+
+
+def _metric(result: Dict, path) -> float:
+    value = result
+    for key in path:
+        value = value[key]
+    return value
+
+
+def compare(current: Dict, baseline: Dict):
+    """Imprime la variación de cada métrica frente a una ejecución anterior"""
+    def key(r):
+        return (r["quantization"], r["prompt_tokens"], r["concurrency"])
+
+    previous = {}
+    for r in baseline["results"]:
+        previous.setdefault(key(r), r)
+
+    print(f"\nComparación con {baseline['meta']['timestamp']} ({baseline['meta']['backend']}):")
+    for r in current["results"]:
+        old = previous.get(key(r))
+        if old is None:
+            continue
+        changes = []
+        for path, higher_is_better in COMPARED_METRICS:
+            before, after = _metric(old, path), _metric(r, path)
+            if not before:
+                continue
+            delta = (after - before) / before * 100
+            better = delta > 0 if higher_is_better else delta < 0
+            changes.append(f"{'.'.join(path)} {delta:+.1f}%{'' if better or abs(delta) < 1 else ' ⚠️'}")
+        print(f"  {key(r)}: " + ", ".join(changes))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    def int_list(value: str) -> List[int]:
+        return [int(v) for v in value.split(",")]
+
+    parser = argparse.ArgumentParser(description="Benchmark de generación")
+    parser.add_argument("--backend", type=str, help="auto, mlx, llamacpp o stub (MODEL_BACKEND por defecto)")
+    parser.add_argument("--prompt-lengths", type=int_list, default=[128, 512, 2048])
+    parser.add_argument("--concurrency", type=int_list, default=[1, 4, 8])
+    parser.add_argument("--quantization", type=lambda v: v.split(","), default=["4bit"],
+                        help="Lista separada por comas (4bit,8bit,none)")
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Retardo por token del stub (ms)")
+    parser.add_argument("--output", type=str, help="Guardar resultados en JSON")
+    parser.add_argument("--compare", type=str, help="JSON de una ejecución anterior")
+
+    args = parser.parse_args()
+    report = run(args)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n📄 Resultados guardados en: {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
@@ -0,0 +1,111 @@
+"""
+Benchmark de los guardrails: coste por mensaje según el número de reglas
+
+Compara los bucles por regla (`in` por keyword, `search` por regex) con
+el matcher de una sola pasada (RuleMatcher) a medida que
+crece el número de reglas, con las reglas reales más reglas sintéticas del
+mismo estilo (una palabra literal seguida de una alternancia). También
+comprueba que ambos caminos disparan las mismas reglas.
+
+Uso:
+    python scripts/bench_guardrails.py
+    python scripts/bench_guardrails.py --rules 12,100,300,600 --messages 2000
+"""
+import random
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List
+
+# Añadir backend al path
+backend_path = Path(__file__).parent.parent / 'backend'
+sys.path.insert(0, str(backend_path))
+
+from app.core.guardrails import ContentFilter, CrisisDetector
+from app.core.multi_match import RuleMatcher
+from app.config import Settings
+
+SYLLABLES = ["ca", "me", "do", "lor", "tris", "an", "sie", "mor", "vi", "da", "pen", "sar", "ten", "go", "ble"]
+
+MESSAGES = [
+    "Hola, hoy me siento un poco mejor que ayer, gracias por escucharme.",
+    "No sé qué hacer con mi vida, todo me sale mal en el trabajo y en casa.",
+    "Últimamente me cuesta dormir y pienso mucho en cosas negativas por la noche.",
+    "Quiero acabar con todo, ya no aguanto más esta situación.",
+    "Mi pareja me dejó y siento que no tengo ganas de nada.",
+    "¿Qué técnicas de respiración me recomiendas para la ansiedad antes de un examen?",
+]
+
+
+def synthetic_word(rng: random.Random) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def build_rules(count: int, rng: random.Random):
+    """Keywords y patrones reales ampliados hasta `count` de cada tipo"""
+    config = Settings()
+    keywords = list(config.CRISIS_KEYWORDS)
+    patterns = list(CrisisDetector(config).crisis_patterns + ContentFilter(config).forbidden_patterns)
+    while len(keywords) < count:
+        keywords.append(" ".join(synthetic_word(rng) for _ in range(rng.randint(1, 3))))
+    while len(patterns) < count:
+        patterns.append(rf"{synthetic_word(rng)}\s+({synthetic_word(rng)}|{synthetic_word(rng)})")
+    return keywords[:count], patterns[:count]
+
+
+def per_rule(keywords: List[str], patterns: List[str]) -> Callable[[str], tuple]:
+    compiled = [re.compile(p, re.IGNORECASE) for p in patterns]
+
+    def check(text: str) -> tuple:
+        lower = text.lower()
+        return (
+            [i for i, k in enumerate(keywords) if k in lower],
+            [i for i, p in enumerate(compiled) if p.search(text)],
+        )
+    return check
+
+
+def single_pass(keywords: List[str], patterns: List[str]) -> Callable[[str], tuple]:
+    matcher = RuleMatcher(keywords, patterns, re.IGNORECASE)
+    return matcher.match
+
+
+def time_per_message(check: Callable[[str], tuple], texts: List[str]) -> float:
+    """Microsegundos por mensaje"""
+    start = time.perf_counter()
+    for text in texts:
+        check(text)
+    return (time.perf_counter() - start) / len(texts) * 1e6
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    texts = [rng.choice(MESSAGES) for _ in range(args.messages)]
+
+    print(f"{'reglas':>7} {'por regla (µs)':>15} {'una pasada (µs)':>16} {'speedup':>8}")
+    for count in args.rules:
+        keywords, patterns = build_rules(count, rng)
+        baseline = per_rule(keywords, patterns)
+        optimized = single_pass(keywords, patterns)
+
+        for text in MESSAGES:
+            if baseline(text) != optimized(text):
+                raise AssertionError(f"Reglas distintas para: {text!r}")
+
+        before = time_per_message(baseline, texts)
+        after = time_per_message(optimized, texts)
+        print(f"{count:>7} {before:>15.1f} {after:>16.1f} {before / after:>7.2f}x")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark de guardrails por número de reglas")
+    parser.add_argument("--rules", type=lambda v: [int(x) for x in v.split(",")],
+                        default=[12, 50, 100, 200, 400, 800],
+                        help="Nº de keywords y de patrones por escenario")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+
+    run(parser.parse_args())
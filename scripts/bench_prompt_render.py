@@ -0,0 +1,70 @@
+"""
+Micro-benchmark del prompt incremental de SessionManager
+
+Simula sesiones largas y mide el coste por turno de render_prompt frente a
+re-tokenizar el prompt completo. Con el prompt incremental solo se
+tokenizan los mensajes nuevos; lo único que crece con el historial es la
+copia de la lista de token ids.
+"""
+import re
+import sys
+import time
+from pathlib import Path
+
+# Añadir backend al path
+backend_path = Path(__file__).parent.parent / 'backend'
+sys.path.insert(0, str(backend_path))
+
+from app.core.session_manager import SessionManager
+from app.config import Settings
+
+
+WORD_RE = re.compile(r"\w+|\s+|[^\w\s]")
+
+
+def word_encode(text: str):
+    """Tokenizer aproximado por palabras: coste proporcional al texto tokenizado"""
+    return [hash(piece) % 150_000 for piece in WORD_RE.findall(text)]
+
+
+def run(turns: int, sessions: int, buckets: int = 5):
+    config = Settings(MAX_CONTEXT_LENGTH=1_000_000, MAX_TOKENS=512)
+    manager = SessionManager(config, encode=word_encode)
+    per_turn = [0.0] * turns
+    full_per_turn = [0.0] * turns
+
+    for _ in range(sessions):
+        session_id = manager.create_session()
+        for turn in range(turns):
+            manager.add_message(session_id, "user", f"Turno {turn}: me siento algo agobiado hoy")
+
+            start = time.perf_counter()
+            prompt = manager.render_prompt(session_id, max_context=turns * 2, summary_threshold=turns * 2)
+            per_turn[turn] += time.perf_counter() - start
+
+            # Referencia: re-tokenizar todo el prompt en cada turno
+            start = time.perf_counter()
+            word_encode(prompt.text)
+            full_per_turn[turn] += time.perf_counter() - start
+
+            manager.add_message(session_id, "assistant", "Probemos la respiración 4-7-8 juntos.")
+
+    size = max(1, turns // buckets)
+    print(f"{'turnos':>12} {'incremental (µs)':>18} {'re-tokenizar (µs)':>18}")
+    for i in range(0, turns, size):
+        chunk = slice(i, i + size)
+        n = len(per_turn[chunk]) * sessions
+        incremental = sum(per_turn[chunk]) / n * 1e6
+        full = sum(full_per_turn[chunk]) / n * 1e6
+        print(f"{f'{i}-{i + n // sessions - 1}':>12} {incremental:>18.1f} {full:>18.1f}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark del prompt incremental")
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--sessions", type=int, default=20)
+
+    args = parser.parse_args()
+    run(args.turns, args.sessions)
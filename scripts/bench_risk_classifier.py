@@ -0,0 +1,93 @@
+"""
+Benchmark de la detección de crisis en dos etapas
+
+Mide la latencia del clasificador de riesgo por mensaje (predict) y por
+lotes (predict_many), y el coste de check_input con y sin la segunda etapa
+para mensajes claros (solo reglas) y ambiguos (reglas + clasificador).
+
+Uso:
+    python scripts/bench_risk_classifier.py
+    python scripts/bench_risk_classifier.py --iterations 5000 --batch 1,64,1024
+"""
+import logging
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List
+
+# Añadir backend al path
+backend_path = Path(__file__).parent.parent / 'backend'
+sys.path.insert(0, str(backend_path))
+
+from app.core.guardrails import GuardrailsEngine
+from app.core.risk_classifier import shared_classifier
+from app.config import Settings
+
+CLEAR = [
+    "Hola, hoy me siento un poco mejor que ayer, gracias por escucharme.",
+    "¿Qué técnicas de respiración me recomiendas para la ansiedad antes de un examen?",
+    "Quiero suicidarme, ya lo tengo decidido.",
+]
+
+AMBIGUOUS = [
+    "Últimamente pienso mucho en morir y no sé con quién hablarlo.",
+    "Me muero de risa con mis amigos, pero a veces pienso en la muerte.",
+    "Quiero desaparecer unos días, estoy agotado de todo.",
+]
+
+
+def latencies_us(fn: Callable[[str], object], texts: List[str], iterations: int) -> List[float]:
+    samples = []
+    for i in range(iterations):
+        text = texts[i % len(texts)]
+        start = time.perf_counter()
+        fn(text)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return sorted(samples)
+
+
+def describe(samples: List[float]) -> str:
+    p99 = samples[int(0.99 * (len(samples) - 1))]
+    return f"p50={statistics.median(samples):7.1f}µs  p99={p99:7.1f}µs"
+
+
+def run(args):
+    # Sin el log INFO por mensaje de los guardrails
+    logging.disable(logging.INFO)
+
+    classifier = shared_classifier(Settings())
+    if classifier is None:
+        print("❌ Clasificador no disponible (¿NumPy instalado?)")
+        return
+
+    print("Clasificador")
+    print(f"  predict         {describe(latencies_us(classifier.predict, CLEAR + AMBIGUOUS, args.iterations))}")
+    texts = CLEAR + AMBIGUOUS
+    for size in args.batch:
+        batch = [texts[i % len(texts)] for i in range(size)]
+        rounds = max(1, args.iterations // size)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            classifier.predict_many(batch)
+        per_message = (time.perf_counter() - start) / (rounds * size) * 1e6
+        print(f"  predict_many({size:>5}) {per_message:7.1f}µs/mensaje")
+
+    rules_only = GuardrailsEngine(Settings(ENABLE_RISK_CLASSIFIER=False))
+    cascade = GuardrailsEngine(Settings())
+    print("check_input")
+    for name, texts in (("claros", CLEAR), ("ambiguos", AMBIGUOUS)):
+        before = latencies_us(rules_only.check_input, texts, args.iterations)
+        after = latencies_us(cascade.check_input, texts, args.iterations)
+        print(f"  {name:<9} solo reglas {describe(before)} | dos etapas {describe(after)}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark del clasificador de riesgo")
+    parser.add_argument("--iterations", type=int, default=3000)
+    parser.add_argument("--batch", type=lambda v: [int(x) for x in v.split(",")],
+                        default=[1, 16, 256, 4096])
+
+    run(parser.parse_args())
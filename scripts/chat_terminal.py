@@ -8,14 +8,14 @@ from pathlib import Path
 backend_path = Path(__file__).parent.parent / 'backend'
 sys.path.insert(0, str(backend_path))
 
-from app.core.model_manager_mlx import ModelManagerMLX
+from app.core.model_backend import create_model_backend
 from app.core.guardrails import GuardrailsEngine
 from app.config import settings
 import time
 
 def main():
     print("🔄 Cargando modelo Qwen2.5-7B...")
-    manager = ModelManagerMLX()
+    manager = create_model_backend(settings)
     manager.load_model()
     
     guardrails = GuardrailsEngine(settings)
@@ -5,10 +5,20 @@ Herramientas para generar y validar dataset de entrenamiento
 import json
 import os
 import re
-from typing import List, Dict
+import sys
+from pathlib import Path
+from typing import List, Dict, Optional
 from dataclasses import dataclass
 import logging
 
+# Añadir backend al path
+backend_path = Path(__file__).parent.parent / 'backend'
+sys.path.insert(0, str(backend_path))
+
+from app.config import Settings
+from app.core.guardrails import GuardrailsEngine, RiskLevel
+from app.core.text_normalization import fold_text, normalize_text
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -33,10 +43,24 @@ class DatasetValidator:
     VALID_RISK_LEVELS = ["low", "medium", "high", "critical"]
     
     FORBIDDEN_WORDS = [
-        "diagnóstico", "diagnostico", "prescribo", "receto",
+        "diagnóstico", "prescribo", "receto",
         "tienes depresión", "tienes ansiedad", "sufres de"
     ]
     
+    CRISIS_REFERRALS = ["988", "741741", "911", "emergencia", "profesional"]
+    
+    # Comparadas con el texto normalizado (sin tildes: "diagnostico" también cuenta)
+    _FORBIDDEN_FOLDED = [(word, fold_text(word)) for word in FORBIDDEN_WORDS]
+    
+    def __init__(self, guardrails: Optional[GuardrailsEngine] = None, workers: Optional[int] = None):
+        """
+        Args:
+            guardrails: Motor con el que se revisa el dataset (por defecto, Settings())
+            workers: Procesos para las comprobaciones por lotes (None = GUARDRAIL_BATCH_WORKERS)
+        """
+        self.guardrails = guardrails or GuardrailsEngine(Settings())
+        self.workers = workers
+    
     def validate_example(self, example: Dict) -> tuple[bool, List[str]]:
         """
         Valida un ejemplo del dataset
@@ -80,27 +104,29 @@ class DatasetValidator:
             if metadata["risk_level"] not in self.VALID_RISK_LEVELS:
                 errors.append(f"Nivel de riesgo inválido: {metadata['risk_level']}")
         
-        # 4. Validar contenido
-        for msg in messages:
-            if msg.get("role") == "assistant":
-                content = msg["content"].lower()
-                
-                # Buscar palabras prohibidas
-                for word in self.FORBIDDEN_WORDS:
-                    if word in content:
-                        errors.append(f"Contiene palabra prohibida: '{word}'")
-                
-                # Validar longitud
-                word_count = len(content.split())
-                if word_count > 300:
-                    errors.append(f"Respuesta muy larga: {word_count} palabras (max 300)")
+        # 4. Validar contenido (cada respuesta se normaliza una sola vez)
+        assistant_texts = [
+            normalize_text(msg["content"])
+            for msg in messages
+            if msg.get("role") == "assistant" and isinstance(msg.get("content"), str)
+        ]
+        for normalized in assistant_texts:
+            # Buscar palabras prohibidas
+            for word, folded in self._FORBIDDEN_FOLDED:
+                if folded in normalized.folded:
+                    errors.append(f"Contiene palabra prohibida: '{word}'")
+            
+            # Validar longitud
+            word_count = len(normalized.tokens)
+            if word_count > 300:
+                errors.append(f"Respuesta muy larga: {word_count} palabras (max 300)")
         
         # 5. Validar derivación en crisis
         if metadata.get("risk_level") in ["high", "critical"]:
-            assistant_msgs = [m["content"] for m in messages if m["role"] == "assistant"]
             has_crisis_keywords = any(
-                keyword in " ".join(assistant_msgs).lower()
-                for keyword in ["988", "741741", "911", "emergencia", "profesional"]
+                keyword in normalized.folded
+                for normalized in assistant_texts
+                for keyword in self.CRISIS_REFERRALS
             )
             
             if not has_crisis_keywords:
@@ -121,43 +147,91 @@ class DatasetValidator:
         """
         logger.info(f"🔍 Validando dataset: {dataset_path}")
         
-        valid_count = 0
-        invalid_count = 0
-        all_errors = []
+        errors_by_line: Dict[int, List[str]] = {}
+        declared_risk: Dict[int, Optional[str]] = {}
+        # Textos para los guardrails por lotes: (línea, texto)
+        replies: List[tuple] = []
+        user_messages: List[tuple] = []
         
         with open(dataset_path, 'r', encoding='utf-8') as f:
             for i, line in enumerate(f, 1):
                 try:
                     example = json.loads(line)
                     is_valid, errors = self.validate_example(example)
+                    errors_by_line[i] = errors
                     
-                    if is_valid:
-                        valid_count += 1
-                    else:
-                        invalid_count += 1
-                        all_errors.append({
-                            "line": i,
-                            "errors": errors
-                        })
+                    declared_risk[i] = example.get("metadata", {}).get("risk_level")
+                    for msg in example.get("messages", []):
+                        content = msg.get("content")
+                        if not isinstance(content, str):
+                            continue
+                        if msg.get("role") == "assistant":
+                            replies.append((i, content))
+                        elif msg.get("role") == "user":
+                            user_messages.append((i, content))
                 
                 except json.JSONDecodeError as e:
-                    invalid_count += 1
-                    all_errors.append({
-                        "line": i,
-                        "errors": [f"JSON inválido: {e}"]
-                    })
+                    errors_by_line[i] = [f"JSON inválido: {e}"]
+        
+        guardrail_warnings = self._check_guardrails(errors_by_line, declared_risk, replies, user_messages)
+        
+        all_errors = [
+            {"line": i, "errors": errors}
+            for i, errors in errors_by_line.items()
+            if errors
+        ]
+        invalid_count = len(all_errors)
+        valid_count = len(errors_by_line) - invalid_count
         
         report = {
             "total": valid_count + invalid_count,
             "valid": valid_count,
             "invalid": invalid_count,
-            "errors": all_errors
+            "errors": all_errors,
+            "warnings": guardrail_warnings
         }
         
         logger.info(f"✅ Válidos: {valid_count}")
         logger.info(f"❌ Inválidos: {invalid_count}")
+        if guardrail_warnings:
+            logger.info(f"⚠️  Avisos de guardrails: {len(guardrail_warnings)}")
         
         return report
+    
+    def _check_guardrails(
+        self,
+        errors_by_line: Dict[int, List[str]],
+        declared_risk: Dict[int, Optional[str]],
+        replies: List[tuple],
+        user_messages: List[tuple]
+    ) -> List[Dict]:
+        """
+        Pasa todas las respuestas y mensajes del dataset por los guardrails en dos lotes
+        
+        Las respuestas que violan las reglas de contenido son errores; los
+        mensajes de usuario que los guardrails consideran de riesgo alto
+        cuando la metadata dice otra cosa se devuelven como avisos.
+        """
+        outputs = self.guardrails.check_output_batch([text for _, text in replies], workers=self.workers)
+        for row in (~outputs.is_valid).nonzero()[0]:
+            line = replies[row][0]
+            rules = ", ".join(outputs.violated_rules(row))
+            errors_by_line[line].append(f"Respuesta viola reglas de contenido: {rules}")
+        
+        inputs = self.guardrails.check_input_batch([text for _, text in user_messages], workers=self.workers)
+        warnings = []
+        for row in (~inputs.is_safe).nonzero()[0]:
+            line = user_messages[row][0]
+            declared = declared_risk.get(line)
+            if declared in (RiskLevel.HIGH.value, RiskLevel.CRITICAL.value):
+                continue
+            warnings.append({
+                "line": line,
+                "declared_risk_level": declared,
+                "detected_risk_level": inputs.level(row).value,
+                "rules": inputs.triggered_rules(row)
+            })
+        return warnings
 
 
 class DatasetAnalyzer:
@@ -298,11 +372,13 @@ if __name__ == "__main__":
     parser.add_argument("action", choices=["validate", "analyze", "create-template"])
     parser.add_argument("--input", type=str, help="Archivo de entrada")
     parser.add_argument("--output", type=str, help="Archivo de salida")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Procesos para los guardrails por lotes (por defecto GUARDRAIL_BATCH_WORKERS)")
     
     args = parser.parse_args()
     
     if args.action == "validate":
-        validator = DatasetValidator()
+        validator = DatasetValidator(workers=args.workers)
         report = validator.validate_dataset(args.input)
         
         # Guardar reporte
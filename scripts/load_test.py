@@ -0,0 +1,302 @@
+"""
+Prueba de carga de la API de chat con usuarios simulados (asyncio + httpx)
+
+Cada usuario virtual abre sesiones multi-turno contra /api/chat/message (o
+/api/chat/message/stream con --stream-ratio), espera un tiempo de lectura
+entre turnos y envía mensajes de longitud variable; una fracción de ellos
+son mensajes de crisis (--crisis-ratio), que siguen el camino de emergencia
+sin generación.
+
+Por defecto la aplicación se ejecuta en el mismo proceso (httpx.ASGITransport)
+con el backend stub, así el resultado mide la sobrecarga del servidor
+(sesión, guardrails, render, cola, scheduler) y no la del modelo. En proceso
+ASGITransport entrega el stream SSE completo, así que el tiempo hasta el
+primer token solo es significativo contra un servidor real. Con --url
+se ataca un servidor ya arrancado (p. ej. MODEL_BACKEND=stub uvicorn ...).
+
+Informa de throughput, percentiles de latencia (y del primer token en
+stream), tasa de errores y de rechazos (429/503 con Retry-After).
+
+Uso:
+    python scripts/load_test.py --users 32 --duration 30
+    python scripts/load_test.py --url http://localhost:8000 --users 64 --stream-ratio 0.5
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+
+# Añadir backend al path
+backend_path = Path(__file__).parent.parent / 'backend'
+sys.path.insert(0, str(backend_path))
+
+from app.core.generation_stats import percentile
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+PHRASES = [
+    "últimamente me cuesta dormir",
+    "en el trabajo hay mucha presión",
+    "me siento agobiado con los exámenes",
+    "discutí con mi pareja y no sé cómo arreglarlo",
+    "a veces me noto muy ansioso sin motivo",
+    "quiero aprender técnicas para relajarme",
+    "me cuesta concentrarme en las clases",
+    "echo de menos a mi familia",
+    "no sé cómo poner límites a mis amigos",
+    "siento que no avanzo en nada",
+]
+
+CRISIS_MESSAGES = [
+    "no quiero vivir más",
+    "estoy pensando en suicidarme",
+    "quiero acabar con mi vida",
+    "me voy a hacer daño esta noche",
+]
+
+
+@dataclass
+class LoadProfile:
+    """Comportamiento de los usuarios simulados"""
+    turns_min: int = 2
+    turns_max: int = 8
+    think_time: float = 2.0  # Media (s) de la espera exponencial entre turnos
+    words_mean: float = 25.0  # Longitud media del mensaje (log-normal)
+    words_sigma: float = 0.6
+    crisis_ratio: float = 0.02
+    stream_ratio: float = 0.0
+
+
+@dataclass
+class LoadResults:
+    """Resultados acumulados de todos los usuarios"""
+    latencies: List[float] = field(default_factory=list)
+    first_token: List[float] = field(default_factory=list)
+    statuses: Counter = field(default_factory=Counter)
+    errors: Counter = field(default_factory=Counter)
+    crisis_sent: int = 0
+    crisis_detected: int = 0
+    sessions: int = 0
+
+    @property
+    def requests(self) -> int:
+        return sum(self.statuses.values()) + sum(self.errors.values())
+
+
+def make_message(rng: random.Random, profile: LoadProfile) -> Tuple[str, bool]:
+    """Mensaje del usuario; True si es un mensaje de crisis"""
+    if rng.random() < profile.crisis_ratio:
+        return rng.choice(CRISIS_MESSAGES), True
+    target = max(3, int(rng.lognormvariate(0, profile.words_sigma) * profile.words_mean))
+    words = []
+    while len(words) < target:
+        words.extend(rng.choice(PHRASES).split())
+    return " ".join(words[:target]).capitalize() + ".", False
+
+
+async def send_json(client: httpx.AsyncClient, payload: Dict) -> Tuple[int, Optional[Dict], Optional[float]]:
+    response = await client.post("/api/chat/message", json=payload)
+    body = response.json() if response.status_code == 200 else None
+    return response.status_code, body, None
+
+
+async def send_stream(client: httpx.AsyncClient, payload: Dict) -> Tuple[int, Optional[Dict], Optional[float]]:
+    """POST con SSE; devuelve el evento done y el tiempo hasta el primer token"""
+    start = time.perf_counter()
+    first_token = None
+    done = None
+    async with client.stream("POST", "/api/chat/message/stream", json=payload) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return response.status_code, None, None
+        event = None
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: "):
+                if event == "token" and first_token is None:
+                    first_token = time.perf_counter() - start
+                elif event == "done":
+                    done = json.loads(line[6:])
+                elif event == "error":
+                    raise RuntimeError(json.loads(line[6:])["detail"])
+    return 200, done, first_token
+
+
+async def virtual_user(
+    client: httpx.AsyncClient,
+    profile: LoadProfile,
+    results: LoadResults,
+    deadline: float,
+    seed: int
+):
+    """Sesiones multi-turno hasta que se agota el tiempo"""
+    rng = random.Random(seed)
+    # Arranque escalonado para no sincronizar a todos los usuarios
+    await asyncio.sleep(rng.uniform(0, profile.think_time))
+
+    while time.perf_counter() < deadline:
+        session_id = None
+        results.sessions += 1
+        for _ in range(rng.randint(profile.turns_min, profile.turns_max)):
+            if time.perf_counter() >= deadline:
+                return
+            message, is_crisis = make_message(rng, profile)
+            payload = {"session_id": session_id, "message": message}
+            send = send_stream if rng.random() < profile.stream_ratio else send_json
+
+            start = time.perf_counter()
+            try:
+                status, body, first_token = await send(client, payload)
+            except Exception as e:
+                results.errors[type(e).__name__] += 1
+                continue
+            results.latencies.append(time.perf_counter() - start)
+            results.statuses[status] += 1
+            if first_token is not None:
+                results.first_token.append(first_token)
+
+            if status == 200 and body:
+                session_id = body["session_id"]
+                if is_crisis:
+                    results.crisis_sent += 1
+                    results.crisis_detected += bool(body.get("is_crisis"))
+                    break  # Tras una crisis el usuario no sigue la conversación
+            elif status in (429, 503):
+                # Servidor saturado: pausa antes de reintentar, como el frontend
+                await asyncio.sleep(rng.uniform(0.5, 1.5) * profile.think_time)
+                continue
+
+            await asyncio.sleep(rng.expovariate(1 / profile.think_time) if profile.think_time else 0)
+
+
+@asynccontextmanager
+async def in_process_client(token_delay_ms: float) -> AsyncIterator[httpx.AsyncClient]:
+    """La aplicación real con el backend stub, sin red ni servidor externo"""
+    os.environ["MODEL_BACKEND"] = "stub"
+    os.environ["STUB_TOKEN_DELAY_MS"] = str(token_delay_ms)
+    os.environ.setdefault("ENABLE_METRICS", "false")  # Sin puerto del exportador
+    from app.main import app
+    logging.getLogger("app").setLevel(logging.ERROR)  # Sin un log por petición
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=120) as client:
+            yield client
+
+
+@asynccontextmanager
+async def remote_client(url: str, users: int) -> AsyncIterator[httpx.AsyncClient]:
+    limits = httpx.Limits(max_connections=users, max_keepalive_connections=users)
+    async with httpx.AsyncClient(base_url=url, timeout=120, limits=limits) as client:
+        yield client
+
+
+async def run(args) -> Dict:
+    profile = LoadProfile(
+        turns_min=args.turns_min,
+        turns_max=args.turns_max,
+        think_time=args.think_time,
+        words_mean=args.words_mean,
+        crisis_ratio=args.crisis_ratio,
+        stream_ratio=args.stream_ratio
+    )
+    results = LoadResults()
+    if args.url:
+        client_context = remote_client(args.url, args.users)
+    else:
+        client_context = in_process_client(args.token_delay)
+
+    async with client_context as client:
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(
+            virtual_user(client, profile, results, deadline, args.seed + i)
+            for i in range(args.users)
+        ))
+        elapsed = time.perf_counter() - start
+
+    return report(results, elapsed, args)
+
+
+def _latency_ms(values: List[float]) -> Dict[str, float]:
+    ordered = sorted(values)
+    return {
+        f"p{q}": round(percentile(ordered, q) * 1000, 1) for q in (50, 90, 95, 99)
+    } | {"max": round(ordered[-1] * 1000, 1) if ordered else 0.0}
+
+
+def report(results: LoadResults, elapsed: float, args) -> Dict:
+    total = results.requests
+    ok = results.statuses.get(200, 0)
+    rejected = results.statuses.get(429, 0) + results.statuses.get(503, 0)
+    failed = total - ok - rejected
+    return {
+        "target": args.url or "in-process (stub)",
+        "users": args.users,
+        "duration_sec": round(elapsed, 2),
+        "requests": total,
+        "sessions": results.sessions,
+        "throughput_rps": round(ok / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": _latency_ms(results.latencies),
+        "first_token_ms": _latency_ms(results.first_token) if results.first_token else None,
+        "status_codes": {str(k): v for k, v in sorted(results.statuses.items())},
+        "exceptions": dict(results.errors),
+        "rejected_rate": round(rejected / total, 4) if total else 0.0,
+        "error_rate": round(failed / total, 4) if total else 0.0,
+        "crisis": {"sent": results.crisis_sent, "detected": results.crisis_detected},
+    }
+
+
+def print_report(result: Dict):
+    print(f"\n📊 Prueba de carga: {result['target']}")
+    print(f"   Usuarios: {result['users']}  Duración: {result['duration_sec']}s  "
+          f"Sesiones: {result['sessions']}  Peticiones: {result['requests']}")
+    print(f"   Throughput: {result['throughput_rps']} resp/s")
+    latency = result["latency_ms"]
+    print(f"   Latencia (ms): p50={latency['p50']} p90={latency['p90']} "
+          f"p95={latency['p95']} p99={latency['p99']} max={latency['max']}")
+    if result["first_token_ms"]:
+        first = result["first_token_ms"]
+        print(f"   Primer token (ms): p50={first['p50']} p95={first['p95']} p99={first['p99']}")
+    print(f"   Códigos: {result['status_codes']}  Excepciones: {result['exceptions'] or '-'}")
+    print(f"   Rechazos (429/503): {result['rejected_rate']:.2%}  Errores: {result['error_rate']:.2%}")
+    print(f"   Crisis detectadas: {result['crisis']['detected']}/{result['crisis']['sent']}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Prueba de carga de la API de chat")
+    parser.add_argument("--url", type=str, help="Servidor a probar (por defecto, en proceso con backend stub)")
+    parser.add_argument("--users", type=int, default=16, help="Usuarios concurrentes")
+    parser.add_argument("--duration", type=float, default=30.0, help="Segundos de prueba")
+    parser.add_argument("--turns-min", type=int, default=2)
+    parser.add_argument("--turns-max", type=int, default=8)
+    parser.add_argument("--think-time", type=float, default=2.0, help="Espera media entre turnos (s)")
+    parser.add_argument("--words-mean", type=float, default=25.0, help="Palabras medias por mensaje")
+    parser.add_argument("--crisis-ratio", type=float, default=0.02, help="Fracción de mensajes de crisis")
+    parser.add_argument("--stream-ratio", type=float, default=0.0, help="Fracción de peticiones SSE")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Retardo por paso del stub (ms, en proceso)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, help="Guardar el informe en JSON")
+
+    args = parser.parse_args()
+    result = asyncio.run(run(args))
+    print_report(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"\n📄 Informe guardado en: {args.output}")
@@ -0,0 +1,72 @@
+"""
+Entrena el clasificador de riesgo (segunda etapa de guardrails)
+
+Lee un corpus JSONL ({"text": ..., "label": 0/1}), informa de la
+precisión y recall por validación cruzada al umbral RISK_THRESHOLD y
+guarda los pesos en RISK_MODEL_PATH (.npz), que la API carga al arrancar
+en lugar de entrenar con el corpus semilla.
+
+Uso:
+    python scripts/train_risk_classifier.py
+    python scripts/train_risk_classifier.py --seed-file mi_corpus.jsonl --output modelo.npz
+"""
+import random
+import sys
+from pathlib import Path
+
+# Añadir backend al path
+backend_path = Path(__file__).parent.parent / 'backend'
+sys.path.insert(0, str(backend_path))
+
+from app.core.model_backend import resolve_project_path
+from app.core.risk_classifier import RiskClassifier, load_seed
+from app.config import Settings
+
+
+def cross_validate(texts, labels, threshold: float, folds: int, bits: int, seed: int = 0):
+    """(precisión, recall) de la clase de riesgo con k particiones"""
+    order = list(range(len(texts)))
+    random.Random(seed).shuffle(order)
+    tp = fp = fn = 0
+    for fold in range(folds):
+        held_out = set(order[fold::folds])
+        train = [i for i in order if i not in held_out]
+        model = RiskClassifier.fit([texts[i] for i in train], [labels[i] for i in train], bits=bits)
+        test = sorted(held_out)
+        for i, probability in zip(test, model.predict_many([texts[i] for i in test])):
+            predicted = probability >= threshold
+            tp += predicted and labels[i] == 1
+            fp += predicted and labels[i] == 0
+            fn += not predicted and labels[i] == 1
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    return precision, recall
+
+
+def main(args):
+    settings = Settings()
+    seed_path = Path(args.seed_file) if args.seed_file else resolve_project_path(settings.RISK_SEED_PATH)
+    output = Path(args.output) if args.output else resolve_project_path(settings.RISK_MODEL_PATH)
+
+    texts, labels = load_seed(seed_path)
+    print(f"📚 {len(texts)} ejemplos ({sum(labels)} de riesgo) de {seed_path}")
+
+    precision, recall = cross_validate(texts, labels, settings.RISK_THRESHOLD, args.folds, args.bits)
+    print(f"🎯 Validación cruzada ({args.folds} particiones, umbral {settings.RISK_THRESHOLD}): "
+          f"precisión={precision:.2f} recall={recall:.2f}")
+
+    model = RiskClassifier.fit(texts, labels, bits=args.bits)
+    model.save(output)
+    print(f"💾 Pesos guardados en {output} ({model.weights.nbytes // 1024} KB)")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Entrena el clasificador de riesgo")
+    parser.add_argument("--seed-file", help="Corpus JSONL (por defecto RISK_SEED_PATH)")
+    parser.add_argument("--output", help="Fichero .npz (por defecto RISK_MODEL_PATH)")
+    parser.add_argument("--bits", type=int, default=14, help="log2 del nº de features")
+    parser.add_argument("--folds", type=int, default=5)
+
+    main(parser.parse_args())
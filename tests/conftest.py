@@ -0,0 +1,106 @@
+"""
+Fixtures compartidas: modelo stub determinista para CPU
+"""
+
+import pytest
+from typing import Dict, List, Optional
+
+from app.core.batch_scheduler import BatchDecoder, ContinuousBatchScheduler, GenerationRequest
+from app.core.prompt_cache import PromptCacheEntry
+
+EOS_TOKEN = 0
+
+
+class StubTokenizer:
+    """Tokenizer a nivel de carácter con chat template tipo ChatML"""
+
+    eos_token_ids = {EOS_TOKEN}
+
+    def encode(self, text: str) -> List[int]:
+        return [ord(c) for c in text]
+
+    def decode(self, tokens: List[int]) -> str:
+        return "".join(chr(t) for t in tokens if t != EOS_TOKEN)
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=True):
+        prompt = "".join(
+            f"<|im_start|>{m['role']}\n{m['content']}<|im_end|>\n" for m in messages
+        )
+        if add_generation_prompt:
+            prompt += "<|im_start|>assistant\n"
+        return prompt
+
+
+class StubBatchDecoder(BatchDecoder):
+    """
+    Modelo stub: cada secuencia genera `reply` carácter a carácter y luego EOS
+
+    Registra el tamaño del batch en cada paso y los tokens procesados en
+    cada prefill para verificar el batching y el prompt cache.
+    """
+
+    eos_token_ids = {EOS_TOKEN}
+
+    def __init__(self, reply: str = " Hola, respira hondo<|im_end|> basura"):
+        self.reply = reply
+        self.tokenizer = StubTokenizer()
+        self.pending: Dict[int, List[int]] = {}
+        self.requests: Dict[int, GenerationRequest] = {}
+        self.batch_sizes: List[int] = []
+        self.prefilled: List[int] = []
+        self.prefill_lengths: List[int] = []
+        self.generated: Dict[int, List[int]] = {}
+        self.fail_cached = False
+        self.prefix_builds: List[List[int]] = []
+        self.adapter_history: List[Optional[str]] = []
+        self.fail_adapters = set()
+
+    def reply_for(self, request: GenerationRequest) -> str:
+        return self.reply
+
+    def add(self, seq_id: int, request: GenerationRequest, cached: Optional[PromptCacheEntry] = None):
+        if cached is not None and self.fail_cached:
+            raise ValueError("cache inservible")
+        reuse = cached.reuse_tokens if cached else 0
+        self.prefilled.append(seq_id)
+        self.prefill_lengths.append(len(request.prompt_tokens) - reuse)
+        self.requests[seq_id] = request
+        self.generated[seq_id] = []
+        self.pending[seq_id] = self.tokenizer.encode(self.reply_for(request)) + [EOS_TOKEN]
+
+    def step(self) -> Dict[int, int]:
+        self.batch_sizes.append(len(self.pending))
+        tokens = {seq_id: pending.pop(0) for seq_id, pending in self.pending.items()}
+        for seq_id, token in tokens.items():
+            self.generated[seq_id].append(token)
+        return tokens
+
+    def remove(self, seq_id: int) -> Optional[PromptCacheEntry]:
+        self.pending.pop(seq_id, None)
+        generated = self.generated.pop(seq_id, [])
+        if not generated:
+            return None
+        tokens = self.requests[seq_id].prompt_tokens + generated[:-1]
+        return PromptCacheEntry(tokens=tokens, cache={"seq_id": seq_id}, nbytes=4 * len(tokens))
+
+    def decode(self, tokens: List[int]) -> str:
+        return self.tokenizer.decode(tokens)
+
+    def set_adapter(self, name: Optional[str]):
+        if name in self.fail_adapters:
+            raise ValueError(f"adaptador roto: {name}")
+        self.adapter_history.append(name)
+
+    def build_prefix_cache(self, tokens: List[int]) -> Optional[PromptCacheEntry]:
+        self.prefix_builds.append(list(tokens))
+        return PromptCacheEntry(tokens=list(tokens), cache={"prefix": len(tokens)}, nbytes=4 * len(tokens))
+
+
+@pytest.fixture
+def stub_decoder():
+    return StubBatchDecoder()
+
+
+@pytest.fixture
+def stub_scheduler(stub_decoder):
+    return ContinuousBatchScheduler(stub_decoder, max_batch_size=4)
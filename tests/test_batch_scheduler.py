@@ -0,0 +1,223 @@
+"""
+Tests para el scheduler de batching continuo (modelo stub en CPU)
+"""
+
+import asyncio
+import pytest
+
+from app.core.batch_scheduler import ContinuousBatchScheduler, GenerationRequest
+from app.core.inference_worker import InferenceWorker
+from conftest import StubBatchDecoder, StubTokenizer
+
+
+def make_request(results, deltas=None, **kwargs):
+    """Crea petición que guarda su resultado y fragmentos"""
+    tokens = StubTokenizer().encode("prompt")
+    request = GenerationRequest(prompt_tokens=tokens, **kwargs)
+    request.on_finish = lambda result: results.append((request.request_id, result))
+    if deltas is not None:
+        request.on_delta = deltas.append
+    return request
+
+
+class TestContinuousBatchScheduler:
+    """Tests para ContinuousBatchScheduler"""
+
+    def test_single_request(self, stub_scheduler):
+        """Una petición genera el texto hasta EOS"""
+        results, deltas = [], []
+        stub_scheduler.submit(make_request(results, deltas, stop_strings=["<|im_end|>"]))
+        stub_scheduler.run_until_idle()
+
+        (_, result), = results
+        assert result.text == "Hola, respira hondo"
+        assert result.finish_reason == "stop"
+        assert "".join(deltas) == "Hola, respira hondo"
+
+    def test_concurrent_requests_share_steps(self, stub_decoder, stub_scheduler):
+        """N peticiones concurrentes se decodifican en los mismos pasos"""
+        stub_decoder.reply = "abcdefghij"
+        results = []
+        for _ in range(4):
+            stub_scheduler.submit(make_request(results))
+        stub_scheduler.run_until_idle()
+
+        assert len(results) == 4
+        assert all(r.text == "abcdefghij" for _, r in results)
+        # 10 tokens + EOS por secuencia, en 11 pasos y no en 44
+        assert stub_scheduler.total_steps == 11
+        assert max(stub_decoder.batch_sizes) == 4
+        assert stub_scheduler.get_stats()["avg_batch_size"] == 4.0
+
+    def test_admission_at_token_boundary(self, stub_decoder, stub_scheduler):
+        """Una petición nueva entra en el batch sin esperar a que acabe la anterior"""
+        stub_decoder.reply = "x" * 20
+        results = []
+        stub_scheduler.submit(make_request(results))
+        for _ in range(5):
+            stub_scheduler.step()
+
+        late_deltas = []
+        stub_scheduler.submit(make_request(results, late_deltas))
+        stub_scheduler.step()
+
+        assert len(stub_scheduler.active) == 2
+        assert late_deltas == ["x"]
+        assert not results
+
+    def test_max_batch_size_and_fifo(self, stub_decoder):
+        """No se supera max_batch_size y las peticiones entran en orden"""
+        scheduler = ContinuousBatchScheduler(stub_decoder, max_batch_size=2)
+        stub_decoder.reply = "abc"
+        results = []
+        requests = [make_request(results) for _ in range(5)]
+        for request in requests:
+            scheduler.submit(request)
+        scheduler.run_until_idle()
+
+        assert max(stub_decoder.batch_sizes) == 2
+        assert stub_decoder.prefilled == [r.request_id for r in requests]
+        assert [rid for rid, _ in results] == [r.request_id for r in requests]
+
+    def test_per_request_settings(self, stub_decoder, stub_scheduler):
+        """Cada petición conserva su muestreo, stop strings y max_tokens"""
+        results = []
+        short = make_request(results, max_tokens=5, temperature=0.1)
+        stopped = make_request(results, stop_strings=["respira"], temperature=1.2)
+        stub_scheduler.submit(short)
+        stub_scheduler.submit(stopped)
+        stub_scheduler.run_until_idle()
+
+        by_id = dict(results)
+        assert by_id[short.request_id].finish_reason == "length"
+        assert by_id[short.request_id].generated_tokens == 5
+        assert by_id[short.request_id].text == "Hola"
+        assert by_id[stopped.request_id].finish_reason == "stop"
+        assert by_id[stopped.request_id].text == "Hola,"
+        assert stub_decoder.requests[short.request_id].temperature == 0.1
+        assert stub_decoder.requests[stopped.request_id].temperature == 1.2
+
+    def test_split_stop_string_not_emitted(self, stub_scheduler):
+        """Un stop string partido entre tokens no llega al cliente"""
+        results, deltas = [], []
+        stub_scheduler.submit(make_request(results, deltas, stop_strings=["<|im_end|>"]))
+        stub_scheduler.run_until_idle()
+
+        assert "<" not in "".join(deltas)
+
+    def test_stop_string_halts_decoding(self, stub_decoder, stub_scheduler):
+        """Tras el stop string no se decodifica ningún token más"""
+        results = []
+        stub_decoder.reply = "Hola<|im_end|>" + "x" * 50
+        stub_scheduler.submit(make_request(results, stop_strings=["<|im_end|>"], max_tokens=100))
+        stub_scheduler.run_until_idle()
+
+        (_, result), = results
+        assert result.text == "Hola"
+        assert result.generated_tokens == len("Hola<|im_end|>")
+        assert len(stub_decoder.batch_sizes) == len("Hola<|im_end|>")
+        assert result.tokens_saved == 100 - len("Hola<|im_end|>")
+
+        stats = stub_scheduler.get_stats()
+        assert stats["early_stops"] == 1
+        assert stats["tokens_saved"] == result.tokens_saved
+
+    def test_cancelled_request_retired(self, stub_decoder, stub_scheduler):
+        """Una petición cancelada sale del batch y libera su hueco"""
+        stub_decoder.reply = "x" * 20
+        results = []
+        request = make_request(results)
+        stub_scheduler.submit(request)
+        stub_scheduler.step()
+        request.cancelled = True
+        stub_scheduler.step()
+
+        assert not stub_scheduler.active
+        assert not stub_decoder.pending
+        assert results[0][1].finish_reason == "cancelled"
+
+    def test_decoder_error_fails_requests(self, stub_decoder, stub_scheduler):
+        """Un fallo del modelo termina todas las peticiones con error"""
+        results = []
+        stub_scheduler.submit(make_request(results))
+        stub_scheduler.submit(make_request(results))
+        stub_scheduler.step()
+        stub_scheduler.fail_all(RuntimeError("boom"))
+
+        assert [r.finish_reason for _, r in results] == ["error", "error"]
+        assert not stub_scheduler.has_work()
+
+    def test_live_stats_measure_finished_requests(self, stub_decoder, stub_scheduler):
+        """TTFT, latencia entre tokens y velocidades se miden por petición"""
+        stub_decoder.reply = "abcde"
+        results = []
+        stub_scheduler.submit(make_request(results))
+        stub_scheduler.submit(make_request(results))
+        stub_scheduler.run_until_idle()
+
+        stats = stub_scheduler.live_stats.snapshot()
+        assert stats["requests"] == 2
+        assert stats["prompt_tokens"] == 2 * len("prompt")
+        assert stats["generated_tokens"] == 2 * len("abcde") + 2  # + EOS
+        assert stats["ttft_ms"]["p50"] > 0
+        assert stats["decode_tokens_per_sec"]["mean"] > 0
+
+    def test_live_stats_skip_failed_requests(self, stub_decoder, stub_scheduler):
+        results = []
+        stub_scheduler.submit(make_request(results))
+        stub_scheduler.step()
+        stub_scheduler.fail_all(RuntimeError("boom"))
+
+        assert stub_scheduler.live_stats.snapshot()["requests"] == 0
+
+
+    def test_output_filter_halts_decoding(self, stub_decoder, stub_scheduler):
+        """Con la primera violación la secuencia sale del batch"""
+        results, deltas = [], []
+        stub_decoder.reply = "Hola prescribo" + "x" * 50
+        request = make_request(results, deltas, max_tokens=100)
+        seen = []
+
+        def output_filter(delta):
+            seen.append(delta)
+            return ["forbidden"] if "prescribo" in "".join(seen) else []
+
+        request.output_filter = output_filter
+        stub_scheduler.submit(request)
+        stub_scheduler.run_until_idle()
+
+        (_, result), = results
+        assert result.finish_reason == "filtered"
+        assert result.violated_rules == ["forbidden"]
+        assert "".join(deltas) == "Hola prescrib"
+        assert len(stub_decoder.batch_sizes) == len("Hola prescribo")
+        assert result.tokens_saved == 100 - len("Hola prescribo")
+
+        stats = stub_scheduler.get_stats()
+        assert stats["filtered"] == 1
+        assert stats["early_stops"] == 0
+        assert stats["filtered_tokens_saved"] == result.tokens_saved
+
+
+class TestWorkerBatching:
+    """El worker admite peticiones concurrentes en el mismo batch"""
+
+    def test_concurrent_streams(self, stub_decoder, stub_scheduler):
+        stub_decoder.reply = "respira hondo"
+        worker = InferenceWorker(max_queue_size=8, scheduler=stub_scheduler)
+        worker.start()
+
+        async def scenario():
+            streams = [
+                worker.submit_generation(make_request([], max_tokens=64))
+                for _ in range(4)
+            ]
+            return await asyncio.gather(*(s.read_all() for s in streams))
+
+        try:
+            texts = asyncio.run(scenario())
+        finally:
+            worker.stop()
+
+        assert texts == ["respira hondo"] * 4
+        assert max(stub_decoder.batch_sizes) > 1
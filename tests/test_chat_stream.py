@@ -0,0 +1,317 @@
+"""
+Tests para el streaming de respuestas (ModelManagerMLX + SSE)
+"""
+
+import json
+import pytest
+from types import SimpleNamespace
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import chat
+from app.core import model_manager_mlx
+from app.core.model_manager_mlx import ModelManagerMLX
+from app.core.session_manager import SessionManager
+from app.core.inference_worker import InferenceWorker, QueueFullError
+from app.config import Settings
+from conftest import StubTokenizer
+
+
+def make_stub_stream(segments, consumed=None):
+    """Generador determinista que imita mlx_lm.stream_generate"""
+    def stub_stream_generate(model, tokenizer, prompt, max_tokens, **kwargs):
+        for text in segments[:max_tokens]:
+            if consumed is not None:
+                consumed.append(text)
+            yield SimpleNamespace(text=text)
+    return stub_stream_generate
+
+
+@pytest.fixture
+def stub_manager(monkeypatch, stub_scheduler):
+    monkeypatch.setattr(model_manager_mlx, "make_sampler", lambda **kwargs: None)
+    monkeypatch.setattr(
+        model_manager_mlx,
+        "stream_generate",
+        make_stub_stream([" Hola", ",", " respira", " hondo", "<|im_end|>", " basura"])
+    )
+    manager = ModelManagerMLX(model_path="/nonexistent")
+    manager.model = object()
+    manager.tokenizer = StubTokenizer()
+    manager.scheduler = stub_scheduler
+    manager.is_loaded = True
+    return manager
+
+
+@pytest.fixture
+def session_manager():
+    return SessionManager(Settings(), encode=StubTokenizer().encode)
+
+
+@pytest.fixture
+def inference_worker(stub_scheduler):
+    worker = InferenceWorker(max_queue_size=4, scheduler=stub_scheduler)
+    worker.start()
+    yield worker
+    worker.stop()
+
+
+@pytest.fixture
+def client(stub_manager, session_manager, inference_worker):
+    app = FastAPI()
+    app.include_router(chat.router, prefix="/api/chat")
+    app.dependency_overrides[chat.get_model_manager] = lambda: stub_manager
+    app.dependency_overrides[chat.get_session_manager] = lambda: session_manager
+    app.dependency_overrides[chat.get_inference_worker] = lambda: inference_worker
+    return TestClient(app)
+
+
+def fill_queue(monkeypatch, inference_worker):
+    """La cola se llena entre check_capacity y submit_generation"""
+    def full(request):
+        raise QueueFullError(retry_after=3)
+    monkeypatch.setattr(inference_worker, "submit_generation", full)
+
+
+def parse_sse(body: str):
+    """Convierte el cuerpo SSE en lista de (evento, datos)"""
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+class TestModelManagerStream:
+    """Tests para la API generadora del modelo"""
+
+    def test_stream_yields_deltas(self, stub_manager):
+        """Emite fragmentos sin espacios iniciales y corta en stop string"""
+        deltas = list(stub_manager.generate_stream("prompt", stop_strings=["<|im_end|>"]))
+
+        assert deltas == ["Hola", ",", " respira", " hondo"]
+
+    def test_stream_chat_applies_template(self, stub_manager):
+        """El streaming de chat corta en los stop strings de Qwen"""
+        messages = [{"role": "user", "content": "Hola"}]
+
+        assert "".join(stub_manager.generate_chat_stream(messages)) == "Hola, respira hondo"
+
+    def test_generate_stops_in_decode_loop(self, stub_manager, monkeypatch):
+        """generate() deja de pedir tokens en cuanto aparece el stop string"""
+        consumed = []
+        monkeypatch.setattr(
+            model_manager_mlx,
+            "stream_generate",
+            make_stub_stream(["Hola", "<|im_", "end|>", " basura", " más"], consumed)
+        )
+
+        response = stub_manager.generate("prompt", max_tokens=10, stop_strings=["<|im_end|>"])
+
+        assert response == "Hola"
+        assert consumed == ["Hola", "<|im_", "end|>"]
+        assert stub_manager.get_model_info()["stop_sequences"] == {
+            "early_stops": 1,
+            "tokens_saved": 7,
+        }
+
+    def test_chat_request_marks_system_prefix(self, stub_manager):
+        """La petición indica cuántos tokens son del prompt de sistema"""
+        tokenizer = StubTokenizer()
+        messages = [{"role": "system", "content": "Sistema"}, {"role": "user", "content": "Hola"}]
+
+        request = stub_manager.build_chat_request(messages)
+
+        prefix = tokenizer.apply_chat_template(messages[:1], add_generation_prompt=False)
+        assert request.shared_prefix_len == len(tokenizer.encode(prefix))
+        assert stub_manager.build_chat_request(messages[1:]).shared_prefix_len == 0
+
+    def test_stream_requires_loaded_model(self):
+        """Sin modelo cargado lanza error"""
+        manager = ModelManagerMLX(model_path="/nonexistent")
+
+        with pytest.raises(RuntimeError):
+            list(manager.generate_stream("prompt"))
+
+
+class TestChatMessageEndpoint:
+    """Tests para POST /api/chat/message con batching continuo"""
+
+    def test_send_message(self, client, session_manager):
+        """La respuesta completa se recoge del scheduler"""
+        data = client.post("/api/chat/message", json={"message": "Hola"}).json()
+
+        assert data["response"] == "Hola, respira hondo"
+        assert data["risk_level"] == "low"
+        assert data["prompt_tokens"] > 0
+        history = session_manager.get_conversation_history(data["session_id"])
+        assert history[-1]["content"] == "Hola, respira hondo"
+
+    def test_session_risk_escalates(self, client):
+        """Tres mensajes de riesgo medio seguidos escalan el tercero a HIGH"""
+        message = {"message": "La muerte de mi perro me dejó muy triste"}
+        data = client.post("/api/chat/message", json=message).json()
+        levels = [data["risk_level"]]
+        for _ in range(2):
+            message["session_id"] = data["session_id"]
+            data = client.post("/api/chat/message", json=message).json()
+            levels.append(data["risk_level"])
+
+        assert levels == ["medium", "medium", "high"]
+        assert not data["is_crisis"]
+
+        history = client.get(f"/api/chat/sessions/{data['session_id']}/history").json()
+        assert history["risk"]["messages"] == 3
+        assert history["risk"]["escalations"] == 1
+        assert history["risk"]["score"] == pytest.approx(2.19)
+
+
+    def test_message_over_budget_rejected(self, client, session_manager, stub_decoder):
+        """Un mensaje mayor que el contexto se rechaza con 413 sin tocar el historial"""
+        session_id = client.post("/api/chat/sessions").json()["session_id"]
+
+        response = client.post("/api/chat/message", json={"message": "x" * 5000, "session_id": session_id})
+
+        assert response.status_code == 413
+        assert "demasiado largo" in response.json()["detail"]
+        assert [m["role"] for m in session_manager.get_conversation_history(session_id)] == ["system"]
+        assert session_manager.get_risk(session_id).messages == 0
+        assert stub_decoder.prefilled == []
+
+    def test_guardrails_engine_shared_across_requests(self, client, monkeypatch):
+        """El motor de guardrails no se construye en cada petición"""
+        built = []
+        original_init = chat.GuardrailsEngine.__init__
+
+        def counting_init(self, *args, **kwargs):
+            built.append(self)
+            original_init(self, *args, **kwargs)
+
+        monkeypatch.setattr(chat.GuardrailsEngine, "__init__", counting_init)
+        for _ in range(3):
+            client.post("/api/chat/message", json={"message": "Hola"})
+            client.post("/api/chat/message/stream", json={"message": "Hola"})
+
+        assert len(built) <= 1  # A lo sumo el motor por defecto, creado una vez
+        assert chat.get_guardrails() is chat.get_guardrails()
+
+    def test_queue_full_does_not_keep_user_turn(self, client, session_manager, inference_worker, monkeypatch):
+        """Un 503 no deja el mensaje en el historial: el reintento no lo duplica"""
+        session_id = client.post("/api/chat/message", json={"message": "Hola"}).json()["session_id"]
+        risk_before = session_manager.get_risk(session_id).to_dict()
+        message = {"message": "La muerte de mi perro me dejó muy triste", "session_id": session_id}
+
+        with monkeypatch.context() as m:
+            fill_queue(m, inference_worker)
+            response = client.post("/api/chat/message", json=message)
+
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "3"
+        history = session_manager.get_conversation_history(session_id)
+        assert history[-1]["role"] == "assistant"
+        assert session_manager.get_risk(session_id).to_dict() == risk_before
+
+        client.post("/api/chat/message", json=message)
+        history = session_manager.get_conversation_history(session_id)
+        assert [m["content"] for m in history].count(message["message"]) == 1
+        assert session_manager.render_prompt(session_id).text.count(message["message"]) == 1
+
+class TestChatStreamEndpoint:
+    """Tests para POST /api/chat/message/stream"""
+
+    def test_stream_tokens_and_done(self, client, session_manager):
+        """Emite start, tokens y evento final con risk_level"""
+        response = client.post("/api/chat/message/stream", json={"message": "Hola"})
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+
+        events = parse_sse(response.text)
+        names = [name for name, _ in events]
+        assert names[0] == "start"
+        assert names[-1] == "done"
+        assert names.count("token") > 1
+        deltas = "".join(data["delta"] for name, data in events if name == "token")
+        assert deltas == "Hola, respira hondo"
+
+        done = events[-1][1]
+        assert done["response"] == "Hola, respira hondo"
+        assert done["risk_level"] == "low"
+        assert not done["is_crisis"]
+        assert done["prompt_tokens"] == session_manager.get_stats()["max_prompt_tokens"]
+
+        # La respuesta completa queda guardada en la sesión
+        history = session_manager.get_conversation_history(done["session_id"])
+        assert history[-1]["content"] == "Hola, respira hondo"
+
+    def test_stream_crisis_skips_generation(self, client):
+        """Una crisis crítica devuelve solo la respuesta de emergencia"""
+        response = client.post(
+            "/api/chat/message/stream",
+            json={"message": "Voy a acabar con mi vida"}
+        )
+
+        events = parse_sse(response.text)
+        assert [name for name, _ in events] == ["start", "done"]
+        assert events[-1][1]["is_crisis"]
+        assert "988" in events[-1][1]["emergency_response"]
+
+    def test_stream_filtered_output(self, client, stub_decoder):
+        """Si el post-filtro falla, el evento final trae el fallback"""
+        stub_decoder.reply = "Te prescribo algo"
+
+        events = parse_sse(client.post("/api/chat/message/stream", json={"message": "Hola"}).text)
+        done = events[-1][1]
+
+        assert done["filtered"]
+        assert "Disculpa" in done["response"]
+
+    def test_stream_filter_cancels_decoding(self, client, stub_decoder, session_manager):
+        """El filtro incremental corta la generación en la primera violación"""
+        stub_decoder.reply = "Te prescribo algo" + " bla" * 100
+
+        events = parse_sse(client.post("/api/chat/message/stream", json={"message": "Hola"}).text)
+        deltas = "".join(data["delta"] for name, data in events if name == "token")
+        done = events[-1][1]
+
+        assert done["filtered"]
+        assert "prescribo" not in deltas
+        assert len(stub_decoder.batch_sizes) == len("Te prescribo")
+        history = session_manager.get_conversation_history(done["session_id"])
+        assert history[-1]["content"] == done["response"]
+
+    def test_stream_queue_full_does_not_keep_user_turn(self, client, session_manager, inference_worker, monkeypatch):
+        """Si la cola se llena al encolar, el turno del usuario se retira"""
+        session_id = client.post("/api/chat/sessions").json()["session_id"]
+        fill_queue(monkeypatch, inference_worker)
+
+        response = client.post("/api/chat/message/stream", json={"message": "Hola", "session_id": session_id})
+
+        assert response.status_code == 503
+        assert [m["role"] for m in session_manager.get_conversation_history(session_id)] == ["system"]
+
+    def test_stream_error_does_not_keep_user_turn(self, client, stub_decoder, session_manager):
+        """Un fallo durante la generación emite error y retira el turno sin respuesta"""
+        session_id = client.post("/api/chat/sessions").json()["session_id"]
+
+        def broken_step():
+            raise RuntimeError("decoder caído")
+        stub_decoder.step = broken_step
+
+        events = parse_sse(client.post(
+            "/api/chat/message/stream", json={"message": "Hola", "session_id": session_id}
+        ).text)
+
+        assert events[-1][0] == "error"
+        assert [m["role"] for m in session_manager.get_conversation_history(session_id)] == ["system"]
+        assert session_manager.get_risk(session_id).messages == 0
+
+    def test_stream_message_over_budget_rejected(self, client, session_manager, stub_decoder):
+        """El stream rechaza con 413 un mensaje que no cabe en el contexto"""
+        session_id = client.post("/api/chat/sessions").json()["session_id"]
+
+        response = client.post("/api/chat/message/stream", json={"message": "x" * 5000, "session_id": session_id})
+
+        assert response.status_code == 413
+        assert [m["role"] for m in session_manager.get_conversation_history(session_id)] == ["system"]
+        assert stub_decoder.prefilled == []
@@ -0,0 +1,94 @@
+"""
+Tests para la decodificación incremental y los stop strings
+"""
+
+from app.core.decoding import (
+    IncrementalDetokenizer,
+    SpeculativeStats,
+    StopSequenceMatcher,
+    partial_stop_length,
+)
+
+
+class TestIncrementalDetokenizer:
+    """Tests para IncrementalDetokenizer"""
+
+    def test_holds_incomplete_utf8(self):
+        """Un carácter partido entre tokens no se emite a medias"""
+        raw = "é".encode()
+        detokenizer = IncrementalDetokenizer(
+            lambda tokens: bytes(tokens).decode("utf-8", errors="replace")
+        )
+
+        assert detokenizer.add_token(raw[0]) == ""
+        assert detokenizer.add_token(raw[1]) == "é"
+        assert detokenizer.text == "é"
+
+
+class TestStopSequenceMatcher:
+    """Tests para StopSequenceMatcher"""
+
+    def test_partial_stop_length(self):
+        assert partial_stop_length("Hola <|im", ["<|im_end|>"]) == 4
+        assert partial_stop_length("Hola", ["<|im_end|>"]) == 0
+
+    def test_split_stop_string(self):
+        """El inicio de un stop string se retiene hasta confirmarlo"""
+        matcher = StopSequenceMatcher(["<|im_end|>"])
+
+        assert matcher.feed(" Hola <|im") == "Hola "
+        assert matcher.feed("_end|> basura") == ""
+        assert matcher.stopped
+        assert matcher.output == "Hola "
+        assert matcher.feed("más") == ""
+
+    def test_false_alarm_released(self):
+        """Si no era un stop string, el texto retenido se emite"""
+        matcher = StopSequenceMatcher(["<|im_end|>"])
+
+        assert matcher.feed("a <|i") == "a "
+        assert matcher.feed("ntento") == "<|intento"
+        assert matcher.feed("<") == ""
+        assert matcher.flush() == "<"
+        assert not matcher.stopped
+
+    def test_earliest_stop_wins(self):
+        matcher = StopSequenceMatcher(["FIN", "<|im_end|>"])
+
+        matcher.feed("uno <|im_end|> dos FIN")
+
+        assert matcher.output == "uno "
+
+    def test_without_stop_strings(self):
+        matcher = StopSequenceMatcher()
+
+        assert matcher.feed("  Hola") == "Hola"
+        assert matcher.feed(" <|") == " <|"
+
+
+class TestSpeculativeStats:
+    """Tests para la tasa de aceptación de la decodificación especulativa"""
+
+    def test_rounds_from_draft_flags(self):
+        stats = SpeculativeStats(num_draft_tokens=2)
+        tracker = stats.tracker(max_tokens=10)
+
+        # Ronda 1: acepta 2 de 2; ronda 2: 1 de 2; ronda 3: 0 de 2
+        for from_draft in [True, True, False, True, False, False]:
+            tracker.observe(from_draft)
+
+        data = stats.get_stats()
+        assert data["drafted_tokens"] == 6
+        assert data["accepted_tokens"] == 3
+        assert data["acceptance_rate"] == 0.5
+        assert data["tokens_per_verify"] == 2.0
+
+    def test_last_round_limited_by_max_tokens(self):
+        stats = SpeculativeStats(num_draft_tokens=4)
+        tracker = stats.tracker(max_tokens=3)
+
+        for from_draft in [True, True, True]:
+            tracker.observe(from_draft)
+
+        assert stats.drafted == 3
+        assert stats.get_stats()["acceptance_rate"] == 1.0
@@ -0,0 +1,147 @@
+"""
+Tests para el registro de reglas de guardrails (fichero versionado + recarga)
+"""
+
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from app.core.guardrail_rules import (
+    BUILTIN_CRISIS_PATTERNS,
+    RuleFileError,
+    RuleRegistry,
+    RuleSet,
+    load_rule_file,
+    shared_registry,
+)
+from app.core.guardrails import GuardrailsEngine, RiskLevel
+from app.core.model_backend import resolve_project_path
+from app.config import Settings
+
+
+def write_rules(path, version, keywords=("morir",), patterns=(r"quiero\s+morir",), forbidden=("prescribo",)):
+    path.write_text(json.dumps({
+        "version": version,
+        "crisis": {"keywords": list(keywords), "patterns": list(patterns)},
+        "content": {"forbidden_patterns": list(forbidden)},
+    }))
+    # Fuerza una firma distinta aunque el sistema de ficheros tenga poca resolución
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+@pytest.fixture
+def builtin():
+    return RuleSet.builtin(Settings())
+
+
+class TestRuleFile:
+    """Tests para load_rule_file"""
+
+    def test_shipped_file_matches_builtin_rules(self, builtin):
+        rules = load_rule_file(resolve_project_path(Settings().GUARDRAIL_RULES_PATH))
+
+        assert rules.crisis_keywords == builtin.crisis_keywords
+        assert rules.crisis_patterns == BUILTIN_CRISIS_PATTERNS
+        assert rules.forbidden_patterns == builtin.forbidden_patterns
+
+    def test_missing_version_rejected(self, tmp_path):
+        path = tmp_path / "rules.json"
+        path.write_text(json.dumps({"crisis": {"keywords": ["morir"]}}))
+
+        with pytest.raises(RuleFileError):
+            load_rule_file(path)
+
+    def test_invalid_regex_rejected(self, tmp_path):
+        path = tmp_path / "rules.json"
+        write_rules(path, "2", patterns=["quiero\\s+(morir"])
+
+        with pytest.raises(RuleFileError):
+            load_rule_file(path)
+
+
+class TestRuleRegistry:
+    """Tests para RuleRegistry"""
+
+    def test_falls_back_to_builtin(self, tmp_path, builtin):
+        registry = RuleRegistry(tmp_path / "missing.yaml", builtin)
+
+        assert registry.current() is builtin
+        assert registry.get_stats()["version"] == "builtin"
+
+    def test_hot_reload_swaps_rules(self, tmp_path, builtin):
+        path = tmp_path / "rules.json"
+        write_rules(path, "1")
+        registry = RuleRegistry(path, builtin, reload_interval=0.001)
+        engine = GuardrailsEngine(Settings(), registry)
+
+        assert engine.check_output("Te prescribo esto")[0] is False
+        assert engine.check_output("La dosis de hoy")[0] is True
+
+        first = registry.current()
+        write_rules(path, "2", forbidden=["dosis\\s+de"])
+        registry._next_check = 0
+
+        assert registry.current().version == "2"
+        assert registry.reloads == 1
+        assert engine.check_output("Te prescribo esto")[0] is True
+        assert engine.check_output("La dosis de hoy") == (False, ["forbidden_pattern_0"])
+        # La versión anterior sigue intacta para quien la estuviera usando
+        assert first.forbidden_patterns == ("prescribo",)
+
+    def test_invalid_file_keeps_active_rules(self, tmp_path, builtin):
+        path = tmp_path / "rules.json"
+        write_rules(path, "1")
+        registry = RuleRegistry(path, builtin, reload_interval=0)
+
+        write_rules(path, "2", patterns=["(sin cerrar"])
+
+        assert registry.reload() is False
+        assert registry.current().version == "1"
+        assert registry.errors == 1
+        assert "Patrón inválido" in registry.get_stats()["last_error"]
+
+    def test_watcher_reloads_off_the_request_path(self, tmp_path, builtin):
+        path = tmp_path / "rules.json"
+        write_rules(path, "1")
+        registry = RuleRegistry(path, builtin, reload_interval=0.01)
+        registry.start_watching()
+        try:
+            checked_from = []
+            original_reload = registry.reload
+            registry.reload = lambda force=False: checked_from.append(threading.current_thread()) or original_reload(force)
+
+            write_rules(path, "2")
+            deadline = time.monotonic() + 5
+            while registry.current().version != "2" and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+            assert registry.current().version == "2"
+            assert checked_from
+            assert threading.current_thread() not in checked_from
+            assert registry.get_stats()["watching"] is True
+        finally:
+            registry.stop_watching()
+        assert registry.get_stats()["watching"] is False
+
+    def test_engines_share_compiled_rules(self):
+        config = Settings()
+
+        first = GuardrailsEngine(config)
+        second = GuardrailsEngine(config)
+
+        assert first.registry is second.registry is shared_registry(config)
+        assert first.crisis_detector.rules is second.content_filter.registry.current()
+
+    def test_rules_drive_detection(self, tmp_path, builtin):
+        path = tmp_path / "rules.json"
+        write_rules(path, "1", keywords=["sin salida"], patterns=[])
+        engine = GuardrailsEngine(Settings(ENABLE_RISK_CLASSIFIER=False), RuleRegistry(path, builtin))
+
+        result = engine.check_input("Estoy sin salida")
+
+        assert result.triggered_rules == ["keyword: sin salida"]
+        assert result.risk_level == RiskLevel.MEDIUM
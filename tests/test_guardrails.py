@@ -3,7 +3,10 @@ Tests para el sistema de Guardrails
 """
 
 import pytest
-from app.core.guardrails import CrisisDetector, ContentFilter, GuardrailsEngine, RiskLevel
+from app.core.guardrails import (
+    CrisisDetector, ContentFilter, GuardrailResult, GuardrailsEngine, RiskLevel,
+    RiskTrajectory, StreamingContentFilter
+)
 from app.config import Settings
 
 
@@ -142,7 +145,157 @@ class TestGuardrailsEngine:
         assert len(fallback) > 0
 
 
+class TestStreamingContentFilter:
+    """Tests para el post-filtro incremental"""
+    
+    def test_pattern_split_across_fragments(self, content_filter):
+        """La violación se detecta con el fragmento que la completa"""
+        stream_filter = StreamingContentFilter(content_filter)
+        
+        assert stream_filter.feed("Toma una dos") == []
+        assert stream_filter.feed("is ") == []
+        assert stream_filter.feed("de") == ["forbidden_pattern_4"]
+        # Tras la violación no se sigue evaluando
+        assert stream_filter.feed(" prescribo") == ["forbidden_pattern_4"]
+    
+    def test_same_rules_as_full_check(self, content_filter):
+        response = "Respira hondo. No puedo darte un diagnóstico de nada."
+        stream_filter = StreamingContentFilter(content_filter)
+        
+        for char in response:
+            stream_filter.feed(char)
+        
+        assert stream_filter.violated_rules == content_filter.validate_response(response)[1]
+    
+    def test_lookback_bounds_window(self, content_filter):
+        """Solo se revisan los últimos `lookback` caracteres más lo nuevo"""
+        stream_filter = StreamingContentFilter(content_filter, lookback=4)
+        
+        stream_filter.feed("dosis" + " " * 10)
+        
+        assert stream_filter.feed("de") == []
+        assert len(stream_filter._tail) == 4
+
+
+def turn(level: RiskLevel) -> GuardrailResult:
+    return GuardrailResult(
+        is_safe=True,
+        risk_level=level,
+        triggered_rules=["keyword: morir"] if level != RiskLevel.LOW else [],
+        should_terminate=False
+    )
+
+
+class TestRiskTrajectory:
+    """Tests para el riesgo acumulado de la sesión"""
+    
+    def test_decayed_sum(self):
+        trajectory = RiskTrajectory()
+        
+        trajectory.observe(RiskLevel.MEDIUM, 0.5)
+        trajectory.observe(RiskLevel.HIGH, 0.5)
+        score = trajectory.observe(RiskLevel.LOW, 0.5)
+        
+        assert score == pytest.approx((1.0 * 0.5 + 2.0) * 0.5)
+        assert trajectory.peak == pytest.approx(2.5)
+        assert trajectory.messages == 3
+    
+    def test_repeated_medium_escalates(self, guardrails_engine):
+        trajectory = RiskTrajectory()
+        
+        first = guardrails_engine.check_trajectory(trajectory, turn(RiskLevel.MEDIUM))
+        second = guardrails_engine.check_trajectory(trajectory, turn(RiskLevel.MEDIUM))
+        third = guardrails_engine.check_trajectory(trajectory, turn(RiskLevel.MEDIUM))
+        
+        assert first.risk_level == second.risk_level == RiskLevel.MEDIUM
+        assert third.risk_level == RiskLevel.HIGH
+        assert not third.is_safe and not third.should_terminate
+        assert third.emergency_response is not None
+        assert third.triggered_rules == ["keyword: morir", "trajectory: 2.19"]
+        assert trajectory.escalations == 1
+    
+    def test_spaced_medium_decays(self, guardrails_engine):
+        trajectory = RiskTrajectory()
+        
+        for level in [RiskLevel.MEDIUM, RiskLevel.LOW, RiskLevel.LOW, RiskLevel.MEDIUM, RiskLevel.LOW]:
+            result = guardrails_engine.check_trajectory(trajectory, turn(level))
+            assert result.risk_level == level
+        
+        assert trajectory.escalations == 0
+    
+    def test_high_not_escalated_again(self, guardrails_engine):
+        trajectory = RiskTrajectory(score=5.0)
+        result = turn(RiskLevel.HIGH)
+        
+        assert guardrails_engine.check_trajectory(trajectory, result) is result
+        assert trajectory.escalations == 0
+
+
 # Tests de integración
+BATCH_INPUTS = [
+    "Hola, ¿cómo estás?",
+    "Quiero matarme, no puedo más",
+    "Me corto cuando me siento mal",
+    "Voy a acabar con mi vida",
+    "A veces pienso en morir",
+    "No puedo dormir, estoy muy ansioso todo el tiempo",
+    "Estoy sin esperanza y quiero desaparecer",
+    "",
+]
+
+BATCH_OUTPUTS = [
+    "Creo que tienes depresión clínica",
+    "Te prescribo tomar este medicamento",
+    "La técnica de respiración 4-7-8 puede ayudarte a calmarte",
+    "Toma medicamento y revisa la dosis de la noche",
+    "",
+]
+
+
+class TestBatchAPI:
+    """Tests para check_input_batch / check_output_batch"""
+    
+    def test_input_batch_matches_check_input(self, guardrails_engine):
+        batch = guardrails_engine.check_input_batch(BATCH_INPUTS, workers=1)
+        
+        assert len(batch) == len(BATCH_INPUTS)
+        for row, text in enumerate(BATCH_INPUTS):
+            single = guardrails_engine.check_input(text)
+            assert batch.level(row) == single.risk_level, text
+            assert batch.triggered_rules(row) == single.triggered_rules, text
+            assert bool(batch.is_safe[row]) == single.is_safe
+            assert bool(batch.should_terminate[row]) == single.should_terminate
+        assert sum(batch.counts().values()) == len(BATCH_INPUTS)
+    
+    def test_output_batch_matches_check_output(self, guardrails_engine):
+        batch = guardrails_engine.check_output_batch(BATCH_OUTPUTS, workers=1)
+        
+        for row, response in enumerate(BATCH_OUTPUTS):
+            is_valid, violations = guardrails_engine.check_output(response)
+            assert bool(batch.is_valid[row]) == is_valid, response
+            assert batch.violated_rules(row) == violations, response
+    
+    def test_process_pool_matches_local(self):
+        engine = GuardrailsEngine(Settings(GUARDRAIL_BATCH_PARALLEL_MIN=4))
+        texts = BATCH_INPUTS * 3
+        
+        local = engine.check_input_batch(texts, workers=1)
+        pooled = engine.check_input_batch(texts, workers=2)
+        
+        assert pooled.risk_levels.tolist() == local.risk_levels.tolist()
+        assert pooled.keyword_mask.tobytes() == local.keyword_mask.tobytes()
+        assert pooled.pattern_mask.tobytes() == local.pattern_mask.tobytes()
+        assert [pooled.triggered_rules(i) for i in range(len(texts))] == \
+            [local.triggered_rules(i) for i in range(len(texts))]
+        
+        outputs = engine.check_output_batch(BATCH_OUTPUTS * 2, workers=2)
+        assert outputs.is_valid.tolist() == engine.check_output_batch(BATCH_OUTPUTS * 2, workers=1).is_valid.tolist()
+    
+    def test_empty_batch(self, guardrails_engine):
+        assert len(guardrails_engine.check_input_batch([])) == 0
+        assert len(guardrails_engine.check_output_batch([])) == 0
+
+
 class TestGuardrailsIntegration:
     """Tests de integración del sistema completo"""
     
@@ -0,0 +1,118 @@
+"""
+Tests para el hilo de inferencia con cola acotada
+"""
+
+import asyncio
+import threading
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import chat
+from app.core.inference_worker import InferenceWorker, QueueFullError
+from app.core.session_manager import SessionManager
+from app.config import Settings
+
+
+@pytest.fixture
+def worker():
+    worker = InferenceWorker(max_queue_size=2, retry_after=7)
+    worker.start()
+    yield worker
+    worker.stop()
+
+
+class TestInferenceWorker:
+    """Tests para InferenceWorker"""
+
+    def test_run_returns_result(self, worker):
+        """Ejecuta la llamada en el hilo de inferencia"""
+        async def scenario():
+            return await worker.run(lambda x: (x * 2, threading.current_thread().name), 21)
+
+        result, thread_name = asyncio.run(scenario())
+
+        assert result == 42
+        assert thread_name == "inference-worker"
+
+    def test_run_propagates_errors(self, worker):
+        """Las excepciones del modelo llegan al handler"""
+        def fail():
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError):
+            asyncio.run(worker.run(fail))
+
+    def test_stream_forwards_items(self, worker):
+        """Los elementos de un generador llegan en orden al event loop"""
+        async def scenario():
+            return [item async for item in worker.submit_stream(lambda: iter(["a", "b", "c"]))]
+
+        assert asyncio.run(scenario()) == ["a", "b", "c"]
+
+    def test_event_loop_not_blocked(self, worker):
+        """El event loop sigue atendiendo mientras el modelo genera"""
+        release = threading.Event()
+
+        async def scenario():
+            future = worker.submit(release.wait, 5)
+            # El loop responde aunque la generación siga en curso
+            await asyncio.sleep(0.01)
+            assert not future.done()
+            release.set()
+            return await future
+
+        assert asyncio.run(scenario()) is True
+
+    def test_queue_full_rejects_fast(self, worker):
+        """Con la cola llena se rechaza sin esperar"""
+        release = threading.Event()
+
+        async def scenario():
+            running = worker.submit(release.wait, 5)
+            await asyncio.sleep(0.05)  # el worker toma el primer trabajo
+            pending = [worker.submit(lambda: None) for _ in range(2)]
+
+            with pytest.raises(QueueFullError) as exc_info:
+                worker.submit(lambda: None)
+
+            release.set()
+            await asyncio.gather(running, *pending)
+            return exc_info.value
+
+        error = asyncio.run(scenario())
+
+        assert error.retry_after == 7
+        assert worker.get_stats()["rejected"] == 1
+
+    def test_stats(self, worker):
+        """Expone profundidad de cola y tiempos de espera"""
+        asyncio.run(worker.run(lambda: None))
+        stats = worker.get_stats()
+
+        assert stats["queue_depth"] == 0
+        assert stats["max_queue_size"] == 2
+        assert stats["processed"] == 1
+        assert stats["avg_wait_ms"] >= 0
+
+
+class TestChatQueueFull:
+    """El endpoint de chat responde 503 con Retry-After"""
+
+    def test_send_message_returns_503(self):
+        worker = InferenceWorker(max_queue_size=1, retry_after=3)
+        # Sin hilo arrancado la cola no se vacía
+        worker._queue.put_nowait(object())
+
+        app = FastAPI()
+        app.include_router(chat.router, prefix="/api/chat")
+        app.dependency_overrides[chat.get_model_manager] = lambda: None
+        app.dependency_overrides[chat.get_session_manager] = lambda: SessionManager(Settings())
+        app.dependency_overrides[chat.get_inference_worker] = lambda: worker
+        client = TestClient(app)
+
+        for route in ("/api/chat/message", "/api/chat/message/stream"):
+            response = client.post(route, json={"message": "Hola"})
+
+            assert response.status_code == 503
+            assert response.headers["retry-after"] == "3"
@@ -0,0 +1,212 @@
+"""
+Tests para los adaptadores LoRA (registro LRU, scheduler y API)
+"""
+
+import json
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import adapters, chat
+from app.core.batch_scheduler import ContinuousBatchScheduler, GenerationRequest
+from app.core.inference_worker import InferenceWorker
+from app.core.lora_adapters import AdapterError, LoRAAdapterRegistry
+from app.core.prompt_cache import SessionPromptCache
+from app.core.session_manager import SessionManager
+from app.core.stub_backend import StubModelBackend
+from app.config import Settings
+from conftest import StubTokenizer
+
+
+def make_adapter(root, name, size=16):
+    path = root / name
+    path.mkdir()
+    (path / "adapter_config.json").write_text(json.dumps({
+        "num_layers": 8,
+        "lora_parameters": {"rank": 8, "scale": 20.0, "dropout": 0.0}
+    }))
+    (path / "adapters.safetensors").write_bytes(b"\0" * size)
+
+
+@pytest.fixture
+def lora_dir(tmp_path):
+    for name in ["estudiantes", "estres_laboral", "duelo"]:
+        make_adapter(tmp_path, name)
+    (tmp_path / "incompleto").mkdir()
+    return tmp_path
+
+
+@pytest.fixture
+def registry(lora_dir):
+    loads = []
+
+    def load_weights(path):
+        loads.append(path.parent.name)
+        return {"w": path.parent.name}, path.stat().st_size
+
+    registry = LoRAAdapterRegistry(lora_dir, load_weights, max_resident=2)
+    registry.loads_log = loads
+    return registry
+
+
+class TestLoRAAdapterRegistry:
+    """Tests para LoRAAdapterRegistry"""
+
+    def test_available_lists_complete_adapters(self, registry):
+        assert registry.available() == ["duelo", "estres_laboral", "estudiantes"]
+
+    def test_lru_keeps_recent_adapters(self, registry):
+        registry.get("estudiantes")
+        registry.get("estres_laboral")
+        registry.get("estudiantes")
+        registry.get("duelo")
+
+        assert registry.resident() == ["estudiantes", "duelo"]
+        assert registry.loads_log == ["estudiantes", "estres_laboral", "duelo"]
+        assert registry.get_stats()["evictions"] == 1
+        assert registry.get_stats()["hits"] == 1
+
+    def test_unknown_adapter(self, registry):
+        with pytest.raises(AdapterError):
+            registry.get("incompleto")
+        with pytest.raises(AdapterError):
+            registry.validate("no_existe")
+
+    def test_unload_and_reload(self, registry):
+        registry.get("duelo")
+
+        assert registry.unload("duelo")
+        assert not registry.unload("duelo")
+
+        registry.get("duelo")
+        assert registry.loads_log == ["duelo", "duelo"]
+
+    def test_load_failure(self, lora_dir):
+        def broken(path):
+            raise OSError("disco")
+
+        with pytest.raises(AdapterError):
+            LoRAAdapterRegistry(lora_dir, broken).get("duelo")
+
+
+class TestSchedulerAdapters:
+    """Las secuencias de un batch comparten adaptador"""
+
+    @pytest.fixture
+    def scheduler(self, stub_decoder):
+        return ContinuousBatchScheduler(
+            stub_decoder,
+            max_batch_size=4,
+            prompt_cache=SessionPromptCache(max_bytes=1_000_000)
+        )
+
+    def submit(self, scheduler, results, adapter, session_id=None, prompt="prompt"):
+        request = GenerationRequest(
+            prompt_tokens=StubTokenizer().encode(prompt),
+            stop_strings=["<|im_end|>"],
+            adapter=adapter,
+            session_id=session_id
+        )
+        request.on_finish = lambda result: results.append((adapter, result))
+        scheduler.submit(request)
+        return request
+
+    def test_batches_grouped_by_adapter(self, scheduler, stub_decoder):
+        stub_decoder.reply = "ok<|im_end|>"
+        results = []
+        for adapter in ["estudiantes", "estudiantes", "duelo", None]:
+            self.submit(scheduler, results, adapter)
+
+        scheduler.run_until_idle()
+
+        assert stub_decoder.adapter_history == ["estudiantes", "duelo", None]
+        # Los dos primeros comparten batch; los demás van de uno en uno
+        assert stub_decoder.batch_sizes[0] == 2
+        assert max(stub_decoder.batch_sizes[1:]) <= 2
+        assert [a for a, _ in results] == ["estudiantes", "estudiantes", "duelo", None]
+        assert all(r.text == "ok" for _, r in results)
+        assert scheduler.get_stats()["adapter_switches"] == 3
+
+    def test_failing_adapter_reports_error(self, scheduler, stub_decoder):
+        stub_decoder.reply = "ok<|im_end|>"
+        stub_decoder.fail_adapters = {"roto"}
+        results = []
+        self.submit(scheduler, results, "roto")
+        self.submit(scheduler, results, None)
+
+        scheduler.run_until_idle()
+
+        assert results[0][1].finish_reason == "error"
+        assert results[1][1].text == "ok"
+        assert scheduler.active_adapter is None
+
+    def test_prompt_cache_is_per_adapter(self, scheduler, stub_decoder):
+        stub_decoder.reply = "ok<|im_end|>"
+        results = []
+        for adapter in ["estudiantes", "duelo", "estudiantes"]:
+            self.submit(scheduler, results, adapter, session_id="s1", prompt="prompt largo")
+            scheduler.run_until_idle()
+
+        assert [r.cached_tokens for _, r in results] == [0, 0, len("prompt largo") - 1]
+
+
+class TestAdapterSelectionAPI:
+    """Selección por metadata/sesión y descarga en caliente"""
+
+    @pytest.fixture
+    def backend(self, lora_dir):
+        backend = StubModelBackend(reply="Hola<|im_end|>", lora_path=lora_dir, max_resident_adapters=2)
+        backend.load_model()
+        return backend
+
+    @pytest.fixture
+    def session_manager(self):
+        return SessionManager(Settings())
+
+    @pytest.fixture
+    def client(self, backend, session_manager):
+        worker = InferenceWorker(max_queue_size=4, scheduler=backend.scheduler)
+        worker.start()
+        app = FastAPI()
+        app.include_router(chat.router, prefix="/api/chat")
+        app.include_router(adapters.router, prefix="/api/adapters")
+        app.dependency_overrides[chat.get_model_manager] = lambda: backend
+        app.dependency_overrides[chat.get_session_manager] = lambda: session_manager
+        app.dependency_overrides[chat.get_inference_worker] = lambda: worker
+        app.dependency_overrides[adapters.get_model_manager] = lambda: backend
+        yield TestClient(app)
+        worker.stop()
+
+    def test_metadata_selects_adapter_for_session(self, client, backend):
+        data = client.post(
+            "/api/chat/message",
+            json={"message": "Hola", "metadata": {"adapter": "estudiantes"}}
+        ).json()
+        assert data["response"] == "Hola"
+        assert backend.scheduler.active_adapter == "estudiantes"
+
+        # El siguiente turno de la sesión mantiene el adaptador
+        client.post("/api/chat/message", json={"message": "Otra", "session_id": data["session_id"]})
+        assert backend.scheduler.get_stats()["adapter_switches"] == 1
+
+        listing = client.get("/api/adapters").json()
+        assert listing["active"] == "estudiantes"
+        assert listing["resident"] == ["estudiantes"]
+
+    def test_unknown_adapter_rejected(self, client, session_manager):
+        response = client.post(
+            "/api/chat/message",
+            json={"message": "Hola", "metadata": {"adapter": "no_existe"}}
+        )
+
+        assert response.status_code == 400
+        assert all(
+            s.metadata.get("adapter") is None for s in session_manager.sessions.values()
+        )
+
+    def test_unload_adapter(self, client):
+        client.post("/api/chat/message", json={"message": "Hola", "metadata": {"adapter": "duelo"}})
+
+        assert client.delete("/api/adapters/duelo").status_code == 200
+        assert client.get("/api/adapters").json()["resident"] == []
+        assert client.delete("/api/adapters/duelo").status_code == 404
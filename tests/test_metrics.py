@@ -0,0 +1,115 @@
+"""
+Tests para el exportador Prometheus
+"""
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from prometheus_client import CollectorRegistry
+
+from app.api import chat
+from app.core.inference_worker import InferenceWorker
+from app.core.metrics import Metrics, metrics, rule_family
+from app.core.session_manager import SessionManager
+from app.core.stub_backend import StubModelBackend
+from app.config import Settings
+
+
+@pytest.fixture
+def registry():
+    """Métricas globales sobre un registry aislado; se deshabilitan al terminar"""
+    registry = CollectorRegistry()
+    metrics.configure(True, registry=registry)
+    yield registry
+    metrics.enabled = False
+
+
+class TestMetrics:
+    """Tests para Metrics"""
+
+    @pytest.mark.parametrize("rule,family", [
+        ("keyword: acabar con mi vida", "keyword"),
+        ("pattern: crisis_3", "pattern"),
+        ("forbidden_pattern_2", "forbidden_pattern"),
+    ])
+    def test_rule_family_drops_detail(self, rule, family):
+        assert rule_family(rule) == family
+
+    def test_disabled_is_noop(self):
+        disabled = Metrics()
+        disabled.configure(False)
+
+        disabled.observe_input_check(0.001, "high", ["keyword: morir"])
+        disabled.observe_generation(0.1, 0.2, 10, 5)
+
+        assert disabled.registry is None
+
+    def test_input_check_counters(self):
+        registry = CollectorRegistry()
+        local = Metrics()
+        local.configure(True, registry=registry)
+
+        local.observe_input_check(0.0002, "high", ["keyword: morir", "pattern: crisis_0", "pattern: crisis_4"])
+
+        assert registry.get_sample_value("guardrail_risk_level_total", {"level": "high"}) == 1
+        assert registry.get_sample_value(
+            "guardrail_rule_triggered_total", {"stage": "input", "family": "pattern"}
+        ) == 2
+        assert registry.get_sample_value("guardrail_check_seconds_count", {"stage": "input"}) == 1
+
+    def test_session_gauges_evaluated_on_scrape(self):
+        registry = CollectorRegistry()
+        local = Metrics()
+        local.configure(True, registry=registry)
+        sessions = {}
+
+        local.track_sessions(count=lambda: len(sessions), text_bytes=lambda: 100 * len(sessions))
+        sessions["a"] = sessions["b"] = object()
+
+        assert registry.get_sample_value("sessions_active") == 2
+        assert registry.get_sample_value("sessions_memory_bytes", {"kind": "text"}) == 200
+
+
+class TestChatMetrics:
+    """El request path alimenta las métricas"""
+
+    @pytest.fixture
+    def client(self, registry):
+        backend = StubModelBackend(reply="Respira hondo<|im_end|>")
+        backend.load_model()
+        worker = InferenceWorker(max_queue_size=4, scheduler=backend.scheduler)
+        worker.start()
+        app = FastAPI()
+        app.include_router(chat.router, prefix="/api/chat")
+        app.dependency_overrides[chat.get_model_manager] = lambda: backend
+        app.dependency_overrides[chat.get_session_manager] = lambda: SessionManager(Settings())
+        app.dependency_overrides[chat.get_inference_worker] = lambda: worker
+        app.dependency_overrides[chat.get_summarizer] = lambda: None
+        yield TestClient(app)
+        worker.stop()
+
+    def test_message_records_stages(self, client, registry):
+        response = client.post("/api/chat/message", json={"message": "Hola, estoy bien"})
+
+        assert response.status_code == 200
+        assert registry.get_sample_value("guardrail_risk_level_total", {"level": "low"}) == 1
+        assert registry.get_sample_value("guardrail_check_seconds_count", {"stage": "output"}) == 1
+        assert registry.get_sample_value("inference_queue_wait_seconds_count") == 1
+        assert registry.get_sample_value("generation_prefill_seconds_count") == 1
+        assert registry.get_sample_value("generation_output_tokens_sum") == len("Respira hondo<|im_end|>")
+
+    def test_route_latency_uses_template(self, registry):
+        from app.main import app
+
+        # Sin lifespan no hay session_manager: la ruta falla con 500
+        TestClient(app, raise_server_exceptions=False).get("/api/chat/sessions/abc-123/history")
+
+        samples = [
+            s.labels for metric in registry.collect() for s in metric.samples
+            if s.name == "http_request_duration_seconds_count"
+        ]
+        assert samples == [{
+            "method": "GET",
+            "route": "/api/chat/sessions/{session_id}/history",
+            "status": "500",
+        }]
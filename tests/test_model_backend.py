@@ -0,0 +1,145 @@
+"""
+Tests para la capa de backends de inferencia
+"""
+
+import pytest
+
+from app.config import Settings
+from app.core import llamacpp_backend, model_backend
+from app.core.llamacpp_backend import LlamaCppBackend, find_gguf_file
+from app.core.model_manager_mlx import MLX_LM_MIN_VERSION, batch_generator_api_error
+from app.core.model_backend import create_model_backend, render_chatml, resolve_backend_name
+from app.core.stub_backend import StubModelBackend
+
+
+@pytest.fixture
+def stub_backend():
+    backend = create_model_backend(Settings(MODEL_BACKEND="stub", MAX_BATCH_SIZE=4))
+    assert backend.load_model()
+    return backend
+
+
+class TestBackendSelection:
+    """Tests para la selección de backend desde Settings"""
+
+    def test_explicit_backend(self):
+        assert resolve_backend_name("STUB") == "stub"
+        assert isinstance(create_model_backend(Settings(MODEL_BACKEND="stub")), StubModelBackend)
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            resolve_backend_name("tensorrt")
+
+    def test_auto_picks_installed_backend(self):
+        assert resolve_backend_name("auto") in ("mlx", "llamacpp", "stub")
+
+
+class TestStubBackend:
+    """El backend stub recorre el mismo camino que un modelo real"""
+
+    def test_generate_chat_is_deterministic(self, stub_backend):
+        messages = [{"role": "user", "content": "Hola"}]
+
+        first = stub_backend.generate_chat(messages)
+
+        assert first == stub_backend.generate_chat(messages)
+        assert "<|im_end|>" not in first
+
+    def test_scheduler_request(self, stub_backend):
+        messages = [{"role": "system", "content": "Sistema"}, {"role": "user", "content": "Hola"}]
+        request = stub_backend.build_chat_request(messages, session_id="s1")
+        results = []
+        request.on_finish = results.append
+
+        stub_backend.scheduler.submit(request)
+        stub_backend.scheduler.run_until_idle()
+
+        assert results[0].text == stub_backend.generate_chat(messages)
+        assert results[0].finish_reason == "stop"
+        assert results[0].cached_tokens == len(render_chatml(messages[:1], add_generation_prompt=False))
+        assert "s1" in stub_backend.prompt_cache
+
+    def test_model_info_and_cleanup(self, stub_backend):
+        info = stub_backend.get_model_info()
+        assert info["backend"] == "stub"
+        assert info["performance"]["requests"] == 0
+
+        stub_backend.cleanup()
+
+        assert stub_backend.get_model_info() == {"loaded": False, "backend": "stub"}
+
+
+class TestLlamaCppBackend:
+    """Tests para la selección de GGUF (sin llama-cpp-python)"""
+
+    def test_quantization_picks_file(self, tmp_path):
+        for name in ["qwen2.5-7b-instruct-q8_0.gguf", "qwen2.5-7b-instruct-q4_k_m.gguf", "qwen2.5-7b-instruct-f16.gguf"]:
+            (tmp_path / name).touch()
+
+        assert find_gguf_file(tmp_path, "4bit").name == "qwen2.5-7b-instruct-q4_k_m.gguf"
+        assert find_gguf_file(tmp_path, "8bit").name == "qwen2.5-7b-instruct-q8_0.gguf"
+        assert find_gguf_file(tmp_path, "none").name == "qwen2.5-7b-instruct-f16.gguf"
+
+    def test_missing_quantization(self, tmp_path):
+        (tmp_path / "qwen-q8_0.gguf").touch()
+
+        assert find_gguf_file(tmp_path, "4bit") is None
+        with pytest.raises(ValueError):
+            find_gguf_file(tmp_path, "3bit")
+
+    def test_relative_gguf_path_resolved_from_project_root(self, monkeypatch, tmp_path):
+        root = tmp_path / "proyecto"
+        gguf_dir = root / "models" / "qwen-gguf"
+        gguf_dir.mkdir(parents=True)
+        (gguf_dir / "qwen-q4_k_m.gguf").touch()
+        monkeypatch.setattr(model_backend, "PROJECT_ROOT", root)
+        elsewhere = tmp_path / "backend"
+        elsewhere.mkdir()
+        monkeypatch.chdir(elsewhere)  # p.ej. uvicorn arrancado desde backend/
+
+        backend = create_model_backend(Settings(MODEL_BACKEND="llamacpp", GGUF_MODEL_PATH="./models/qwen-gguf"))
+
+        assert backend.model_path == gguf_dir
+        assert find_gguf_file(backend.model_path, "4bit").name == "qwen-q4_k_m.gguf"
+
+    def test_load_without_library_fails_cleanly(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(llamacpp_backend, "Llama", None)
+        backend = LlamaCppBackend(model_path=str(tmp_path))
+
+        assert not backend.load_model()
+        assert not backend.is_loaded
+
+
+class TestMLXVersionCheck:
+    """Tests para la comprobación de la API de BatchGenerator (sin MLX)"""
+
+    def test_old_batch_generator_rejected(self):
+        class OldBatchGenerator:  # API de mlx-lm 0.28
+            def insert(self, prompts, max_tokens=None):
+                pass
+
+            def next(self):
+                pass
+
+            def remove(self, uids):
+                pass
+
+        error = batch_generator_api_error(OldBatchGenerator)
+
+        assert "next_generated()" in error
+        assert "insert(caches=)" in error
+        assert "remove(return_prompt_caches=)" in error
+        assert f"mlx-lm>={MLX_LM_MIN_VERSION}" in error
+
+    def test_current_batch_generator_accepted(self):
+        class BatchGenerator:
+            def insert(self, prompts, max_tokens=None, caches=None, samplers=None):
+                pass
+
+            def next_generated(self):
+                pass
+
+            def remove(self, uids, return_prompt_caches=False):
+                pass
+
+        assert batch_generator_api_error(BatchGenerator) is None
@@ -0,0 +1,138 @@
+"""
+Tests para el matcher de una sola pasada (Aho-Corasick + regex unidas)
+"""
+
+import random
+import re
+
+import pytest
+
+from app.core.guardrails import ContentFilter, CrisisDetector
+from app.core.multi_match import KeywordAutomaton, RuleMatcher, required_literals
+from app.config import Settings
+
+TEXTS = [
+    "",
+    "Hola, hoy estoy bien",
+    "Quiero matarme, no puedo más",
+    "No quiero vivir, quiero acabar con mi vida",
+    "He pensado en cortarme y hacerme daño",
+    "quiero morirme... quiero morir, voy a suicidarme",
+    "Tengo un plan para matarme y no quiero seguir viviendo",
+    "Te prescribo una dosis de ibuprofeno; toma medicamento",
+    "Tienes depresión, el diagnóstico de ansiedad es claro",
+    "AUTOLESIÓN, MUERTE, DESAPARECER",
+    "suicidarsuicidio",
+]
+
+
+def naive_keywords(keywords, text):
+    return [i for i, k in enumerate(keywords) if k in text]
+
+
+def naive_patterns(patterns, text):
+    return [i for i, p in enumerate(patterns) if re.search(p, text, re.IGNORECASE)]
+
+
+class TestKeywordAutomaton:
+    """Tests para KeywordAutomaton"""
+
+    def test_overlapping_and_nested(self):
+        keywords = ["he", "she", "his", "hers", "suicidar", "suicidarme", "dar"]
+        automaton = KeywordAutomaton(keywords)
+
+        assert automaton.find("ushers") == [0, 1, 3]
+        assert automaton.find("suicidarme") == [4, 5, 6]
+
+    def test_duplicates_and_empty(self):
+        automaton = KeywordAutomaton(["morir", "", "morir"])
+
+        assert automaton.find("no") == [1]
+        assert automaton.find("morir") == [0, 1, 2]
+
+    def test_matches_substring_search(self):
+        rng = random.Random(7)
+        alphabet = "abcñó "
+        keywords = ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 4))) for _ in range(40)]
+        automaton = KeywordAutomaton(keywords)
+
+        for _ in range(300):
+            text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+            assert automaton.find(text) == naive_keywords(keywords, text)
+
+
+class TestRequiredLiterals:
+    """Tests para required_literals"""
+
+    @pytest.mark.parametrize("pattern,literals", [
+        (r"quiero\s+(morir|suicidarme)", ["quiero"]),
+        (r"(cortar|hacer\s+daño|lastimar)me", ["cortar", "hacer", "lastimar"]),
+        (r"(a|b*)c", ["c"]),
+        (r"x{2}y", ["y"]),
+        (r"a*b?", None),
+    ])
+    def test_extracts_mandatory_literal(self, pattern, literals):
+        assert required_literals(pattern, re.IGNORECASE) == literals
+
+
+class TestRuleMatcher:
+    """Tests para RuleMatcher"""
+
+    def test_rules_starting_at_same_position(self):
+        patterns = [r"quiero\s+morir", r"quiero", r"morir(me)?", r"(a)(b)?c", r"\d+"]
+        matcher = RuleMatcher(patterns=patterns)
+
+        assert matcher.match("Quiero morirme") == ([], [0, 1, 2])
+        assert matcher.match("ac 12") == ([], [3, 4])
+        assert matcher.always_patterns == [4]
+
+    def test_case_equivalences_of_ignorecase(self):
+        """İ, ı y ſ encajan con i y s en re.IGNORECASE: el prefiltro no las pierde"""
+        matcher = RuleMatcher(["si"], [r"quiero", r"sı"])
+
+        assert matcher.match("QUİERO") == ([], [0])
+        assert matcher.match("quıero ſı") == ([], [0, 1])
+        assert matcher.match("SI") == ([0], [1])
+
+    def test_matches_per_rule_loops(self):
+        rng = random.Random(3)
+        alphabet = "aeiouqrsİıſSÑñ \u0307"
+        keywords = ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 3))) for _ in range(30)]
+        patterns = [f"{rng.choice(alphabet)}{rng.choice(alphabet)}\\s*({rng.choice(alphabet)}|{rng.choice(alphabet)})"
+                    for _ in range(30)]
+        patterns = [p for p in patterns if p.strip()]
+        matcher = RuleMatcher(keywords, patterns)
+
+        for _ in range(500):
+            text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 25)))
+            assert matcher.match(text) == (
+                naive_keywords(keywords, text.lower()), naive_patterns(patterns, text)
+            )
+
+    @pytest.mark.parametrize("text", TEXTS)
+    def test_same_rules_as_per_pattern_search(self, text):
+        config = Settings()
+        patterns = CrisisDetector(config).crisis_patterns + ContentFilter(config).forbidden_patterns
+
+        assert RuleMatcher(patterns=patterns).match(text)[1] == naive_patterns(patterns, text)
+
+
+class TestGuardrailsParity:
+    """triggered_rules y puntuación idénticos a los bucles por regla"""
+
+    @pytest.mark.parametrize("text", TEXTS)
+    def test_crisis_detector(self, text):
+        # Solo la primera etapa: el clasificador añade su propia regla
+        detector = CrisisDetector(Settings(ENABLE_RISK_CLASSIFIER=False))
+        expected = [f"keyword: {detector.crisis_keywords[i]}"
+                    for i in naive_keywords(detector.crisis_keywords, text.lower())]
+        expected += [f"pattern: crisis_{i}" for i in naive_patterns(detector.crisis_patterns, text)]
+
+        assert detector.detect_crisis(text).triggered_rules == expected
+
+    @pytest.mark.parametrize("text", TEXTS)
+    def test_content_filter(self, text):
+        content_filter = ContentFilter(Settings())
+        expected = [f"forbidden_pattern_{i}" for i in naive_patterns(content_filter.forbidden_patterns, text)]
+
+        assert content_filter.validate_response(text) == (not expected, expected)
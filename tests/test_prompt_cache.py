@@ -0,0 +1,240 @@
+"""
+Tests para el KV-cache por sesión entre turnos
+"""
+
+import pytest
+
+from app.core.batch_scheduler import ContinuousBatchScheduler, GenerationRequest
+from app.core.prompt_cache import (
+    PromptCacheEntry,
+    SessionPromptCache,
+    SharedPrefixCache,
+    common_prefix_length,
+)
+from conftest import StubTokenizer
+
+
+def make_entry(tokens, nbytes=None):
+    return PromptCacheEntry(tokens=tokens, cache=object(), nbytes=nbytes or len(tokens))
+
+
+class TestSessionPromptCache:
+    """Tests para SessionPromptCache"""
+
+    def test_common_prefix_length(self):
+        assert common_prefix_length([1, 2, 3], [1, 2, 4]) == 2
+        assert common_prefix_length([1, 2], [1, 2, 3]) == 2
+        assert common_prefix_length([], [1]) == 0
+
+    def test_take_reuses_prefix(self):
+        """Un prompt que extiende el anterior reutiliza el prefijo"""
+        cache = SessionPromptCache(max_bytes=1000)
+        cache.put("s1", make_entry([1, 2, 3, 4]))
+
+        entry = cache.take("s1", [1, 2, 3, 4, 5, 6])
+
+        assert entry.reuse_tokens == 4
+        assert "s1" not in cache  # en uso hasta que vuelva con put()
+        assert cache.get_stats()["hits"] == 1
+
+    def test_take_keeps_one_token_to_prefill(self):
+        """Aunque el prompt esté entero en cache, queda un token de prefill"""
+        cache = SessionPromptCache(max_bytes=1000)
+        cache.put("s1", make_entry([1, 2, 3]))
+
+        assert cache.take("s1", [1, 2, 3]).reuse_tokens == 2
+
+    def test_miss_falls_back(self):
+        """Sesión desconocida o prefijo distinto: prefill completo"""
+        cache = SessionPromptCache(max_bytes=1000)
+        cache.put("s1", make_entry([9, 9]))
+
+        assert cache.take("unknown", [1, 2]) is None
+        assert cache.take("s1", [1, 2]) is None
+        assert cache.get_stats()["misses"] == 2
+
+    def test_lru_eviction_under_budget(self):
+        """Se desaloja la sesión usada hace más tiempo"""
+        cache = SessionPromptCache(max_bytes=10)
+        cache.put("a", make_entry([1], nbytes=4))
+        cache.put("b", make_entry([2], nbytes=4))
+        cache.put("a", make_entry([1, 1], nbytes=4))  # 'a' pasa a ser la más reciente
+        cache.put("c", make_entry([3], nbytes=4))
+
+        assert "b" not in cache
+        assert "a" in cache and "c" in cache
+        assert cache.total_bytes == 8
+        assert cache.get_stats()["evictions"] == 1
+
+    def test_drop_removes_session_and_adapter_caches(self):
+        """Al expirar la sesión se liberan también sus caches por adaptador"""
+        cache = SessionPromptCache(max_bytes=100)
+        cache.put("s1", make_entry([1], nbytes=4))
+        cache.put("s1@empatia", make_entry([1], nbytes=4))
+        cache.put("s10", make_entry([2], nbytes=4))
+
+        assert cache.drop("s1") == 2
+        assert len(cache) == 1 and "s10" in cache
+        assert cache.total_bytes == 4
+        assert cache.drop("s1") == 0
+
+    def test_entry_over_budget_not_stored(self):
+        cache = SessionPromptCache(max_bytes=10)
+        cache.put("a", make_entry([1], nbytes=11))
+
+        assert len(cache) == 0
+        assert cache.total_bytes == 0
+
+
+class TestSchedulerPromptCache:
+    """El scheduler solo hace prefill de los tokens nuevos de cada turno"""
+
+    @pytest.fixture
+    def scheduler(self, stub_decoder):
+        return ContinuousBatchScheduler(
+            stub_decoder,
+            max_batch_size=4,
+            prompt_cache=SessionPromptCache(max_bytes=1_000_000)
+        )
+
+    def run_turn(self, scheduler, messages):
+        tokenizer = StubTokenizer()
+        prompt = tokenizer.apply_chat_template(messages)
+        results = []
+        request = GenerationRequest(
+            prompt_tokens=tokenizer.encode(prompt),
+            stop_strings=["<|im_end|>"],
+            session_id="s1"
+        )
+        request.on_finish = results.append
+        scheduler.submit(request)
+        scheduler.run_until_idle()
+        return prompt, results[0]
+
+    def test_second_turn_prefills_only_new_message(self, scheduler, stub_decoder):
+        stub_decoder.reply = "Respira.<|im_end|>"
+        messages = [{"role": "system", "content": "Sistema"}, {"role": "user", "content": "Hola"}]
+
+        _, first = self.run_turn(scheduler, messages)
+        assert first.cached_tokens == 0
+
+        messages += [
+            {"role": "assistant", "content": first.text},
+            {"role": "user", "content": "Gracias"},
+        ]
+        prompt, second = self.run_turn(scheduler, messages)
+
+        # Todo lo anterior a la respuesta generada viene del cache
+        assert second.cached_tokens > len(StubTokenizer().apply_chat_template(messages[:2]))
+        assert stub_decoder.prefill_lengths[1] == len(prompt) - second.cached_tokens
+        assert stub_decoder.prefill_lengths[1] < stub_decoder.prefill_lengths[0]
+        assert second.text == "Respira."
+
+    def test_unusable_cache_falls_back_to_full_prefill(self, scheduler, stub_decoder):
+        stub_decoder.reply = "Respira.<|im_end|>"
+        messages = [{"role": "user", "content": "Hola"}]
+        _, first = self.run_turn(scheduler, messages)
+
+        stub_decoder.fail_cached = True
+        messages += [
+            {"role": "assistant", "content": first.text},
+            {"role": "user", "content": "Gracias"},
+        ]
+        prompt, second = self.run_turn(scheduler, messages)
+
+        assert second.cached_tokens == 0
+        assert stub_decoder.prefill_lengths[1] == len(prompt)
+        assert second.text == "Respira."
+
+
+class TestSharedPrefixCache:
+    """Tests para SharedPrefixCache"""
+
+    def test_match_returns_independent_copy(self):
+        cache = SharedPrefixCache()
+        cache.ensure([1, 2, 3], lambda tokens: PromptCacheEntry(tokens, {"kv": []}, nbytes=3))
+
+        entry = cache.match([1, 2, 3, 4], clone=lambda c: {"kv": list(c["kv"])})
+        entry.cache["kv"].append(99)
+
+        assert entry.reuse_tokens == 3
+        assert cache.entry.cache == {"kv": []}
+        assert cache.match([1, 2], clone=dict) is None
+        assert cache.match([9, 2, 3, 4], clone=dict) is None
+
+    def test_rebuilds_only_when_prefix_changes(self):
+        builds = []
+
+        def build(tokens):
+            builds.append(tokens)
+            return PromptCacheEntry(tokens, None, nbytes=len(tokens))
+
+        cache = SharedPrefixCache()
+        cache.ensure([1, 2], build)
+        version = cache.version
+        cache.ensure([1, 2], build)
+        assert len(builds) == 1
+
+        cache.ensure([1, 3], build)
+        assert len(builds) == 2
+        assert cache.version != version
+
+    def test_unsupported_build_not_retried(self):
+        calls = []
+        cache = SharedPrefixCache()
+
+        assert not cache.ensure([1, 2], lambda tokens: calls.append(tokens))
+        assert not cache.ensure([1, 2], lambda tokens: calls.append(tokens))
+        assert len(calls) == 1
+
+
+class TestSchedulerSharedPrefix:
+    """Las sesiones nuevas parten del KV del prompt de sistema"""
+
+    @pytest.fixture
+    def scheduler(self, stub_decoder):
+        return ContinuousBatchScheduler(
+            stub_decoder,
+            max_batch_size=4,
+            prompt_cache=SessionPromptCache(max_bytes=1_000_000),
+            prefix_cache=SharedPrefixCache()
+        )
+
+    def make_request(self, system, user, session_id):
+        tokenizer = StubTokenizer()
+        prefix = tokenizer.encode(tokenizer.apply_chat_template(
+            [{"role": "system", "content": system}], add_generation_prompt=False
+        ))
+        prompt = tokenizer.encode(tokenizer.apply_chat_template([
+            {"role": "system", "content": system},
+            {"role": "user", "content": user},
+        ]))
+        return GenerationRequest(
+            prompt_tokens=prompt,
+            stop_strings=["<|im_end|>"],
+            session_id=session_id,
+            shared_prefix_len=len(prefix)
+        ), len(prefix)
+
+    def test_new_sessions_skip_system_prefill(self, scheduler, stub_decoder):
+        stub_decoder.reply = "Respira.<|im_end|>"
+        results = []
+        for i, user in enumerate(["Hola", "Buenas noches"]):
+            request, prefix_len = self.make_request("Sistema", user, f"s{i}")
+            request.on_finish = results.append
+            scheduler.submit(request)
+        scheduler.run_until_idle()
+
+        assert len(stub_decoder.prefix_builds) == 1
+        assert [r.cached_tokens for r in results] == [prefix_len, prefix_len]
+        assert all(r.text == "Respira." for r in results)
+        assert scheduler.get_stats()["prefix_cache"]["hits"] == 2
+
+    def test_system_prompt_change_rebuilds_prefix(self, scheduler, stub_decoder):
+        for system in ["Sistema", "Sistema", "Otro sistema"]:
+            request, _ = self.make_request(system, "Hola", None)
+            scheduler.submit(request)
+            scheduler.run_until_idle()
+
+        assert len(stub_decoder.prefix_builds) == 2
+        assert scheduler.get_stats()["prefix_cache"]["rebuilds"] == 2
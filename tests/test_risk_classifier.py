@@ -0,0 +1,110 @@
+"""
+Tests para el clasificador de riesgo (segunda etapa de detección de crisis)
+"""
+
+import numpy as np
+import pytest
+
+from app.core.guardrails import CrisisDetector, RiskLevel
+from app.core.risk_classifier import RiskClassifier, hash_ngrams, shared_classifier
+from app.config import Settings
+
+TEXTS = ["quiero morir", "quiero matarme ya", "pienso en la muerte cada noche",
+         "me muero de risa", "la muerte de mi perro", "hoy estoy bien"]
+LABELS = [1, 1, 1, 0, 0, 0]
+
+
+@pytest.fixture(scope="module")
+def classifier():
+    return RiskClassifier.fit(TEXTS, LABELS, bits=10)
+
+
+class TestHashNgrams:
+    """Tests para hash_ngrams"""
+
+    def test_stable_and_in_range(self):
+        first = hash_ngrams("Quiero  MORIR", 10, (2, 4))
+
+        assert np.array_equal(first, hash_ngrams("quiero morir", 10, (2, 4)))
+        assert first.min() >= 0 and first.max() < 1 << 10
+        # " quiero morir " tiene 14 caracteres: 13 + 12 + 11 n-gramas
+        assert first.size == 36
+
+    def test_empty_text(self):
+        assert hash_ngrams("", 10, (5, 6)).size == 0
+
+
+class TestRiskClassifier:
+    """Tests para RiskClassifier"""
+
+    def test_separates_training_examples(self, classifier):
+        probabilities = classifier.predict_many(TEXTS)
+
+        assert (probabilities[:3] > 0.5).all()
+        assert (probabilities[3:] < 0.5).all()
+
+    def test_predict_many_matches_predict(self, classifier):
+        texts = TEXTS + ["", "morir"]
+
+        batch = classifier.predict_many(texts)
+
+        assert batch.shape == (len(texts),)
+        assert np.allclose(batch, [classifier.predict(t) for t in texts], atol=1e-5)
+
+    def test_save_and_load(self, classifier, tmp_path):
+        path = tmp_path / "risk_model.npz"
+        classifier.save(path)
+
+        loaded = RiskClassifier.load(path)
+
+        assert loaded.bits == 10
+        assert np.allclose(loaded.predict_many(TEXTS), classifier.predict_many(TEXTS))
+
+    def test_shared_classifier_trained_from_seed(self):
+        classifier = shared_classifier(Settings())
+
+        assert classifier is shared_classifier(Settings())
+        assert classifier.predict("quiero morir") > classifier.predict("me muero de risa")
+        assert shared_classifier(Settings(ENABLE_RISK_CLASSIFIER=False)) is None
+
+
+class TestCascade:
+    """La segunda etapa solo decide los casos ambiguos"""
+
+    class Recorder:
+        def __init__(self, probability):
+            self.probability = probability
+            self.calls = []
+
+        def predict(self, text, folded=False):
+            assert folded
+            self.calls.append(text)
+            return self.probability
+
+    def test_ambiguous_escalated_above_threshold(self):
+        recorder = self.Recorder(0.9)
+        detector = CrisisDetector(Settings(), classifier=recorder)
+
+        result = detector.detect_crisis("Hoy pienso en morir")
+
+        # Recibe el texto ya normalizado
+        assert recorder.calls == ["hoy pienso en morir"]
+        assert result.risk_level == RiskLevel.HIGH
+        assert result.triggered_rules[-1] == "classifier: 0.90"
+        assert result.emergency_response is not None
+
+    def test_ambiguous_kept_below_threshold(self):
+        detector = CrisisDetector(Settings(), classifier=self.Recorder(0.5))
+
+        result = detector.detect_crisis("Me muero de risa, casi morir de risa")
+
+        assert result.risk_level == RiskLevel.MEDIUM
+        assert not any(rule.startswith("classifier") for rule in result.triggered_rules)
+
+    @pytest.mark.parametrize("text", ["Hola, ¿cómo estás?", "Quiero suicidarme"])
+    def test_clear_cases_skip_classifier(self, text):
+        recorder = self.Recorder(0.9)
+
+        CrisisDetector(Settings(), classifier=recorder).detect_crisis(text)
+
+        assert recorder.calls == []
@@ -4,7 +4,8 @@ Tests para Session Manager
 
 import pytest
 from datetime import datetime, timedelta
-from app.core.session_manager import SessionManager, Session, Message
+from app.core.prompt_cache import PromptCacheEntry, SessionPromptCache
+from app.core.session_manager import SessionManager, Session, Message, MessageTooLongError
 from app.config import Settings
 
 
@@ -145,6 +146,20 @@ class TestSessionManager:
         # Verificar que fue eliminada
         assert session_manager.get_session(session_id) is None
     
+    def test_expired_session_releases_prompt_cache(self, config):
+        """Al expirar una sesión se libera su KV-cache"""
+        prompt_cache = SessionPromptCache(max_bytes=100)
+        manager = SessionManager(config, on_session_removed=prompt_cache.drop)
+        session_id = manager.create_session()
+        prompt_cache.put(session_id, PromptCacheEntry(tokens=[1], cache=None, nbytes=4))
+        prompt_cache.put(f"{session_id}@empatia", PromptCacheEntry(tokens=[1], cache=None, nbytes=4))
+        
+        manager.get_session(session_id).last_activity = datetime.now() - timedelta(seconds=3601)
+        manager.cleanup_expired_sessions()
+        
+        assert len(prompt_cache) == 0
+        assert prompt_cache.total_bytes == 0
+    
     def test_system_prompt_included(self, session_manager):
         """Prompt de sistema se incluye al crear sesión"""
         session_id = session_manager.create_session()
@@ -153,3 +168,188 @@ class TestSessionManager:
         assert len(session.messages) > 0
         assert session.messages[0].role == "system"
         assert "psicoeducación" in session.messages[0].content.lower()
+
+
+class TestContextAssembly:
+    """Tests para el ensamblado de contexto por presupuesto de tokens"""
+    
+    @pytest.fixture
+    def small_manager(self):
+        # Tokenizer de caracteres: el coste es exacto y fácil de calcular
+        config = Settings(MAX_CONTEXT_LENGTH=2000, MAX_TOKENS=200)
+        return SessionManager(config, count_tokens=len)
+    
+    def test_token_count_cached_on_add(self, small_manager):
+        """El recuento de tokens se calcula una vez al añadir el mensaje"""
+        calls = []
+        small_manager.count_tokens = lambda text: calls.append(text) or len(text)
+        session_id = small_manager.create_session()
+        small_manager.add_message(session_id, "user", "Hola")
+        
+        message = small_manager.get_session(session_id).messages[-1]
+        assert message.token_count == len("<|im_start|>user\nHola<|im_end|>\n")
+        
+        small_manager.build_context(session_id)
+        small_manager.build_context(session_id)
+        assert len(calls) == 2  # sistema + usuario
+    
+    def test_short_conversation_fits(self, small_manager):
+        """Una conversación corta entra completa"""
+        session_id = small_manager.create_session()
+        small_manager.add_message(session_id, "user", "Hola")
+        small_manager.add_message(session_id, "assistant", "¡Hola!")
+        small_manager.add_message(session_id, "user", "Estoy nervioso")
+        
+        context = small_manager.build_context(session_id)
+        
+        assert [m["role"] for m in context.messages] == ["system", "user", "assistant", "user"]
+        assert context.dropped == 0
+        assert context.budget == 1800
+        rendered = "".join(
+            f"<|im_start|>{m['role']}\n{m['content']}<|im_end|>\n" for m in context.messages
+        ) + "<|im_start|>assistant\n"
+        assert context.prompt_tokens == len(rendered)
+    
+    def test_fills_newest_first_within_budget(self, small_manager):
+        """Se conservan el sistema y los mensajes más recientes"""
+        session_id = small_manager.create_session()
+        for i in range(40):
+            small_manager.add_message(session_id, "user", f"Mensaje {i:02d} " + "x" * 30)
+        
+        context = small_manager.build_context(session_id)
+        
+        assert context.messages[0]["role"] == "system"
+        assert context.messages[-1]["content"].startswith("Mensaje 39")
+        assert context.dropped > 0
+        assert context.prompt_tokens <= context.budget
+        kept = [int(m["content"].split()[1]) for m in context.messages[1:]]
+        assert kept == list(range(40 - len(kept), 40))
+    
+    def test_latest_message_always_included(self, small_manager):
+        """El último mensaje entra aunque por sí solo exceda el presupuesto"""
+        session_id = small_manager.create_session()
+        small_manager.add_message(session_id, "user", "Hola")
+        small_manager.add_message(session_id, "user", "x" * 5000)
+        
+        context = small_manager.build_context(session_id)
+        
+        assert len(context.messages) == 2
+        assert context.dropped == 1
+        assert context.prompt_tokens > context.budget
+    
+    def test_message_over_budget_rejected(self, small_manager):
+        """Un mensaje que no cabe por sí solo se rechaza antes de ensamblar"""
+        session_id = small_manager.create_session()
+        fits = small_manager.add_message(session_id, "user", "Hola")
+        small_manager.check_message_fits(session_id, fits)
+        
+        too_long = small_manager.add_message(session_id, "user", "x" * 5000)
+        with pytest.raises(MessageTooLongError) as exc_info:
+            small_manager.check_message_fits(session_id, too_long)
+        
+        assert exc_info.value.budget == 1800
+        assert exc_info.value.tokens > 5000
+    
+    def test_stats_report_prompt_cost(self, small_manager):
+        """Las estadísticas registran el coste de cada prompt ensamblado"""
+        session_id = small_manager.create_session()
+        small_manager.add_message(session_id, "user", "Hola")
+        context = small_manager.build_context(session_id)
+        
+        stats = small_manager.get_stats()
+        
+        assert stats["prompts_built"] == 1
+        assert stats["max_prompt_tokens"] == context.prompt_tokens
+        assert stats["truncated_prompts"] == 0
+    
+    def test_format_for_model_respects_budget(self, small_manager):
+        """format_for_model recorta mensajes recientes por tokens"""
+        session_id = small_manager.create_session()
+        for i in range(15):
+            small_manager.add_message(session_id, "user", f"Mensaje {i:02d} " + "x" * 200)
+        
+        formatted = small_manager.format_for_model(session_id)
+        
+        assert len(formatted) <= 1800
+        assert "Mensaje 14" in formatted
+        assert "Mensaje 00" not in formatted
+
+
+class TestIncrementalPrompt:
+    """Tests para el prompt renderizado de forma incremental"""
+    
+    @pytest.fixture
+    def encoded(self):
+        return []
+    
+    @pytest.fixture
+    def char_manager(self, encoded):
+        def encode(text):
+            encoded.append(text)
+            return [ord(c) for c in text]
+        config = Settings(MAX_CONTEXT_LENGTH=100_000, MAX_TOKENS=200)
+        return SessionManager(config, encode=encode)
+    
+    def test_tokens_match_full_render(self, char_manager):
+        """Texto y token ids coinciden con renderizar desde cero"""
+        session_id = char_manager.create_session()
+        for i in range(3):
+            char_manager.add_message(session_id, "user", f"Pregunta {i}")
+            prompt = char_manager.render_prompt(session_id)
+            char_manager.add_message(session_id, "assistant", f"Respuesta {i}")
+        
+        assert prompt.text.endswith("<|im_start|>user\nPregunta 2<|im_end|>\n<|im_start|>assistant\n")
+        assert prompt.tokens == [ord(c) for c in prompt.text]
+        assert prompt.prompt_tokens == len(prompt.text)
+        assert not prompt.rebuilt
+        assert char_manager.format_for_model(session_id).startswith(prompt.text[:-len("<|im_start|>assistant\n")])
+    
+    def test_only_new_messages_are_encoded(self, char_manager, encoded):
+        """Cada turno tokeniza solo los bloques nuevos"""
+        session_id = char_manager.create_session()
+        char_manager.add_message(session_id, "user", "Hola")
+        char_manager.render_prompt(session_id)
+        char_manager.add_message(session_id, "assistant", "¡Hola!")
+        char_manager.add_message(session_id, "user", "Estoy nervioso")
+        
+        encoded.clear()
+        prompt = char_manager.render_prompt(session_id)
+        
+        assert encoded == [
+            "<|im_start|>assistant\n¡Hola!<|im_end|>\n",
+            "<|im_start|>user\nEstoy nervioso<|im_end|>\n",
+        ]
+        assert not prompt.rebuilt
+    
+    def test_discarded_turn_leaves_prompt(self, char_manager):
+        """Un turno retirado tras renderizarse no reaparece en el siguiente prompt"""
+        session_id = char_manager.create_session()
+        pending = char_manager.add_message(session_id, "user", "PRIMER INTENTO")
+        char_manager.render_prompt(session_id)
+        
+        assert char_manager.discard_message(session_id, pending)
+        char_manager.add_message(session_id, "user", "Otra pregunta")
+        prompt = char_manager.render_prompt(session_id)
+        
+        assert "PRIMER INTENTO" not in prompt.text
+        assert prompt.text.endswith("<|im_start|>user\nOtra pregunta<|im_end|>\n<|im_start|>assistant\n")
+        assert prompt.tokens == [ord(c) for c in prompt.text]
+        assert prompt.rebuilt
+    
+    def test_summary_rewrites_prefix(self, char_manager):
+        """Al superar el umbral se reconstruye con resumen y se vuelve a ampliar"""
+        session_id = char_manager.create_session()
+        for i in range(12):
+            char_manager.add_message(session_id, "user", f"Mensaje {i:02d} con ansiedad")
+            prompt = char_manager.render_prompt(session_id, max_context=4, summary_threshold=8)
+        
+        assert prompt.dropped > 0
+        assert "RESUMEN DE CONVERSACIÓN PREVIA" in prompt.text
+        assert "Mensaje 11" in prompt.text
+        assert "Mensaje 00" not in prompt.text
+        assert prompt.tokens == [ord(c) for c in prompt.text]
+        
+        char_manager.add_message(session_id, "user", "Sigo aquí")
+        follow_up = char_manager.render_prompt(session_id, max_context=4, summary_threshold=8)
+        assert not follow_up.rebuilt
+        assert follow_up.text.startswith(prompt.text[:-len("<|im_start|>assistant\n")])
@@ -0,0 +1,144 @@
+"""
+Tests para la persistencia de sesiones (SessionStore)
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.core.guardrails import RiskLevel
+from app.core.session_manager import SessionManager
+from app.core.session_store import MemorySessionStore, SQLiteSessionStore, create_session_store
+from app.config import Settings
+
+
+@pytest.fixture
+def config():
+    return Settings()
+
+
+def open_manager(config, path, **kwargs):
+    return SessionManager(config, store=SQLiteSessionStore(path, **kwargs))
+
+
+def restart(manager, config, path, **kwargs):
+    """Cierra el manager (guardando lo pendiente) y abre otro sobre el mismo fichero"""
+    asyncio.run(manager.cleanup())
+    return open_manager(config, path, **kwargs)
+
+
+class TestSessionStoreFactory:
+    """Tests para create_session_store"""
+
+    def test_memory_is_default(self, config):
+        manager = SessionManager(config)
+
+        assert isinstance(manager.store, MemorySessionStore)
+        assert manager.get_session("desconocida") is None
+
+    def test_unknown_backend_rejected(self):
+        with pytest.raises(ValueError):
+            create_session_store(Settings(SESSION_STORE="redis"))
+
+
+class TestSQLiteSessionStore:
+    """Tests para SQLiteSessionStore"""
+
+    def test_session_survives_restart(self, config, tmp_path):
+        path = tmp_path / "sessions.db"
+        manager = open_manager(config, path)
+        session_id = manager.create_session()
+        manager.add_message(session_id, "user", "Hola, estoy estresado", {"source": "test"})
+        manager.add_message(session_id, "assistant", "Respira conmigo")
+        manager.get_risk(session_id).observe(RiskLevel.MEDIUM, decay=0.7)
+        manager.select_adapter(session_id, {"adapter": "empatia"})
+        manager.set_summary(session_id, "Habla de estrés", covered=2)
+
+        manager = restart(manager, config, path)
+        session = manager.get_session(session_id)
+
+        assert [m.role for m in session.messages] == ["system", "user", "assistant"]
+        assert session.messages[1].content == "Hola, estoy estresado"
+        assert session.messages[1].metadata == {"source": "test"}
+        assert session.messages[1].normalized.folded == "hola, estoy estresado"
+        assert session.metadata["adapter"] == "empatia"
+        assert session.summary.text == "Habla de estrés"
+        assert session.summary.covered == 2
+        assert session.risk.score == pytest.approx(1.0)
+        assert session.archived == 0
+        assert manager.render_prompt(session_id).text.startswith("<|im_start|>system")
+
+    def test_loads_recent_window(self, config, tmp_path):
+        path = tmp_path / "sessions.db"
+        manager = open_manager(config, path)
+        session_id = manager.create_session()
+        for i in range(10):
+            manager.add_message(session_id, "user", f"Mensaje {i}")
+        manager.set_summary(session_id, "Resumen", covered=8)
+
+        manager = restart(manager, config, path, load_window=4)
+        session = manager.get_session(session_id)
+
+        assert session.messages[0].role == "system"
+        assert [m.content for m in session.messages[1:]] == [f"Mensaje {i}" for i in range(6, 10)]
+        assert session.archived == 6
+        assert session.summary.covered == 2  # Relativo a los mensajes cargados
+
+        # Los mensajes nuevos siguen la numeración de los persistidos
+        manager.add_message(session_id, "user", "Mensaje 10")
+        manager = restart(manager, config, path, load_window=4)
+        session = manager.get_session(session_id)
+
+        assert [m.content for m in session.messages[1:]] == [f"Mensaje {i}" for i in range(7, 11)]
+        assert session.summary.covered == 1
+
+    def test_discarded_message_not_restored(self, config, tmp_path):
+        path = tmp_path / "sessions.db"
+        manager = open_manager(config, path)
+        session_id = manager.create_session()
+        pending = manager.add_message(session_id, "user", "Sin respuesta")
+
+        assert manager.discard_message(session_id, pending)
+        manager.add_message(session_id, "user", "Reintento")
+        manager = restart(manager, config, path)
+        session = manager.get_session(session_id)
+
+        assert [m.content for m in session.messages[1:]] == ["Reintento"]
+        assert session.archived == 0
+
+    def test_writes_are_batched(self, config, tmp_path):
+        store = SQLiteSessionStore(tmp_path / "sessions.db", flush_interval=0.5)
+        manager = SessionManager(config, store=store)
+        session_id = manager.create_session()
+        for i in range(50):
+            manager.add_message(session_id, "user", f"Mensaje {i}")
+
+        store.flush()
+
+        assert store.written == 2 * 51  # Mensaje + estado de la sesión
+        assert store.batches < 5
+        assert store.coalesced >= 51 - store.batches  # Un estado por sesión y commit
+        assert store.get_stats()["pending"] == 0
+        store.close()
+
+    def test_expired_sessions_removed(self, config, tmp_path):
+        path = tmp_path / "sessions.db"
+        manager = open_manager(config, path)
+        kept = manager.create_session()
+        expired = manager.create_session()
+        manager.get_session(expired).last_activity = datetime.now() - timedelta(seconds=config.SESSION_TIMEOUT + 1)
+        manager.add_message(kept, "user", "Sigo aquí")
+        manager.store.save_session(manager.get_session(expired))
+
+        manager = restart(manager, config, path)
+
+        assert manager.get_session(expired) is None
+        assert manager.get_session(kept) is not None
+        manager.cleanup_expired_sessions()
+        manager.store.flush()
+        asyncio.run(manager.cleanup())
+
+        store = SQLiteSessionStore(path)
+        assert store.load(expired) is None
+        store.close()
@@ -0,0 +1,95 @@
+"""
+Tests para la decodificación especulativa de ModelManagerMLX (sin MLX)
+"""
+
+import pytest
+from types import SimpleNamespace
+
+from app.core import model_manager_mlx
+from app.core.model_manager_mlx import ModelManagerMLX
+from conftest import StubTokenizer
+
+
+def make_stub_stream(segments, calls):
+    """Imita stream_generate; cada segmento es (texto, from_draft)"""
+    def stub_stream_generate(model, tokenizer, prompt, max_tokens, **kwargs):
+        calls.append(kwargs)
+        for text, from_draft in segments[:max_tokens]:
+            yield SimpleNamespace(text=text, from_draft=from_draft)
+    return stub_stream_generate
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    monkeypatch.setattr(model_manager_mlx, "make_sampler", lambda **kwargs: None)
+    manager = ModelManagerMLX(model_path="/nonexistent", num_draft_tokens=2)
+    manager.model = object()
+    manager.tokenizer = StubTokenizer()
+    manager.is_loaded = True
+    return manager
+
+
+class TestSpeculativeDecoding:
+    """Tests para el modo especulativo y su fallback"""
+
+    def test_draft_model_used_and_measured(self, manager, monkeypatch):
+        calls = []
+        monkeypatch.setattr(model_manager_mlx, "stream_generate", make_stub_stream(
+            [("Hola", True), (",", True), (" respira", False), (" hondo", False)], calls
+        ))
+        manager.draft_model = object()
+
+        assert manager.generate("prompt", max_tokens=10) == "Hola, respira hondo"
+
+        assert calls[0]["draft_model"] is manager.draft_model
+        assert calls[0]["num_draft_tokens"] == 2
+        speculative = manager.get_model_info()["speculative"]
+        assert speculative["enabled"]
+        assert speculative["drafted_tokens"] == 4
+        assert speculative["accepted_tokens"] == 2
+        assert speculative["acceptance_rate"] == 0.5
+
+    def test_without_draft_model(self, manager, monkeypatch):
+        calls = []
+        monkeypatch.setattr(model_manager_mlx, "stream_generate", make_stub_stream(
+            [("Hola", False)], calls
+        ))
+
+        assert manager.generate("prompt") == "Hola"
+
+        assert calls == [{"sampler": None}]
+        assert not manager.get_model_info()["speculative"]["enabled"]
+
+    def test_missing_draft_model_falls_back(self, manager, tmp_path):
+        manager.draft_model_path = tmp_path / "no-existe"
+
+        manager._load_draft_model()
+
+        assert manager.draft_model is None
+
+    def test_vocab_mismatch_falls_back(self, manager, monkeypatch, tmp_path):
+        manager.draft_model_path = tmp_path
+        manager.tokenizer = SimpleNamespace(vocab_size=151_646)
+        monkeypatch.setattr(
+            model_manager_mlx,
+            "load",
+            lambda path: (object(), SimpleNamespace(vocab_size=32_000))
+        )
+
+        manager._load_draft_model()
+
+        assert manager.draft_model is None
+
+    def test_compatible_draft_model_loaded(self, manager, monkeypatch, tmp_path):
+        draft = object()
+        manager.draft_model_path = tmp_path
+        manager.tokenizer = SimpleNamespace(vocab_size=151_646)
+        monkeypatch.setattr(
+            model_manager_mlx,
+            "load",
+            lambda path: (draft, SimpleNamespace(vocab_size=151_646))
+        )
+
+        manager._load_draft_model()
+
+        assert manager.draft_model is draft
@@ -0,0 +1,116 @@
+"""
+Tests para el resumen de sesiones en segundo plano
+"""
+
+import asyncio
+import pytest
+
+from app.core.inference_worker import InferenceWorker, QueueFullError
+from app.core.session_manager import SessionManager
+from app.core.stub_backend import StubModelBackend
+from app.core.summarizer import ConversationSummarizer
+from app.config import Settings
+
+
+@pytest.fixture
+def backend():
+    backend = StubModelBackend(reply="- La persona siente ansiedad por los exámenes<|im_end|>")
+    backend.load_model()
+    return backend
+
+
+@pytest.fixture
+def session_manager(backend):
+    return SessionManager(Settings(), encode=backend.encode)
+
+
+def fill_session(session_manager, turns):
+    session_id = session_manager.create_session()
+    for i in range(turns):
+        session_manager.add_message(session_id, "user", f"Mensaje {i:02d}")
+        session_manager.add_message(session_id, "assistant", f"Respuesta {i:02d}")
+    return session_id
+
+
+class TestBackgroundQueue:
+    """Las peticiones de fondo ceden el paso a las de usuario"""
+
+    def test_user_requests_go_first(self, backend):
+        worker = InferenceWorker(max_queue_size=4, scheduler=backend.scheduler)
+
+        async def scenario():
+            background = worker.submit_background(backend.build_request([1, 2, 3]))
+            worker.submit_generation(backend.build_request([4, 5, 6]))
+            jobs = [worker._next_job() for _ in range(3)]
+            return background, [job for job in jobs if getattr(job, "request", None)]
+
+        background, jobs = asyncio.run(scenario())
+
+        assert jobs[0].request.prompt_tokens == [4, 5, 6]
+        assert jobs[1] is background._job
+
+    def test_background_queue_is_bounded(self, backend):
+        worker = InferenceWorker(max_queue_size=4, scheduler=backend.scheduler, max_background=1)
+
+        async def scenario():
+            worker.submit_background(backend.build_request([1]))
+            with pytest.raises(QueueFullError):
+                worker.submit_background(backend.build_request([2]))
+
+        asyncio.run(scenario())
+        assert worker.get_stats()["background_depth"] == 1
+
+
+class TestConversationSummarizer:
+    """Resumen incremental con el modelo stub"""
+
+    @pytest.fixture
+    def worker(self, backend):
+        worker = InferenceWorker(max_queue_size=4, scheduler=backend.scheduler)
+        worker.start()
+        yield worker
+        worker.stop()
+
+    @pytest.fixture
+    def summarizer(self, session_manager, backend, worker):
+        return ConversationSummarizer(session_manager, backend, worker, trigger=6, keep_recent=4)
+
+    def run_summary(self, summarizer, session_id):
+        async def scenario():
+            scheduled = summarizer.schedule(session_id)
+            await asyncio.gather(*summarizer._tasks)
+            return scheduled
+        return asyncio.run(scenario())
+
+    def test_short_session_not_summarized(self, summarizer, session_manager):
+        session_id = fill_session(session_manager, 4)
+
+        assert not self.run_summary(summarizer, session_id)
+        assert session_manager.get_session(session_id).summary is None
+
+    def test_summary_stored_and_used_in_prompt(self, summarizer, session_manager):
+        session_id = fill_session(session_manager, 6)
+
+        assert self.run_summary(summarizer, session_id)
+
+        summary = session_manager.get_session(session_id).summary
+        assert summary.text == "- La persona siente ansiedad por los exámenes"
+        assert summary.covered == 8
+        prompt = session_manager.render_prompt(session_id)
+        assert summary.text in prompt.text
+        assert "Mensaje 03" not in prompt.text
+        assert "Mensaje 04" in prompt.text
+        assert prompt.tokens == session_manager.encode(prompt.text)
+        assert summarizer.get_stats()["completed"] == 1
+
+    def test_summary_is_incremental(self, summarizer, session_manager):
+        session_id = fill_session(session_manager, 6)
+        self.run_summary(summarizer, session_id)
+        for i in range(6, 9):
+            session_manager.add_message(session_id, "user", f"Mensaje {i:02d}")
+            session_manager.add_message(session_id, "assistant", f"Respuesta {i:02d}")
+
+        assert self.run_summary(summarizer, session_id)
+
+        assert session_manager.get_session(session_id).summary.covered == 14
+        assert summarizer.get_stats()["messages_folded"] == 14
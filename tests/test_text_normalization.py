@@ -0,0 +1,97 @@
+"""
+Tests para el texto normalizado compartido (guardrails, resúmenes, dataset)
+"""
+
+import pytest
+
+from app.core.guardrails import CrisisDetector, RiskLevel
+from app.core.session_manager import Message, SessionManager
+from app.core.text_normalization import fold_text, normalize_text, strip_accents
+from app.config import Settings
+
+
+class TestNormalizeText:
+    """Tests para normalize_text"""
+
+    def test_folds_case_accents_and_whitespace(self):
+        normalized = normalize_text("  Me siento  FATAL,\n\tquiero   desaparecer… AUTOLESIÓN ")
+
+        assert normalized.folded == "me siento fatal, quiero desaparecer… autolesion"
+        assert normalized.tokens == ("me", "siento", "fatal", "quiero", "desaparecer", "autolesion")
+
+    @pytest.mark.parametrize("text,expected", [
+        ("pingüino", "pinguino"),
+        ("Año Ñandú", "Año Ñandu"),
+        ("canción", "cancion"),
+        ("ño", "ño"),
+    ])
+    def test_strip_accents_keeps_enye(self, text, expected):
+        assert strip_accents(text) == expected
+
+    def test_idempotent(self):
+        folded = fold_text("Estrés  y ANSIEDAD")
+
+        assert fold_text(folded) == folded
+
+
+class TestMessageNormalization:
+    """El texto se normaliza una vez, al crear el mensaje"""
+
+    def test_computed_on_creation(self):
+        msg = Message(role="user", content="Tengo ESTRÉS")
+
+        assert msg.normalized.folded == "tengo estres"
+
+    def test_session_reuses_precomputed(self, monkeypatch):
+        manager = SessionManager(Settings())
+        session_id = manager.create_session()
+        normalized = normalize_text("Hola")
+
+        calls = []
+        monkeypatch.setattr(
+            "app.core.session_manager.normalize_text",
+            lambda text: calls.append(text) or normalize_text(text)
+        )
+        manager.add_message(session_id, "user", "Hola", normalized=normalized)
+
+        assert manager.get_session(session_id).messages[-1].normalized is normalized
+        assert calls == []
+
+    def test_summary_ignores_accents(self):
+        manager = SessionManager(Settings())
+        messages = [
+            Message(role="user", content="Estoy con mucho estres"),
+            Message(role="user", content="Me siento DEPRIMIDO"),
+        ]
+
+        summary = manager._generate_summary(messages)
+
+        assert "estrés" in summary
+        assert "tristeza" in summary
+
+
+class TestGuardrailsOnNormalizedText:
+    """Los guardrails comparan con el texto normalizado"""
+
+    @pytest.fixture
+    def detector(self):
+        return CrisisDetector(Settings(ENABLE_RISK_CLASSIFIER=False))
+
+    def test_keyword_without_accent(self, detector):
+        result = detector.detect_crisis("pienso en la autolesion")
+
+        assert result.triggered_rules == ["keyword: autolesión"]
+        assert result.risk_level == RiskLevel.MEDIUM
+
+    def test_pattern_with_extra_whitespace(self, detector):
+        result = detector.detect_crisis("Quiero    MORIR")
+
+        assert "pattern: crisis_0" in result.triggered_rules
+
+    def test_uses_precomputed_normalization(self, detector):
+        normalized = normalize_text("quiero suicidarme")
+
+        # El texto original no se vuelve a analizar
+        result = detector.detect_crisis("texto ignorado", normalized)
+
+        assert result.risk_level == RiskLevel.CRITICAL
@@ -0,0 +1,122 @@
+"""
+Tests para Server-Timing y el profiler por muestreo
+"""
+
+import contextvars
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api import chat
+from app.core.inference_worker import InferenceWorker
+from app.core.profiler import SamplingProfiler
+from app.core.session_manager import SessionManager
+from app.core.stub_backend import StubModelBackend
+from app.core.tracing import RequestTrace, current_trace, span, start_trace, traced
+from app.config import Settings
+
+
+class TestRequestTrace:
+    """Tests para RequestTrace y span"""
+
+    def test_span_without_trace_is_noop(self):
+        with span("render"):
+            pass
+
+        assert current_trace() is None
+
+    def test_spans_accumulate_by_name(self):
+        @traced("session")
+        def touch():
+            return "ok"
+
+        def run():
+            trace = start_trace()
+            assert touch() == "ok"
+            touch()
+            with span("render"):
+                pass
+            return trace
+
+        # Contexto aislado para no dejar el trace activo en otros tests
+        spans = contextvars.copy_context().run(run).spans
+
+        assert list(spans) == ["session", "render"]
+        assert spans["session"] >= 0
+
+    def test_server_timing_format(self):
+        trace = RequestTrace()
+        trace.add("prefill", 0.0125)
+        trace.add("prefill", 0.0025)
+
+        header = trace.server_timing(total=False)
+
+        assert header == "prefill;dur=15.00"
+
+
+class TestSamplingProfiler:
+    """Tests para SamplingProfiler"""
+
+    def test_samples_one_in_n(self, tmp_path):
+        profiler = SamplingProfiler(3, str(tmp_path), interval=0.001)
+
+        sessions = [profiler.maybe_start() for _ in range(6)]
+
+        sampled = [s for s in sessions if s is not None]
+        assert [s is not None for s in sessions] == [False, False, True, False, False, True]
+        for s in sampled:
+            s.stop()
+
+    def test_writes_folded_stacks(self, tmp_path):
+        profile = SamplingProfiler(1, str(tmp_path), interval=0.001).maybe_start()
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            sum(range(1000))
+
+        path = profile.stop("POST-/api/chat/message")
+
+        assert path.name.endswith("-POST-_api_chat_message.folded")
+        stack, count = path.read_text().splitlines()[0].rsplit(" ", 1)
+        assert int(count) >= 1
+        assert ";" in stack
+
+    def test_rejects_invalid_rate(self, tmp_path):
+        with pytest.raises(ValueError):
+            SamplingProfiler(0, str(tmp_path))
+
+
+class TestServerTimingHeader:
+    """El middleware devuelve las fases del hot path"""
+
+    @pytest.fixture
+    def client(self):
+        from app.main import app
+
+        backend = StubModelBackend(reply="Respira hondo<|im_end|>")
+        backend.load_model()
+        worker = InferenceWorker(max_queue_size=4, scheduler=backend.scheduler)
+        worker.start()
+        app.dependency_overrides[chat.get_model_manager] = lambda: backend
+        app.dependency_overrides[chat.get_session_manager] = lambda: SessionManager(Settings())
+        app.dependency_overrides[chat.get_inference_worker] = lambda: worker
+        app.dependency_overrides[chat.get_summarizer] = lambda: None
+        yield TestClient(app)
+        app.dependency_overrides.clear()
+        worker.stop()
+
+    def test_message_reports_phases(self, client):
+        response = client.post("/api/chat/message", json={"message": "Hola, estoy bien"})
+
+        assert response.status_code == 200
+        phases = [entry.split(";")[0] for entry in response.headers["Server-Timing"].split(", ")]
+        for phase in ("session", "guardrails_in", "render", "tokenize", "queue", "prefill",
+                      "decode", "guardrails_out", "total"):
+            assert phase in phases
+
+    def test_stream_reports_phases_before_generation(self, client):
+        response = client.post("/api/chat/message/stream", json={"message": "Hola"})
+
+        phases = [entry.split(";")[0] for entry in response.headers["Server-Timing"].split(", ")]
+        assert "guardrails_in" in phases
+        assert "prefill" not in phases